@@ -1,79 +1,138 @@
 import os
-import logging
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
-from sqlalchemy.orm import DeclarativeBase
+from flask import Flask, render_template
 from werkzeug.middleware.proxy_fix import ProxyFix
+from config import Config
+from extensions import db, login_manager
+from replicas import read_only
+
+
+def create_app(config=None):
+    """Create and configure the Flask application.
+
+    `config` may be a config class/object or a dict of overrides applied on
+    top of `Config`. The schema is not touched here; run `flask --app app migrate`.
+    """
+    from sqlite_profile import engine_options, configure_sqlite_engine
+    from replicas import init_replicas
+    from credentials import init_credentials
+    from profiling import init_profiling
+    from metrics import init_metrics
+    from migrations import register_commands
+    from recommender import init_recommender
+    from exports import init_exports
+    from archive import init_archive
+    from bonus import init_bonus
+    from counters import init_counters
+    from ledger import init_ledger
+    from facets import init_facets
+    from typeahead import init_typeahead
+    from dream_import import init_dream_import
+    from logging_setup import init_logging
+    from cache import init_cache
+    from http_cache import init_http_cache
+    from template_cache import init_template_cache
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config))
+
+    # Configure logging
+    init_logging(app)
+
+    if app.config['PROXY_X_FOR'] or app.config['PROXY_X_PROTO'] or app.config['PROXY_X_HOST']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_X_FOR'],
+                                x_proto=app.config['PROXY_X_PROTO'], x_host=app.config['PROXY_X_HOST'])
+
+    # Initialize extensions
+    db.init_app(app)
+    login_manager.init_app(app)
+
+    # Apply WAL and connection pragmas when running on SQLite
+    with app.app_context():
+        for engine in db.engines.values():
+            configure_sqlite_engine(engine, app.config)
+    init_replicas(app)
+    init_profiling(app)
+    init_metrics(app, db)
+    cache = init_cache(app)
+    init_credentials(app, cache)
+    init_http_cache(app)
+    init_template_cache(app, cache)
+
+    # Register blueprints
+    from routes.auth_routes import auth_bp
+    from routes.marketplace_routes import marketplace_bp
+    from routes.profile_routes import profile_bp
+    from routes.tag_routes import tag_bp
+    from routes.api_routes import api_bp
+    from routes.cart_routes import cart_bp
+
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(marketplace_bp, url_prefix='/marketplace')
+    app.register_blueprint(profile_bp, url_prefix='/profile')
+    app.register_blueprint(tag_bp, url_prefix='/tags')
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+    app.register_blueprint(cart_bp, url_prefix='/cart')
+
+    # Main routes
+    app.add_url_rule('/', 'home', home)
+    app.add_url_rule('/leaderboard', 'leaderboard', leaderboard)
+    app.context_processor(inject_dream_utils)
+
+    register_commands(app)
+    init_recommender(app)
+    init_exports(app)
+    init_archive(app)
+    init_bonus(app)
+    init_counters(app)
+    init_ledger(app)
+    init_facets(app)
+    init_typeahead(app)
+    init_dream_import(app)
+
+    # Create upload directory if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    return app
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
-class Base(DeclarativeBase):
-    pass
-
-db = SQLAlchemy(model_class=Base)
-
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "neural-dreams-secret-key")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///neural_dreams.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Configure upload folder
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Initialize extensions
-db.init_app(app)
-
-# Initialize Flask-Login
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'auth.login'  # type: ignore
-login_manager.login_message = 'Please log in to access this dreamy marketplace.'
-login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
     from models import User
     return User.query.get(int(user_id))
 
-# Register blueprints
-from routes.auth_routes import auth_bp
-from routes.marketplace_routes import marketplace_bp
-from routes.profile_routes import profile_bp
-from routes.tag_routes import tag_bp
-
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(marketplace_bp, url_prefix='/marketplace')
-app.register_blueprint(profile_bp, url_prefix='/profile')
-app.register_blueprint(tag_bp, url_prefix='/tags')
-
-# Main routes
-from flask import render_template, redirect, url_for
-from models import Dream, User
-from dream_utils import get_dream_of_the_week
 
-@app.route('/')
+@read_only
 def home():
-    dream_of_week = get_dream_of_the_week()
-    recent_dreams = Dream.query.order_by(Dream.created_at.desc()).limit(6).all()
-    top_sellers = User.query.join(Dream).group_by(User.id).order_by(db.func.avg(Dream.average_rating).desc()).limit(5).all()
-    
-    return render_template('home.html', 
+    from datetime import datetime, timedelta
+    from sqlalchemy import select
+    from models import Dream, User
+    from async_db import gather
+    from dream_utils import card_columns, dream_of_the_week_query
+    # Three independent queries: concurrent on the ASGI read path
+    week, recent, sellers = gather(
+        dream_of_the_week_query(datetime.utcnow() - timedelta(days=7)),
+        select(Dream).options(card_columns()).order_by(Dream.created_at.desc()).limit(6),
+        select(User, db.func.avg(Dream.average_rating)).join(Dream, Dream.author_id == User.id)
+            .group_by(User.id).order_by(db.func.avg(Dream.average_rating).desc()).limit(5),
+    )
+    dream_of_week = week.scalars().first()
+    if not dream_of_week:
+        dream_of_week = gather(dream_of_the_week_query())[0].scalars().first()
+
+    return render_template('home.html',
                          dream_of_week=dream_of_week,
-                         recent_dreams=recent_dreams,
-                         top_sellers=top_sellers)
+                         recent_dreams=recent.scalars().all(),
+                         top_sellers=sellers.all())
 
-@app.route('/leaderboard')
+
+@read_only
 def leaderboard():
+    from models import Dream, User
     # Get top sellers by average rating
     top_sellers = db.session.query(User, db.func.avg(Dream.average_rating).label('avg_rating'), db.func.count(Dream.id).label('dream_count')) \
         .join(Dream) \
@@ -81,20 +140,14 @@ def leaderboard():
         .having(db.func.count(Dream.id) > 0) \
         .order_by(db.func.avg(Dream.average_rating).desc()) \
         .limit(20).all()
-    
+
     return render_template('leaderboard.html', top_sellers=top_sellers)
 
-# Create upload directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-@app.context_processor
 def inject_dream_utils():
     from dream_utils import get_category_icon, get_user_tag_display
     return dict(get_category_icon=get_category_icon, get_user_tag_display=get_user_tag_display)
 
-with app.app_context():
-    import models
-    db.create_all()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,204 @@
+"""
+Purchase and rating archival for Neural Dreams Inc.
+Rows older than ARCHIVE_AFTER_DAYS move to purchase_archive and
+rating_archive in small batches, and their counts and sums are added to
+the user_history and dream_history rollups. Lifetime totals are then the
+hot rows plus one rollup row, so stats stay correct while the hot tables
+stay small. Routes that list the full history read both tables through
+purchase_history() and rating_history().
+
+    flask --app app archive            # move rows older than ARCHIVE_AFTER_DAYS
+    flask --app app archive --days 90
+"""
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, delete, exists, func, insert, select, union, union_all, update
+from sqlalchemy.orm import aliased
+from extensions import db, insert_or_ignore
+from models import Dream, DreamHistory, Purchase, PurchaseArchive, Rating, RatingArchive, UserHistory
+
+
+def _history(model, archive_model, name):
+    columns = [column.name for column in model.__table__.c]
+    hot = select(*(model.__table__.c[column] for column in columns))
+    cold = select(*(archive_model.__table__.c[column] for column in columns))
+    return aliased(model, union_all(hot, cold).subquery(name), adapt_on_names=True, name=name)
+
+
+def purchase_history():
+    """A Purchase entity over hot and archived purchases, for queries that need the full history"""
+    return _history(Purchase, PurchaseArchive, 'purchase_history')
+
+
+def rating_history():
+    """A Rating entity over hot and archived ratings, for queries that need the full history"""
+    return _history(Rating, RatingArchive, 'rating_history')
+
+
+def has_purchased(user_id, dream_id):
+    """Check whether a user ever bought a dream, archived purchases included"""
+    return db.session.query(
+        exists().where(Purchase.buyer_id == user_id, Purchase.dream_id == dream_id)
+        | exists().where(PurchaseArchive.buyer_id == user_id, PurchaseArchive.dream_id == dream_id)
+    ).scalar()
+
+
+def purchased_dream_ids(user_id, dream_ids):
+    """Get the subset of `dream_ids` the user owns"""
+    if not dream_ids:
+        return set()
+    return set(db.session.execute(union(
+        select(Purchase.dream_id).where(Purchase.buyer_id == user_id, Purchase.dream_id.in_(dream_ids)),
+        select(PurchaseArchive.dream_id).where(PurchaseArchive.buyer_id == user_id,
+                                               PurchaseArchive.dream_id.in_(dream_ids)),
+    )).scalars())
+
+
+def user_totals(user_id):
+    """Lifetime purchase and rating counts: hot rows plus the archived rollup"""
+    totals = {
+        'purchases': Purchase.query.filter_by(buyer_id=user_id).count(),
+        'ratings_given': Rating.query.filter_by(rater_id=user_id).count(),
+    }
+
+    history = db.session.get(UserHistory, user_id)
+    if history is not None:
+        for name in totals:
+            totals[name] += getattr(history, name)
+    return totals
+
+
+def rating_totals(dream_id):
+    """Lifetime (rating count, rating sum) of a dream, archived ratings included"""
+    count, total = db.session.query(
+        func.count(Rating.id), func.coalesce(func.sum(Rating.rating), 0)
+    ).filter(Rating.dream_id == dream_id).one()
+    history = db.session.get(DreamHistory, dream_id)
+    if history is not None:
+        count += history.ratings
+        total += history.rating_sum
+    return count, total
+
+
+def restore_rating(user_id, dream_id):
+    """Move a user's archived rating of a dream back to the rating table so it can be edited"""
+    archived = RatingArchive.query.filter_by(rater_id=user_id, dream_id=dream_id).first()
+    if archived is None:
+        return None
+    rating = Rating(id=archived.id, rater_id=archived.rater_id, dream_id=archived.dream_id,
+                    rating=archived.rating, review=archived.review, created_at=archived.created_at)
+    db.session.execute(update(UserHistory).where(UserHistory.user_id == user_id)
+                       .values(ratings_given=UserHistory.ratings_given - 1))
+    db.session.execute(update(DreamHistory).where(DreamHistory.dream_id == dream_id)
+                       .values(ratings=DreamHistory.ratings - 1,
+                               rating_sum=DreamHistory.rating_sum - archived.rating))
+    db.session.delete(archived)
+    db.session.add(rating)
+    return rating
+
+
+def fold_dream_sales(dream):
+    """Add a dream's hot sales to its author's rollup before the dream is deleted.
+
+    Sales counters are lifetime totals, so the author's history must keep
+    them once the purchase rows are gone.
+    """
+    sales, earnings = db.session.query(
+        func.count(Purchase.id), func.coalesce(func.sum(Purchase.price_paid), 0)
+    ).filter(Purchase.dream_id == dream.id).one()
+    if sales:
+        _add_to_rollup(db.session.connection(), UserHistory, 'user_id',
+                       {dream.author_id: {'sales': sales, 'earnings': earnings}})
+
+
+def _add_to_rollup(conn, model, key, deltas):
+    """Add {key value: {column: delta}} to a rollup table, creating missing rows"""
+    if not deltas:
+        return
+    table = model.__table__
+    existing = set(conn.execute(select(table.c[key]).where(table.c[key].in_(list(deltas)))).scalars())
+    missing = [{key: value} for value in deltas if value not in existing]
+    if missing:
+        # The delete route and the archive job can both be creating the same row
+        conn.execute(insert_or_ignore(conn, table), missing)
+    columns = next(iter(deltas.values())).keys()
+    conn.execute(
+        update(table).where(table.c[key] == bindparam('_key'))
+        .values({column: table.c[column] + bindparam(f'_{column}') for column in columns}),
+        [{'_key': value, **{f'_{column}': amount for column, amount in row.items()}}
+         for value, row in deltas.items()],
+    )
+
+
+def _grouped(conn, stmt, *names):
+    return {row[0]: dict(zip(names, row[1:])) for row in conn.execute(stmt)}
+
+
+def _archive_purchases(conn, ids):
+    columns = [column.name for column in Purchase.__table__.c]
+    conn.execute(insert(PurchaseArchive).from_select(
+        columns, select(*(Purchase.__table__.c[column] for column in columns)).where(Purchase.id.in_(ids))))
+    in_batch = Purchase.id.in_(ids)
+    _add_to_rollup(conn, UserHistory, 'user_id', _grouped(
+        conn, select(Purchase.buyer_id, func.count(), func.sum(Purchase.price_paid))
+        .where(in_batch).group_by(Purchase.buyer_id), 'purchases', 'spent'))
+    _add_to_rollup(conn, UserHistory, 'user_id', _grouped(
+        conn, select(Dream.author_id, func.count(), func.sum(Purchase.price_paid))
+        .join(Dream, Purchase.dream_id == Dream.id).where(in_batch).group_by(Dream.author_id),
+        'sales', 'earnings'))
+    _add_to_rollup(conn, DreamHistory, 'dream_id', _grouped(
+        conn, select(Purchase.dream_id, func.count()).where(in_batch).group_by(Purchase.dream_id), 'purchases'))
+    conn.execute(delete(Purchase).where(in_batch))
+
+
+def _archive_ratings(conn, ids):
+    columns = [column.name for column in Rating.__table__.c]
+    conn.execute(insert(RatingArchive).from_select(
+        columns, select(*(Rating.__table__.c[column] for column in columns)).where(Rating.id.in_(ids))))
+    in_batch = Rating.id.in_(ids)
+    _add_to_rollup(conn, UserHistory, 'user_id', _grouped(
+        conn, select(Rating.rater_id, func.count()).where(in_batch).group_by(Rating.rater_id), 'ratings_given'))
+    _add_to_rollup(conn, DreamHistory, 'dream_id', _grouped(
+        conn, select(Rating.dream_id, func.count(), func.sum(Rating.rating))
+        .where(in_batch).group_by(Rating.dream_id), 'ratings', 'rating_sum'))
+    conn.execute(delete(Rating).where(in_batch))
+
+
+def _archive_table(model, date_column, mover, cutoff, batch_size):
+    moved = 0
+    while True:
+        # One short transaction per batch keeps write locks brief
+        with db.engine.begin() as conn:
+            ids = conn.execute(select(model.id).where(date_column < cutoff)
+                               .order_by(model.id).limit(batch_size)).scalars().all()
+            if ids:
+                mover(conn, ids)
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+
+
+def archive(before, batch_size=None):
+    """Move purchases and ratings made before `before` to the archive; returns the counts moved"""
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    return {
+        'purchases': _archive_table(Purchase, Purchase.purchase_date, _archive_purchases, before, batch_size),
+        'ratings': _archive_table(Rating, Rating.created_at, _archive_ratings, before, batch_size),
+    }
+
+
+@click.command('archive')
+@with_appcontext
+@click.option('--days', type=int, help='Archive rows older than this many days [default: ARCHIVE_AFTER_DAYS].')
+@click.option('--batch-size', type=int, help='Rows moved per transaction [default: ARCHIVE_BATCH_SIZE].')
+def archive_command(days, batch_size):
+    """Move old purchases and ratings to the archive tables."""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    moved = archive(datetime.utcnow() - timedelta(days=days), batch_size)
+    click.echo(f"Archived {moved['purchases']} purchase(s) and {moved['ratings']} rating(s) older than {days} days.")
+
+
+def init_archive(app):
+    app.cli.add_command(archive_command)
@@ -0,0 +1,94 @@
+"""
+ASGI entry point for Neural Dreams Inc.
+Serve with `uvicorn --factory asgi:create_asgi_app --workers 4` (pip install
+uvicorn a2wsgi, plus aiosqlite or asyncpg). GET and HEAD requests for the
+read-only views in ASYNC_ENDPOINTS run on the worker's event loop, in a
+greenlet whose database calls await the async engines (async_db.py): while
+one request waits on the database the worker serves the others. Every
+other request, including all writes and uploads, goes to the WSGI app on a
+thread pool, as under gunicorn.
+"""
+import io
+from werkzeug.exceptions import HTTPException
+
+# Read-only views served on the event loop
+ASYNC_ENDPOINTS = {
+    'home', 'leaderboard', 'tags.tag_leaderboard',
+    'marketplace.index', 'marketplace.dream_detail',
+    'api.list_dreams', 'api.dream_detail', 'api.user_stats', 'api.typeahead_suggestions',
+}
+
+
+class AsyncReadApp:
+    """ASGI app: the read views on the event loop, everything else on the WSGI app in threads"""
+
+    def __init__(self, app):
+        from a2wsgi import WSGIMiddleware
+        from async_db import init_async_db
+        self.app = app
+        self.reader = init_async_db(app)
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASGI_WSGI_THREADS'])
+        self.urls = app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and self._on_loop(scope['path']):
+            await self._serve_on_loop(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    def _on_loop(self, path):
+        try:
+            endpoint, _ = self.urls.match(path, method='GET')
+        except HTTPException:  # not found, or a redirect the WSGI app answers
+            return False
+        return endpoint in ASYNC_ENDPOINTS
+
+    async def _serve_on_loop(self, scope, receive, send):
+        from a2wsgi.wsgi import build_environ
+        body = []
+        while True:
+            message = await receive()
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = build_environ(scope, io.BytesIO(b''.join(body)))
+        environ['wsgi.input_terminated'] = True
+        status, headers, chunks = await self.reader.run(self._call_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    def _call_wsgi(self, environ):
+        """Run the Flask app for one request, buffering the response (these views never stream)"""
+        started = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+            return chunks.append
+
+        iterable = self.app(environ, start_response)
+        try:
+            chunks.extend(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return started['status'], started['headers'], chunks
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.reader.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(config=None):
+    """The Flask app behind an AsyncReadApp; `config` is passed to create_app()"""
+    from app import create_app
+    return AsyncReadApp(create_app(config))
@@ -0,0 +1,138 @@
+"""
+Async database access for the ASGI read path of Neural Dreams Inc.
+asgi.py runs the read-only views on the worker's event loop, each inside a
+greenlet started by AsyncReader.run(). There db.session and gather() use
+async engines (aiosqlite or asyncpg) on the primary database and on each
+DATABASE_REPLICA_URLS replica: a query suspends the view until its driver
+answers, so the worker serves other requests meanwhile, and gather() runs
+independent SELECTs concurrently on separate connections. Under WSGI,
+gather() runs the statements one after another on db.session, so views
+keep a single code path.
+"""
+import contextvars
+import itertools
+import sqlalchemy as sa
+from flask_sqlalchemy.pagination import SelectPagination
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import lazyload
+from extensions import db
+from replicas import serving_reader
+
+# Sync driver name -> async driver that speaks to the same database
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg'}
+
+
+def async_url(url):
+    """The async-driver form of a database URL"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'The ASGI app supports SQLite and PostgreSQL, not {backend}')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncReader:
+    """A worker's async engines, and the greenlets its read views run in"""
+
+    def __init__(self, url, pool_size, replica_urls=(), pragmas=()):
+        self.pool_size = pool_size
+        self.pragmas = pragmas  # run on each new SQLite connection
+        # Engines only connect on first use, so they are safe to create before the server forks
+        self.engine = self._create_engine(async_url(url))
+        self.replicas = [self._create_engine(async_url(replica)) for replica in replica_urls]
+        self._replica_cycle = itertools.cycle(self.replicas)
+
+    def _create_engine(self, url):
+        from sqlalchemy.ext.asyncio import create_async_engine
+        url.get_dialect().import_dbapi()  # fail at startup, not on the first request, without the driver
+        engine = create_async_engine(url, pool_size=self.pool_size, max_overflow=self.pool_size)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine.sync_engine, 'connect', self._set_sqlite_pragmas)
+        return engine
+
+    def _set_sqlite_pragmas(self, dbapi_connection, connection_record):
+        from sqlite_profile import apply_pragmas
+        apply_pragmas(dbapi_connection, self.pragmas)
+
+    def next_engine(self, replica=False):
+        """The primary's engine, or with `replica` the next replica's (the primary when there are none)"""
+        if replica and self.replicas:
+            return next(self._replica_cycle)
+        return self.engine
+
+    def bind(self, replica=False):
+        """The sync facade of an engine, for db.session inside run(); its queries await the async driver"""
+        return self.next_engine(replica).sync_engine
+
+    async def run(self, fn, *args):
+        """Run sync `fn` in a greenlet on the running event loop, with db.session and gather() on these engines.
+
+        `fn` gets a context of its own, as on a server thread, so Flask gives
+        it a fresh app context and db.session and removes them inside the greenlet.
+        """
+        from sqlalchemy.util import greenlet_spawn
+        context = contextvars.Context()
+        context.run(serving_reader.set, self)
+        return await greenlet_spawn(context.run, fn, *args)
+
+    async def gather(self, statements, replica=False):
+        """Run statements concurrently, each on its own connection; returns their buffered results"""
+        import asyncio
+        from sqlalchemy.ext.asyncio import AsyncSession
+        engine = self.next_engine(replica)
+
+        async def run(statement):
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                # Frozen results keep the loaded rows and objects after the session closes
+                return (await session.execute(statement)).freeze()
+
+        return [frozen() for frozen in await asyncio.gather(*(run(statement) for statement in statements))]
+
+    async def dispose(self):
+        for engine in (self.engine, *self.replicas):
+            await engine.dispose()
+
+
+def gather(*statements):
+    """Results of independent read-only statements, concurrently on the ASGI read path.
+
+    Each result is a SQLAlchemy Result (use .scalars(), .first(), .all()).
+    ORM objects come back detached on the async path, so statements must
+    eager-load every relationship the caller touches. Reads go to a replica
+    when db.session's would: in a @read_only scope, before this browser wrote.
+    """
+    from sqlalchemy.util import await_
+    from replicas import reads_from_replica
+    reader = serving_reader.get()
+    if reader is None or len(statements) < 2:  # nothing to overlap
+        return [db.session.execute(statement) for statement in statements]
+    return await_(reader.gather(statements, replica=reads_from_replica(db.session)))
+
+
+def paginate(select, page, per_page):
+    """db.paginate() for a select, with the page and the total count fetched by one gather()"""
+    return _GatheredPagination(select=select, session=db.session, page=page, per_page=per_page, error_out=False)
+
+
+class _GatheredPagination(SelectPagination):
+
+    def _query_items(self):
+        select = self._query_args['select']
+        counted = select.options(lazyload('*')).order_by(None).subquery()
+        items, total = gather(select.limit(self.per_page).offset(self._query_offset),
+                              sa.select(sa.func.count()).select_from(counted))
+        self._total = total.scalar()
+        return list(items.unique().scalars())
+
+    def _query_count(self):
+        return self._total
+
+
+def init_async_db(app):
+    """Create the app's AsyncReader; asgi.py calls this, WSGI deployments never need the async drivers"""
+    from sqlite_profile import sqlite_pragmas
+    reader = app.extensions['async_db'] = AsyncReader(
+        app.config['SQLALCHEMY_DATABASE_URI'], app.config['ASYNC_DB_POOL_SIZE'],
+        app.config['DATABASE_REPLICA_URLS'], sqlite_pragmas(app.config))
+    return reader
@@ -0,0 +1,206 @@
+"""
+Compare the read views served by sync gunicorn and by the ASGI app.
+
+Seeds a scratch SQLite file, then starts two servers on it: gunicorn with
+one gthread worker and --threads threads (the sync deployment), and
+uvicorn with one worker running asgi.py. Both have the page cache off and
+sleep --latency-ms in the driver for every statement (a sqlite3 trace
+callback, on the sync and the aiosqlite connections) to stand in for a
+network round trip to a database server. A mix of home, marketplace,
+leaderboard, dream detail and API requests is then sent at each
+--concurrency level, reporting req/s and p50/p99 latency for both, after
+checking that both servers return the same API payloads. Never touches
+DATABASE_URL.
+
+Usage: python -m benchmarks.async_reads [--latency-ms 5] [--requests 400] [--threads 8] [--concurrency 1,8,32,64]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.load_routes import percentile
+from benchmarks.seed_data import PRESETS
+
+PAGES = {
+    'home': lambda rng, dreams: '/',
+    'marketplace': lambda rng, dreams: f'/marketplace/?page={rng.randint(1, 20)}',
+    'leaderboard': lambda rng, dreams: '/leaderboard',
+    'dream_detail': lambda rng, dreams: f'/marketplace/dream/{rng.randint(1, dreams)}',
+    'api_dream': lambda rng, dreams: f'/api/v1/dreams/{rng.randint(1, dreams)}?include=ratings',
+    'api_list': lambda rng, dreams: '/api/v1/dreams?sort_by=rating_high&limit=20',
+}
+
+
+def add_latency(app, seconds, reader=None):
+    """Sleep `seconds` in the driver for every statement the app's engines (and `reader`'s) run"""
+    from sqlalchemy import event
+    from extensions import db
+
+    def trace(statement):
+        time.sleep(seconds)
+
+    def on_sync_connect(dbapi_connection, connection_record):
+        dbapi_connection.set_trace_callback(trace)
+
+    def on_async_connect(dbapi_connection, connection_record):
+        from sqlalchemy.util import await_
+        # aiosqlite runs the sqlite3 connection on its own thread, so the sleep doesn't block the event loop
+        await_(dbapi_connection.driver_connection.set_trace_callback(trace))
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', on_sync_connect)
+    if reader is not None:
+        event.listen(reader.engine.sync_engine, 'connect', on_async_connect)
+
+
+def _config():
+    return {'SQLALCHEMY_DATABASE_URI': os.environ['ASYNC_READS_DB'], 'PAGE_CACHE_TTL': 0}
+
+
+def sync_app():
+    """gunicorn factory for the sync server"""
+    import logging
+    from app import create_app
+    app = create_app(_config())
+    app.logger.setLevel(logging.WARNING)
+    add_latency(app, float(os.environ['ASYNC_READS_LATENCY']))
+    return app
+
+
+def asgi_app():
+    """uvicorn factory for the ASGI server"""
+    import logging
+    from asgi import create_asgi_app
+    asgi = create_asgi_app(_config())
+    asgi.app.logger.setLevel(logging.WARNING)
+    add_latency(asgi.app, float(os.environ['ASYNC_READS_LATENCY']), asgi.reader)
+    return asgi
+
+
+def start_server(command, port, env):
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            status, _ = asyncio.run(fetch_once(port, '/api/v1/dreams?limit=1'))
+            if status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{command[0]} did not start on port {port}')
+
+
+async def fetch(reader, writer, path):
+    """One GET on a keep-alive HTTP/1.1 connection; returns (status, body)"""
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def fetch_once(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        return await fetch(reader, writer, path)
+    finally:
+        writer.close()
+
+
+async def load(port, requests, concurrency, dreams):
+    """Send `requests` mixed page views from `concurrency` keep-alive clients; returns (req/s, latencies)"""
+    remaining = iter(range(requests))
+    latencies = []
+    errors = []
+
+    async def client(seed):
+        rng = random.Random(seed)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            while next(remaining, None) is not None:
+                path = PAGES[rng.choice(list(PAGES))](rng, dreams)
+                started = time.perf_counter()
+                status, _ = await fetch(reader, writer, path)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    errors.append((path, status))
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    assert not errors, errors[:5]
+    return requests / elapsed, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--preset', choices=PRESETS, default='small')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='simulated round trip per statement')
+    parser.add_argument('--requests', type=int, default=400, help='requests per concurrency level and server')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads (and ASGI_WSGI_THREADS)')
+    parser.add_argument('--concurrency', default='1,8,32,64', help='comma-separated client counts')
+    parser.add_argument('--port', type=int, default=5081, help='the sync server; the ASGI one uses the next port')
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from benchmarks.seed_data import seed
+
+    url = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "async_reads.db")}'
+    sizes = PRESETS[args.preset]
+    with create_app({'SQLALCHEMY_DATABASE_URI': url}).app_context():
+        seed(db, **sizes)
+
+    env = dict(os.environ, ASYNC_READS_DB=url, ASYNC_READS_LATENCY=str(args.latency_ms / 1000),
+               ASGI_WSGI_THREADS=str(args.threads), ASYNC_DB_POOL_SIZE=str(max(10, args.threads)))
+    sync_port, asgi_port = args.port, args.port + 1
+    servers = {
+        'sync': start_server([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{sync_port}',
+                              '--worker-class', 'gthread', '--workers', '1', '--threads', str(args.threads),
+                              'benchmarks.async_reads:sync_app()'], sync_port, env),
+        'asgi': start_server([sys.executable, '-m', 'uvicorn', '--factory', 'benchmarks.async_reads:asgi_app',
+                              '--host', '127.0.0.1', '--port', str(asgi_port), '--workers', '1',
+                              '--no-access-log'], asgi_port, env),
+    }
+    ports = {'sync': sync_port, 'asgi': asgi_port}
+    try:
+        # Warm both servers and check they agree
+        rng = random.Random(42)
+        for name, page in PAGES.items():
+            path = page(rng, sizes['dreams'])
+            (sync_status, sync_body), (asgi_status, asgi_body) = (
+                asyncio.run(fetch_once(ports[server], path)) for server in ('sync', 'asgi'))
+            assert sync_status == asgi_status == 200, (path, sync_status, asgi_status)
+            if name.startswith('api'):
+                assert json.loads(sync_body) == json.loads(asgi_body), path
+        print(f"Seeded {sizes['dreams']:,} dreams; {args.latency_ms:g}ms per statement; "
+              f"gunicorn 1 worker x {args.threads} threads vs uvicorn 1 worker; API payloads match")
+
+        print(f"{'clients':>8}  {'sync req/s':>10} {'p50':>8} {'p99':>8}  {'asgi req/s':>10} {'p50':>8} {'p99':>8}")
+        for concurrency in (int(level) for level in args.concurrency.split(',')):
+            row = [f'{concurrency:>8}']
+            for server in ('sync', 'asgi'):
+                rate, latencies = asyncio.run(load(ports[server], args.requests, concurrency, sizes['dreams']))
+                row.append(f'{rate:>10.1f} {percentile(latencies, 50) * 1000:>6.0f}ms '
+                           f'{percentile(latencies, 99) * 1000:>6.0f}ms')
+            print('  '.join(row))
+    finally:
+        for process in servers.values():
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Time buying a cart of dreams one by one versus in one bulk checkout.
+
+Buys the same number of dreams through process_dream_purchase (one
+validation, commit and tag update per dream) and through checkout.checkout
+(set-based validation, one transaction, one tag update), reporting time
+and SQL statements for each. Then checks the partial-failure rules: a cart
+with an invalid item, a cart the buyer can't afford and a cart that fails
+halfway through writing all leave points, purchases, counters and the
+ledger untouched. Uses a scratch SQLite file, so it never touches
+DATABASE_URL.
+
+Usage: python -m benchmarks.checkout [--items 20]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.seed_data import chunked_execute
+
+
+BUYER_POINTS = 1000000
+
+
+class SimulatedFailure(Exception):
+    pass
+
+
+def seed(db, items):
+    """Two rich buyers (with matching ledger grants), ten authors and enough dreams for three carts"""
+    from sqlalchemy import insert
+    from models import Dream, LedgerEntry, User
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': BUYER_POINTS if n <= 2 else 0, 'created_at': now}
+                                    for n in range(1, 13)])
+        conn.execute(insert(LedgerEntry), [{'user_id': n, 'amount': BUYER_POINTS, 'kind': 'grant', 'created_at': now}
+                                           for n in (1, 2)])
+        chunked_execute(conn, insert(Dream), ({'id': n, 'title': f'Dream {n}', 'description': '-', 'excerpt': '-',
+                                               'category': 'surreal', 'price': 10 + n % 7, 'author_id': 3 + n % 10,
+                                               'created_at': now} for n in range(1, 3 * items + 1)), 5000)
+
+
+def state(db):
+    """Everything a checkout writes, for before/after comparisons"""
+    from sqlalchemy import func, select
+    from models import Dream, LedgerEntry, Purchase, User
+    with db.engine.connect() as conn:
+        return (conn.execute(select(func.sum(User.points), func.sum(User.sales_count))).one(),
+                conn.execute(select(func.count(Purchase.id))).scalar(),
+                conn.execute(select(func.sum(Dream.purchase_count))).scalar(),
+                conn.execute(select(func.count(LedgerEntry.id))).scalar(),
+                conn.execute(select(User.points).where(User.id == 1)).scalar())
+
+
+def count_statements(engine):
+    from sqlalchemy import event
+    counter = {'statements': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['statements'] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return counter, lambda: event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def timed(db, fn):
+    counter, stop = count_statements(db.engine)
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    stop()
+    return result, elapsed, counter['statements']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20, help='dreams per cart')
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    from models import User
+    from dream_utils import process_dream_purchase
+    import checkout
+    import ledger
+    from counters import find_drift
+
+    path = os.path.join(tempfile.mkdtemp(), 'checkout.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context(), app.test_request_context():
+        init_db()
+        seed(db, args.items)
+        first, second = list(range(1, args.items + 1)), list(range(args.items + 1, 2 * args.items + 1))
+
+        def one_by_one():
+            from models import Dream
+            buyer = db.session.get(User, 1)
+            return all(process_dream_purchase(buyer, db.session.get(Dream, dream_id))[0] for dream_id in first)
+
+        ok, elapsed, statements = timed(db, one_by_one)
+        assert ok
+        print(f'One by one:    {args.items} dreams in {elapsed * 1000:.1f}ms, {statements} statements')
+        db.session.remove()
+
+        ok, elapsed, statements = timed(db, lambda: checkout.checkout(db.session.get(User, 2), second)[0])
+        assert ok
+        print(f'Bulk checkout: {args.items} dreams in {elapsed * 1000:.1f}ms, {statements} statements')
+        db.session.remove()
+
+        # Partial failures: each cart is bought whole or not at all
+        spare = list(range(2 * args.items + 1, 3 * args.items + 1))
+        before = state(db)
+        ok, _, problems = checkout.checkout(db.session.get(User, 1), spare + [first[0], 999999])
+        assert not ok and set(problems) == {first[0], 999999} and state(db) == before
+        print(f'Invalid items: rejected ({len(problems)} problems), nothing written')
+
+        points = db.session.get(User, 1).points
+        db.session.execute(User.__table__.update().where(User.id == 1).values(points=5))
+        db.session.commit()
+        before = state(db)
+        ok, message, _ = checkout.checkout(db.session.get(User, 1), spare)
+        assert not ok and state(db) == before
+        print(f'Unaffordable:  rejected ({message}), nothing written')
+        db.session.execute(User.__table__.update().where(User.id == 1).values(points=points))
+        db.session.commit()
+        db.session.remove()
+
+        original = ledger.record_entries
+
+        def fail_midway(entries):
+            original(entries)
+            raise SimulatedFailure('ledger write failed')
+
+        ledger.record_entries = fail_midway
+        before = state(db)
+        ok, message, _ = checkout.checkout(db.session.get(User, 1), spare)
+        ledger.record_entries = original
+        assert not ok and state(db) == before
+        print(f'Failed write:  rolled back ({message}), nothing written')
+        db.session.remove()
+
+        ok, _, _ = checkout.checkout(db.session.get(User, 1), spare)
+        assert ok and not any(find_drift(db.session.connection())) and not list(ledger.find_mismatches())
+        print('Retry:         bought, counters and ledger consistent')
+
+
+if __name__ == '__main__':
+    main()
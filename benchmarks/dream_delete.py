@@ -0,0 +1,97 @@
+"""
+Time deleting a dream with tens of thousands of purchases and ratings.
+
+Compares the old ORM cascade (load every child row, then DELETE them one
+by one) with the ON DELETE CASCADE path, where the session deletes only
+the dream and the database removes the children. Uses a scratch SQLite
+file, so it never touches DATABASE_URL.
+
+Usage: python -m benchmarks.dream_delete [--children 50000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.seed_data import chunked_execute
+
+
+def seed(db, children):
+    """One author, `children` buyers, and two dreams each bought and rated by every buyer"""
+    from sqlalchemy import insert
+    from models import Dream, Purchase, Rating, User
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        chunked_execute(conn, insert(User), ({'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com',
+                                              'password_hash': '-', 'points': 0, 'created_at': now}
+                                             for n in range(1, children + 2)), 20000)
+        conn.execute(insert(Dream), [{'id': n, 'title': f'Dream {n}', 'description': '-', 'category': 'surreal',
+                                      'price': 10, 'author_id': 1, 'created_at': now} for n in (1, 2)])
+        for dream_id in (1, 2):
+            chunked_execute(conn, insert(Purchase), ({'buyer_id': n, 'dream_id': dream_id, 'price_paid': 10,
+                                                      'purchase_date': now} for n in range(2, children + 2)), 20000)
+            chunked_execute(conn, insert(Rating), ({'rater_id': n, 'dream_id': dream_id, 'rating': 4,
+                                                    'created_at': now} for n in range(2, children + 2)), 20000)
+
+
+def count_statements(engine):
+    from sqlalchemy import event
+    counter = {'statements': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['statements'] += len(parameters) if executemany else 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return counter, lambda: event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def timed_delete(db, dream_id, load_children):
+    from models import Dream
+    counter, stop = count_statements(db.engine)
+    started = time.perf_counter()
+    dream = db.session.get(Dream, dream_id)
+    if load_children:
+        # Loaded collections are deleted row by row, as before passive_deletes
+        len(dream.purchases), len(dream.ratings)
+    db.session.delete(dream)
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+    stop()
+    db.session.remove()
+    return elapsed, counter['statements']
+
+
+def remaining(db, dream_id):
+    from sqlalchemy import func, select
+    from models import Purchase, Rating
+    with db.engine.connect() as conn:
+        return sum(conn.execute(select(func.count()).where(model.dream_id == dream_id)).scalar()
+                   for model in (Purchase, Rating))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--children', type=int, default=50000, help='purchases and ratings per dream')
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+
+    path = os.path.join(tempfile.mkdtemp(), 'delete.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        started = time.perf_counter()
+        seed(db, args.children)
+        print(f'Seeded 2 dreams with {args.children:,} purchases and ratings each '
+              f'in {time.perf_counter() - started:.1f}s ({path})')
+
+        for label, dream_id, load_children in (('ORM cascade', 1, True), ('DB cascade', 2, False)):
+            elapsed, statements = timed_delete(db, dream_id, load_children)
+            assert remaining(db, dream_id) == 0
+            print(f'{label + ":":13} {elapsed:.2f}s, {statements:,} statement(s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Time importing a seller's catalogue one post at a time versus in bulk.
+
+Generates a manifest and a zip of camera-sized JPEGs, then imports them
+the way post_dream does (inline resize, one commit and one tag update per
+dream) and through dream_import.import_dreams (parallel resizes, chunked
+Core inserts, one tag update). Checks the bulk import skipped and
+reported the invalid rows, wrote excerpts, and left the facet counts
+matching a full recount. Uses a scratch SQLite file and upload folder,
+so it never touches DATABASE_URL or static/uploads.
+
+Usage: python -m benchmarks.dream_import [--dreams 200] [--image-size 2400x1800]
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import tempfile
+import time
+import zipfile
+from benchmarks.seed_data import ADJECTIVES, NOUNS, PHRASES
+
+INVALID_ROWS = 5
+
+
+def make_image(size, rng):
+    from PIL import Image
+    # Upscaled noise: photo-like file sizes without a real camera
+    small = (size[0] // 8, size[1] // 8)
+    image = Image.frombytes('RGB', small, rng.randbytes(small[0] * small[1] * 3)).resize(size, Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_upload(dreams, size, rng):
+    """A CSV manifest with INVALID_ROWS bad rows mixed in, and a zip with one image per valid row"""
+    images = [make_image(size, rng) for _ in range(8)]
+    manifest, archive = io.StringIO(), io.BytesIO()
+    writer = csv.writer(manifest)
+    writer.writerow(['title', 'description', 'category', 'price', 'image'])
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as images_zip:
+        for n in range(dreams):
+            name = f'photos/dream-{n}.jpg'
+            images_zip.writestr(name, images[n % len(images)])
+            description = ' '.join(f'{rng.choice(PHRASES)} a {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}.'
+                                   for _ in range(rng.randint(2, 12)))
+            writer.writerow([f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {n}', description,
+                             rng.choice(['surreal', 'funny', 'scary', 'romantic', 'bizarre']), rng.randint(1, 800),
+                             f'dream-{n}.jpg'])
+    for n in range(INVALID_ROWS):
+        writer.writerow([f'Broken dream {n}', 'Too short', 'surreal', 'free', 'missing.jpg'])
+    return manifest.getvalue().encode(), archive.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dreams', type=int, default=200)
+    parser.add_argument('--image-size', default='2400x1800', help='WIDTHxHEIGHT of the generated photos')
+    args = parser.parse_args()
+    size = tuple(int(part) for part in args.image_size.split('x'))
+
+    from sqlalchemy import func, select
+    from werkzeug.datastructures import FileStorage
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    from models import Dream, FacetCount, User
+    from dream_utils import save_dream_image, update_user_dream_tag
+    from dream_import import import_dreams, read_manifest
+    import facets
+
+    rng = random.Random(42)
+    manifest, images = make_upload(args.dreams, size, rng)
+    print(f'Manifest: {args.dreams} dreams + {INVALID_ROWS} invalid rows, zip of {len(images) / 1e6:.1f}MB')
+
+    scratch = tempfile.mkdtemp()
+    uploads = os.path.join(scratch, 'uploads')
+    os.makedirs(uploads)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(scratch, "import.db")}',
+                      'UPLOAD_FOLDER': uploads})
+    with app.app_context():
+        init_db()
+        for n in (1, 2):
+            db.session.add(User(username=f'seller{n}', email=f'seller{n}@example.com', password_hash='-'))
+        db.session.commit()
+
+        # The post_dream path, one dream at a time
+        archive = zipfile.ZipFile(io.BytesIO(images))
+        started = time.perf_counter()
+        for number, row in read_manifest(io.BytesIO(manifest), 'dreams.csv'):
+            if row['title'].startswith('Broken'):
+                continue
+            upload = FileStorage(io.BytesIO(archive.read('photos/' + row['image'])), filename=row['image'])
+            dream = Dream(title=row['title'], description=row['description'], category=row['category'],
+                          price=int(row['price']), image_filename=save_dream_image(upload), author_id=1)
+            db.session.add(dream)
+            db.session.commit()
+            update_user_dream_tag(1)
+        one_by_one = time.perf_counter() - started
+        print(f'One by one: {args.dreams} dreams in {one_by_one:.1f}s')
+
+        seller = db.session.get(User, 2)
+        progress = []
+        report = import_dreams(seller, io.BytesIO(manifest), 'dreams.csv', io.BytesIO(images),
+                               lambda report: progress.append(report['imported']))
+        print(f"Bulk import: {report['imported']} dreams in {report['seconds']:.1f}s "
+              f"({one_by_one / report['seconds']:.1f}x faster, {app.config['IMPORT_IMAGE_WORKERS']} image workers), "
+              f"progress after each chunk: {progress}")
+
+        assert report['imported'] == report['images'] == args.dreams
+        assert report['failed'] == len(report['errors']) == INVALID_ROWS
+        print(f"Skipped {report['failed']} invalid rows, e.g. row {report['errors'][0][0]}: {report['errors'][0][1]}")
+        assert db.session.scalar(select(func.count(Dream.id)).where(Dream.author_id == 2, Dream.excerpt == '')) == 0
+        assert len(os.listdir(uploads)) == 2 * args.dreams
+
+        counted = {(row.category, row.price_bucket): row.dreams for row in db.session.scalars(select(FacetCount))}
+        with db.engine.begin() as conn:
+            facets.rebuild(conn)
+        assert counted == {(row.category, row.price_bucket): row.dreams for row in db.session.scalars(select(FacetCount))}
+        print('Excerpts, images and facet counts match')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Time the marketplace facet counts and check they stay correct.
+
+Compares three ways of getting the sidebar counts: a COUNT query per
+category and per price bucket, one grouped query, and the precomputed
+facet_count table behind the app cache. Then creates, edits and deletes
+dreams through the ORM and checks the incrementally maintained counts
+still match a full recount. Uses a scratch SQLite file, so it never
+touches DATABASE_URL.
+
+Usage: python -m benchmarks.facets [--dreams 100000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.seed_data import chunked_execute
+
+
+def seed(db, dreams, categories):
+    from sqlalchemy import insert
+    from models import Dream, User
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), {'id': 1, 'username': 'author', 'email': 'author@example.com',
+                                    'password_hash': '-', 'created_at': now})
+        chunked_execute(conn, insert(Dream), ({'id': n, 'title': f'Dream {n}', 'description': '-', 'excerpt': '-',
+                                               'category': rng.choice(categories), 'price': rng.randint(1, 1000),
+                                               'author_id': 1, 'created_at': now}
+                                              for n in range(1, dreams + 1)), 5000)
+
+
+def median_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dreams', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from sqlalchemy import func, select
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    from models import Dream, FacetCount
+    from cache import get_cache
+    import facets
+
+    path = os.path.join(tempfile.mkdtemp(), 'facets.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        categories = app.config['DREAM_CATEGORIES']
+        init_db()
+        seed(db, args.dreams, categories)
+        with db.engine.begin() as conn:
+            facets.rebuild(conn)
+
+        def separate_counts():
+            counts = {category: Dream.query.filter(Dream.category == category).count() for category in categories}
+            for low, high in facets.PRICE_BUCKETS:
+                query = Dream.query.filter(Dream.price >= low)
+                counts[(low, high)] = (query.filter(Dream.price <= high) if high else query).count()
+            return counts
+
+        def cached():
+            return facets.facet_counts()
+
+        get_cache().invalidate('facets')
+        separate, separate_time = median_time(separate_counts, args.repeat)
+        grouped, grouped_time = median_time(lambda: facets._grouped(Dream.query), args.repeat)
+        result, cached_time = median_time(cached, args.repeat)
+        assert result['categories'] == {category: separate[category] for category in categories}
+        assert [count for _, _, count in result['price_buckets']] == [separate[bucket] for bucket in facets.PRICE_BUCKETS]
+        assert sum(grouped.values()) == args.dreams
+        queries = len(categories) + len(facets.PRICE_BUCKETS)
+        print(f'Separate COUNTs ({queries} queries): {separate_time * 1000:8.1f}ms')
+        print(f'One grouped query:         {grouped_time * 1000:8.1f}ms')
+        print(f'Precomputed + cache:       {cached_time * 1000:8.3f}ms')
+
+        # Incremental maintenance through ordinary ORM writes
+        rng = random.Random(7)
+        for n in range(200):
+            db.session.add(Dream(title=f'New {n}', description='-', category=rng.choice(categories),
+                                 price=rng.randint(1, 1000), author_id=1))
+        db.session.commit()
+        for dream in Dream.query.filter(Dream.id <= 300):
+            if dream.id % 3 == 0:
+                db.session.delete(dream)
+            elif dream.id % 3 == 1:
+                dream.price = rng.randint(1, 1000)
+            else:
+                dream.category = rng.choice(categories)
+        db.session.commit()
+        maintained = facets.facet_counts()
+
+        def table_counts():
+            return {(row.category, row.price_bucket): row.dreams
+                    for row in db.session.execute(select(FacetCount).where(FacetCount.dreams > 0)).scalars()}
+
+        before = table_counts()
+        with db.engine.begin() as conn:
+            facets.rebuild(conn)
+        db.session.expire_all()
+        assert before == table_counts() == facets._grouped(Dream.query)
+        assert maintained['total'] == db.session.scalar(select(func.count(Dream.id)))
+        print('Incremental maintenance: matches a full recount after 200 creates and 300 edits/deletes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure what listing queries pay for the full dream description.
+
+Runs the marketplace listing query with every column loaded and with the
+card columns only (the stored excerpt instead of the description), and
+reports the bytes fetched from the database and the ORM hydration time
+for each. Uses a scratch SQLite file, so it never touches DATABASE_URL.
+
+Usage: python -m benchmarks.listing_columns [--dreams 20000] [--description-chars 2000] [--page-size 12]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.seed_data import ADJECTIVES, NOUNS, PHRASES, chunked_execute
+
+
+def seed(db, dreams, description_chars):
+    from sqlalchemy import insert
+    from models import Dream, User, make_excerpt
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    def description():
+        words = []
+        while sum(len(word) + 1 for word in words) < description_chars:
+            words.append(f'{rng.choice(PHRASES)} a {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}.')
+        return ' '.join(words)
+
+    def dream_rows():
+        for n in range(1, dreams + 1):
+            text = description()
+            yield {'id': n, 'title': f'Dream {n}', 'description': text, 'excerpt': make_excerpt(text),
+                   'category': 'surreal', 'price': 10, 'author_id': 1, 'created_at': now, 'updated_at': now}
+
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), {'id': 1, 'username': 'author', 'email': 'author@example.com',
+                                    'password_hash': '-', 'created_at': now})
+        chunked_execute(conn, insert(Dream), dream_rows(), 5000)
+
+
+def fetched_bytes(db, query):
+    """Bytes of column data the database hands back for a query"""
+    total = 0
+    with db.engine.connect() as conn:
+        for row in conn.execute(query.statement):
+            for value in row:
+                if isinstance(value, str):
+                    total += len(value.encode('utf-8'))
+                elif value is not None:
+                    total += 8
+    return total
+
+
+def hydration_time(db, query, repeat):
+    """Median seconds to load the query's rows as Dream objects in a fresh session"""
+    timings = []
+    for _ in range(repeat):
+        db.session.remove()
+        started = time.perf_counter()
+        query.with_session(db.session()).all()
+        timings.append(time.perf_counter() - started)
+    db.session.remove()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dreams', type=int, default=20000)
+    parser.add_argument('--description-chars', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    from models import Dream
+    from dream_utils import card_columns, sort_dreams
+
+    path = os.path.join(tempfile.mkdtemp(), 'listing.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        started = time.perf_counter()
+        seed(db, args.dreams, args.description_chars)
+        print(f'Seeded {args.dreams:,} dreams with ~{args.description_chars:,}-character descriptions '
+              f'in {time.perf_counter() - started:.1f}s ({path})')
+
+        for label, limit in (('one page', args.page_size), ('all dreams', args.dreams)):
+            results = {}
+            for variant, query in (('full rows', Dream.query),
+                                   ('card columns', Dream.query.options(card_columns()))):
+                query = sort_dreams(query, 'newest').limit(limit)
+                results[variant] = (fetched_bytes(db, query), hydration_time(db, query, args.repeat))
+            (full_bytes, full_time), (card_bytes, card_time) = results.values()
+            print(f'{label} ({limit:,} rows):')
+            print(f'  full rows:    {full_bytes:>12,} bytes, hydrated in {full_time * 1000:8.2f}ms')
+            print(f'  card columns: {card_bytes:>12,} bytes, hydrated in {card_time * 1000:8.2f}ms '
+                  f'({card_bytes / full_bytes:.0%} of the bytes, {full_time / card_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Drive the main routes and report throughput and latency percentiles.
+
+Runs in-process through the Flask test client by default, or against a
+running server with --url (e.g. a local gunicorn). Either way it reads the
+database named by DATABASE_URL to pick dream ids, usernames and purchases,
+so seed it first with benchmarks.seed_data.
+
+Results are saved as JSON; pass --baseline to compare with an earlier run
+and flag regressions.
+
+Usage: python -m benchmarks.load_routes [--requests 200] [--url http://127.0.0.1:5000]
+                                        [--save benchmarks/results/latest.json]
+                                        [--baseline benchmarks/results/baseline.json]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from benchmarks.seed_data import SEED_PASSWORD
+
+SCENARIOS = ['home', 'marketplace', 'dream_detail', 'profile', 'leaderboard', 'tags', 'buy', 'rate']
+SORTS = ['newest', 'oldest', 'price_low', 'price_high', 'rating_high', 'rating_low']
+SEARCH_TERMS = ['', '', '', 'ocean', 'library', 'glowing', 'train']
+CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class TestClientSession:
+    """One browser session through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.csrf_token = ''
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+
+class HttpSession:
+    """One browser session against a live server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.csrf_token = ''
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Measure the POST itself, not the page it redirects to
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def load_fixture(db, logged_in_users, rng):
+    """Pick ids and users to request from the seeded database"""
+    from models import User, Dream, Purchase
+    from sqlalchemy import func, select
+
+    dream_ids = db.session.execute(select(Dream.id).order_by(func.random()).limit(5000)).scalars().all()
+    usernames = db.session.execute(
+        select(User.username).join(Dream, Dream.author_id == User.id).group_by(User.id).limit(2000)
+    ).scalars().all()
+    buyers = db.session.execute(
+        select(User.id, User.username).order_by(User.points.desc()).limit(logged_in_users)
+    ).all()
+    owned = {}
+    for buyer_id, _ in buyers:
+        owned[buyer_id] = db.session.execute(
+            select(Purchase.dream_id).where(Purchase.buyer_id == buyer_id).limit(500)
+        ).scalars().all()
+    if not dream_ids or not buyers:
+        raise SystemExit('The database is empty; run python -m benchmarks.seed_data first')
+    rng.shuffle(usernames)
+    return {'dream_ids': dream_ids, 'usernames': usernames or ['dreamer1'], 'buyers': buyers, 'owned': owned}
+
+
+def build_request(scenario, fixture, buyer_id, rng):
+    """Return (method, path, form data) for one request of a scenario"""
+    if scenario == 'home':
+        return 'GET', '/', None
+    if scenario == 'marketplace':
+        params = {'sort_by': rng.choice(SORTS), 'page': rng.choice([1, 1, 1, 2, 3, 10])}
+        term = rng.choice(SEARCH_TERMS)
+        if term:
+            params['query'] = term
+        if rng.random() < 0.3:
+            params['category'] = rng.choice(['surreal', 'funny', 'scary', 'romantic', 'bizarre'])
+        return 'GET', '/marketplace/?' + urllib.parse.urlencode(params), None
+    if scenario == 'dream_detail':
+        return 'GET', f"/marketplace/dream/{rng.choice(fixture['dream_ids'])}", None
+    if scenario == 'profile':
+        return 'GET', f"/profile/{rng.choice(fixture['usernames'])}", None
+    if scenario == 'leaderboard':
+        return 'GET', '/leaderboard', None
+    if scenario == 'tags':
+        return 'GET', '/tags/', None
+    if scenario == 'buy':
+        return 'POST', f"/marketplace/buy/{rng.choice(fixture['dream_ids'])}", {}
+    if scenario == 'rate':
+        owned = fixture['owned'].get(buyer_id) or fixture['dream_ids']
+        return 'POST', f'/marketplace/rate/{rng.choice(owned)}', {
+            'rating': rng.randint(1, 5), 'review': 'Benchmark review', 'dream_id': '',
+        }
+    raise ValueError(scenario)
+
+
+def log_in(session, username):
+    status, body = session.request('GET', '/auth/login')
+    match = CSRF_PATTERN.search(body.decode('utf-8', 'replace'))
+    session.csrf_token = match.group(1) if match else ''
+    status, _ = session.request('POST', '/auth/login', {
+        'username': username, 'password': SEED_PASSWORD, 'csrf_token': session.csrf_token,
+    })
+    return status == 302
+
+
+def run_scenario(scenario, make_session, fixture, requests, threads, seed):
+    """Issue `requests` requests split across `threads` sessions; return latencies and errors"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    buyers = fixture['buyers']
+
+    def worker(index, count):
+        rng = random.Random(seed + index)
+        session = make_session()
+        buyer_id, username = buyers[index % len(buyers)]
+        if scenario in ('buy', 'rate') and not log_in(session, username):
+            with lock:
+                errors[0] += count
+            return
+        local = []
+        local_errors = 0
+        for _ in range(count):
+            method, path, data = build_request(scenario, fixture, buyer_id, rng)
+            if data is not None:
+                data['csrf_token'] = session.csrf_token
+            started = time.perf_counter()
+            status, _ = session.request(method, path, data)
+            local.append(time.perf_counter() - started)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_thread)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """List scenarios whose p95 or throughput got worse than the baseline by more than `tolerance`"""
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{scenario}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-benchmark the main routes')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--threads', type=int, default=1, help='concurrent sessions per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--logged-in-users', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--save', default='benchmarks/results/latest.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before flagging (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        fixture = load_fixture(db, args.logged_in_users, random.Random(args.seed))
+
+    if args.url:
+        make_session = lambda: HttpSession(args.url)
+    else:
+        make_session = lambda: TestClientSession(app)
+
+    results = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'target': args.url or 'test-client',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1],
+        'threads': args.threads,
+        'scenarios': {},
+    }
+    print(f"{'scenario':>14} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scenario in args.scenarios.split(','):
+        result = run_scenario(scenario, make_session, fixture, args.requests, args.threads, args.seed)
+        results['scenarios'][scenario] = result
+        print(f"{scenario:>14} {result['requests']:>9} {result['errors']:>7} {result['throughput_rps']:>9} "
+              f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved results to {args.save}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            raise SystemExit(1)
+        print('No regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Show that log volume no longer adds to request latency.
+
+Every request emits --records log lines into a deliberately slow sink
+(each write sleeps --sink-latency-ms, like a congested disk or log
+shipper). The same load runs with an inline StreamHandler, the old
+basicConfig setup, and then with the queue pipeline from logging_setup.
+
+Usage: python -m benchmarks.logging_overhead [--requests 300] [--records 20]
+"""
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+from benchmarks.load_routes import percentile
+
+
+class SlowStream(io.TextIOBase):
+    def __init__(self, latency):
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.latency)
+        self.lines += 1
+        return len(text)
+
+
+def build_app(database_path, records):
+    from app import create_app
+    from migrations import init_db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_path}'})
+    with app.app_context():
+        init_db()
+    logger = logging.getLogger('benchmarks.chatty')
+
+    @app.before_request
+    def chatty():
+        for i in range(records):
+            logger.info('handling request, step %d', i)
+
+    return app
+
+
+def measure(app, requests):
+    client = app.test_client()
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        client.get('/leaderboard')
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {p: percentile(latencies, p) * 1000 for p in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inline and queued logging under load')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--records', type=int, default=20, help='log records per request')
+    parser.add_argument('--sink-latency-ms', type=float, default=0.2)
+    args = parser.parse_args()
+
+    from logging_setup import configure_logging, stop_logging
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(os.path.join(tmp, 'bench.db'), args.records)
+        root = logging.getLogger()
+        results = {}
+
+        # Logging disabled entirely: the floor
+        stop_logging()
+        root.handlers[:] = []
+        root.setLevel(logging.CRITICAL)
+        results['no logging'] = measure(app, args.requests)
+
+        # Inline handler: every write happens on the request thread
+        sink = SlowStream(args.sink_latency_ms / 1000)
+        root.handlers[:] = [logging.StreamHandler(sink)]
+        root.setLevel(logging.INFO)
+        results['inline handler'] = measure(app, args.requests)
+
+        # Queue pipeline: request threads only enqueue
+        sink = SlowStream(args.sink_latency_ms / 1000)
+        configure_logging(level='INFO', stream=sink, queue_size=args.requests * args.records * 2)
+        results['queue pipeline'] = measure(app, args.requests)
+        stop_logging()
+
+    print(f'{args.requests} requests x {args.records} records, sink latency {args.sink_latency_ms} ms/write')
+    for label, result in results.items():
+        print(f"{label:>15}: p50 {result[50]:7.2f} ms  p95 {result[95]:7.2f} ms  p99 {result[99]:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Time points ledger reads with and without balance snapshots.
+
+Seeds users with a long ledger history, snapshotting after each period
+as a scheduled `ledger snapshot` would, then times balance, earnings and
+balance-at-time lookups that sum every entry against lookups that read a
+snapshot plus the tail after it, and times the streaming verifier over
+every user. Uses a scratch SQLite file, so it never touches DATABASE_URL.
+
+Usage: python -m benchmarks.points_ledger [--users 5000] [--entries 1000] [--periods 10] [--tail 10]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from benchmarks.seed_data import chunked_execute
+
+
+START = datetime.utcnow() - timedelta(days=730)
+
+
+def seed_users(db, users):
+    from sqlalchemy import insert
+    from models import User
+    with db.engine.begin() as conn:
+        chunked_execute(conn, insert(User), ({'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com',
+                                              'password_hash': '-', 'points': 0, 'created_at': START}
+                                             for n in range(1, users + 1)), 20000)
+
+
+def seed_entries(db, users, first, last, entries, rng):
+    """Entries number first..last-1 (of `entries`, spread over two years) for every user, added to points"""
+    from sqlalchemy import insert
+    from models import LedgerEntry, User
+    balances = {}
+
+    def entry_rows():
+        for n in range(first, last):
+            created = START + timedelta(days=730 * n / entries)
+            for user_id in range(1, users + 1):
+                kind = 'opening' if n == 0 else rng.choice(('purchase', 'sale', 'bonus'))
+                amount = {'opening': 1000, 'purchase': -rng.randint(1, 50), 'sale': rng.randint(1, 50),
+                          'bonus': 100}[kind]
+                balances[user_id] = balances.get(user_id, 0) + amount
+                yield {'user_id': user_id, 'amount': amount, 'kind': kind, 'created_at': created}
+
+    with db.engine.begin() as conn:
+        chunked_execute(conn, insert(LedgerEntry), entry_rows(), 20000)
+        chunked_execute(conn, User.__table__.update().where(User.id == db.bindparam('user_id'))
+                        .values(points=User.points + db.bindparam('delta')),
+                        ({'user_id': user_id, 'delta': delta} for user_id, delta in balances.items()), 20000)
+
+
+def add_tail(db, users, tail):
+    """`tail` recent bonus entries per user, after the snapshots"""
+    from sqlalchemy import insert, update
+    from models import LedgerEntry, User
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        rows = ({'user_id': user_id, 'amount': 1, 'kind': 'bonus', 'created_at': now}
+                for _ in range(tail) for user_id in range(1, users + 1))
+        chunked_execute(conn, insert(LedgerEntry), rows, 20000)
+        conn.execute(update(User).values(points=User.points + tail))
+
+
+def full_scan_totals(db, user_id, when=None):
+    """What every lookup costs without snapshots: sum all of the user's entries"""
+    from sqlalchemy import func
+    from models import LedgerEntry
+    from ledger import EARNED, SPENT
+    query = db.session.query(func.sum(LedgerEntry.amount), func.sum(EARNED), func.sum(SPENT)) \
+        .filter(LedgerEntry.user_id == user_id)
+    if when is not None:
+        query = query.filter(LedgerEntry.created_at <= when)
+    return query.one()
+
+
+def time_lookups(fn, user_ids):
+    timings = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        fn(user_id)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--entries', type=int, default=1000, help='ledger entries per user')
+    parser.add_argument('--periods', type=int, default=10, help='snapshot runs spread over the history')
+    parser.add_argument('--tail', type=int, default=10, help='entries per user after the snapshot')
+    parser.add_argument('--lookups', type=int, default=500)
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    import ledger
+
+    path = os.path.join(tempfile.mkdtemp(), 'ledger.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'LEDGER_SNAPSHOT_LAG_SECONDS': 0})
+    with app.app_context():
+        init_db()
+        seed_users(db, args.users)
+        rng = random.Random(42)
+        seeding = snapshotting = 0.0
+        bounds = [args.entries * period // args.periods for period in range(args.periods + 1)]
+        for first, last in zip(bounds, bounds[1:]):
+            started = time.perf_counter()
+            seed_entries(db, args.users, first, last, args.entries, rng)
+            seeding += time.perf_counter() - started
+            started = time.perf_counter()
+            ledger.take_snapshots()
+            snapshotting += time.perf_counter() - started
+        add_tail(db, args.users, args.tail)
+        print(f'Seeded {args.users:,} users x {args.entries} entries in {seeding:.1f}s ({path})')
+        print(f'Snapshots:   {args.periods} runs over {args.users:,} users in {snapshotting:.2f}s '
+              f'({snapshotting / args.periods:.2f}s per run)')
+
+        user_ids = random.Random(7).sample(range(1, args.users + 1), min(args.lookups, args.users))
+        for user_id in user_ids[:20]:
+            expected = ledger.totals(user_id)
+            assert tuple(full_scan_totals(db, user_id)) == (expected['balance'], expected['earned'], expected['spent'])
+        when = START + timedelta(days=500)
+        for user_id in user_ids[:20]:
+            assert ledger.balance_at(user_id, when) == full_scan_totals(db, user_id, when)[0]
+        print(f'Totals:      full scan p50 {time_lookups(lambda u: full_scan_totals(db, u), user_ids):.3f}ms, '
+              f'snapshot + {args.tail}-entry tail p50 {time_lookups(ledger.totals, user_ids):.3f}ms')
+        print(f'Balance at:  full scan p50 {time_lookups(lambda u: full_scan_totals(db, u, when), user_ids):.3f}ms, '
+              f'snapshot + tail p50 {time_lookups(lambda u: ledger.balance_at(u, when), user_ids):.3f}ms')
+
+        started = time.perf_counter()
+        mismatches = list(ledger.find_mismatches())
+        assert not mismatches
+        print(f'Verify:      {args.users:,} users checked in {time.perf_counter() - started:.2f}s, no mismatches')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Bulk-generate realistic marketplace data for local load testing.
+
+Rows go in through Core executemany inserts in chunks, so production-sized
+datasets (100k users, 1M dreams, millions of purchases and ratings) load
+in minutes. Point DATABASE_URL at a scratch database first.
+
+Usage: python -m benchmarks.seed_data --preset production [--reset]
+"""
+import argparse
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func, select, text, update
+from werkzeug.security import generate_password_hash
+
+PRESETS = {
+    'small': dict(users=1000, dreams=5000, purchases=20000, ratings=8000),
+    'medium': dict(users=10000, dreams=100000, purchases=400000, ratings=150000),
+    'production': dict(users=100000, dreams=1000000, purchases=4000000, ratings=1500000),
+}
+
+# Every seeded user can log in with this password
+SEED_PASSWORD = 'dreamer-password'
+
+CATEGORY_WEIGHTS = {'surreal': 30, 'funny': 20, 'scary': 20, 'romantic': 15, 'bizarre': 15}
+ADJECTIVES = ['floating', 'endless', 'melting', 'whispering', 'upside-down', 'glowing', 'haunted',
+              'velvet', 'clockwork', 'forgotten', 'electric', 'silent', 'tangled', 'crystal', 'lunar']
+NOUNS = ['library', 'ocean', 'staircase', 'carnival', 'forest', 'train', 'lighthouse', 'garden',
+         'city', 'mirror', 'desert', 'piano', 'whale', 'cathedral', 'balloon', 'market']
+PHRASES = ['I was walking through', 'Suddenly everyone turned into', 'The sky opened above',
+           'My childhood friend appeared inside', 'Time ran backwards across', 'I could fly over',
+           'Nobody noticed the', 'Every door led to another', 'The floor dissolved into']
+
+
+def skewed_index(rng, n, skew):
+    """Pick an index in [0, n) where low indices are much more likely (power law)"""
+    return min(n - 1, int(n * rng.random() ** skew))
+
+
+def chunked_execute(conn, statement, rows_iter, chunk_size):
+    """Run a statement with executemany over rows from an iterator, one chunk at a time"""
+    total = 0
+    chunk = []
+    for row in rows_iter:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(statement, chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        conn.execute(statement, chunk)
+        total += len(chunk)
+    return total
+
+
+def seed(db, users, dreams, purchases, ratings, chunk_size=5000, seed_value=42, reset=False):
+    """Generate the dataset and return timing per table"""
+    from models import User, Dream, Purchase, Rating, make_excerpt
+    from migrations import upgrade
+    from facets import rebuild as rebuild_facets
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    start = now - timedelta(days=730)
+    timings = {}
+
+    if reset:
+        db.drop_all()
+    upgrade()
+
+    with db.engine.begin() as conn:
+        first_user = (conn.execute(select(func.max(User.id))).scalar() or 0) + 1
+        first_dream = (conn.execute(select(func.max(Dream.id))).scalar() or 0) + 1
+
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    user_created = array('d')
+
+    def user_rows():
+        for i in range(users):
+            created = start + timedelta(seconds=rng.random() * 700 * 86400)
+            user_created.append(created.timestamp())
+            n = first_user + i
+            yield {
+                'id': n,
+                'username': f'dreamer{n}',
+                'email': f'dreamer{n}@example.com',
+                'password_hash': password_hash,
+                'points': int(rng.lognormvariate(7, 0.8)),
+                'created_at': created,
+                'bio': None,
+                'dream_tag': None,
+            }
+
+    categories = list(CATEGORY_WEIGHTS)
+    weights = list(CATEGORY_WEIGHTS.values())
+    dream_author = array('l')
+    dream_price = array('l')
+
+    def dream_rows():
+        for i in range(dreams):
+            # A few prolific authors write most dreams
+            author_index = skewed_index(rng, users, 2.5)
+            author_created = datetime.fromtimestamp(user_created[author_index])
+            created = author_created + (now - author_created) * rng.random()
+            price = max(1, min(10000, int(rng.lognormvariate(4.5, 1.0))))
+            dream_author.append(first_user + author_index)
+            dream_price.append(price)
+            title = f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'
+            description = ' '.join(
+                f'{rng.choice(PHRASES)} a {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}.'
+                for _ in range(rng.randint(2, 12))
+            )
+            yield {
+                'id': first_dream + i,
+                'title': title,
+                'description': description,
+                'excerpt': make_excerpt(description),
+                'category': rng.choices(categories, weights)[0],
+                'price': price,
+                'image_filename': None,
+                'created_at': created,
+                'average_rating': 0.0,
+                'total_ratings': 0,
+                'author_id': first_user + author_index,
+            }
+
+    # Each (buyer, dream) pair is unique; ratings only come from buyers
+    purchased = set()
+    purchase_pairs = array('q')
+
+    def purchase_rows():
+        attempts = 0
+        while len(purchase_pairs) < purchases and attempts < purchases * 3:
+            attempts += 1
+            dream_index = skewed_index(rng, dreams, 3.0)  # popular dreams sell most
+            buyer = first_user + rng.randrange(users)
+            if buyer == dream_author[dream_index]:
+                continue
+            key = buyer * (dreams + 1) + dream_index
+            if key in purchased:
+                continue
+            purchased.add(key)
+            purchase_pairs.append(key)
+            yield {
+                'buyer_id': buyer,
+                'dream_id': first_dream + dream_index,
+                'purchase_date': now - timedelta(seconds=rng.random() * 365 * 86400),
+                'price_paid': dream_price[dream_index],
+            }
+
+    def rating_rows():
+        count = min(ratings, len(purchase_pairs))
+        for position in rng.sample(range(len(purchase_pairs)), count):
+            buyer, dream_index = divmod(purchase_pairs[position], dreams + 1)
+            yield {
+                'rater_id': buyer,
+                'dream_id': first_dream + dream_index,
+                'rating': rng.choices([1, 2, 3, 4, 5], [5, 8, 20, 37, 30])[0],
+                'review': None if rng.random() < 0.7 else 'Vivid and strange, would dream again.',
+                'created_at': now - timedelta(seconds=rng.random() * 300 * 86400),
+            }
+
+    for name, table, rows in (('users', User.__table__, user_rows()),
+                              ('dreams', Dream.__table__, dream_rows()),
+                              ('purchases', Purchase.__table__, purchase_rows()),
+                              ('ratings', Rating.__table__, rating_rows())):
+        started = time.perf_counter()
+        with db.engine.begin() as conn:
+            inserted = chunked_execute(conn, table.insert(), rows, chunk_size)
+        timings[name] = (inserted, time.perf_counter() - started)
+
+    # Explicit ids bypass Postgres sequences; move them past the new rows
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            for table in ('user', 'dream'):
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), (SELECT max(id) FROM \"{table}\"))"
+                ))
+
+    # Denormalized rating columns: one grouped scan, then executemany updates
+    started = time.perf_counter()
+    stats = select(Rating.dream_id, func.avg(Rating.rating), func.count(Rating.id)) \
+        .where(Rating.dream_id >= first_dream).group_by(Rating.dream_id)
+    statement = update(Dream.__table__).where(Dream.__table__.c.id == bindparam('dream_id')) \
+        .values(average_rating=bindparam('average'), total_ratings=bindparam('count'))
+    with db.engine.begin() as conn:
+        rows = ({'dream_id': dream_id, 'average': round(average, 1), 'count': count}
+                for dream_id, average, count in conn.execute(stats).all())
+        updated = chunked_execute(conn, statement, rows, chunk_size)
+    timings['rating rollup'] = (updated, time.perf_counter() - started)
+
+    # Core inserts skip the ORM flush that maintains the marketplace facet counts
+    started = time.perf_counter()
+    with db.engine.begin() as conn:
+        rebuild_facets(conn)
+    timings['facet counts'] = (dreams, time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the database with synthetic marketplace data')
+    parser.add_argument('--preset', choices=PRESETS, default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--dreams', type=int)
+    parser.add_argument('--purchases', type=int)
+    parser.add_argument('--ratings', type=int)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    args = parser.parse_args()
+
+    sizes = dict(PRESETS[args.preset])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    from app import create_app
+    from extensions import db
+    app = create_app()
+    with app.app_context():
+        print(f"Seeding {app.config['SQLALCHEMY_DATABASE_URI']} with {sizes}")
+        timings = seed(db, chunk_size=args.chunk_size, seed_value=args.seed, reset=args.reset, **sizes)
+    for name, (rows, seconds) in timings.items():
+        print(f'{name:>14}: {rows:>9,} rows in {seconds:7.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)')
+    print(f"Seeded users log in with password '{SEED_PASSWORD}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare SQLite read/write concurrency with the default engine setup and
+with the production profile from sqlite_profile.py.
+
+Usage: python -m benchmarks.sqlite_concurrency [--readers 8] [--writers 2] [--seconds 5]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlite_profile import engine_options, configure_sqlite_engine
+
+
+def make_engine(path, profile):
+    url = f'sqlite:///{path}'
+    if profile:
+        engine = create_engine(url, **engine_options(url))
+        configure_sqlite_engine(engine)
+    else:
+        # What the app used before: rollback journal, default timeout
+        engine = create_engine(url, pool_recycle=300, pool_pre_ping=True)
+    return engine
+
+
+def seed(engine, rows):
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE dream (id INTEGER PRIMARY KEY, title TEXT, price INTEGER)'))
+        conn.execute(text('INSERT INTO dream (title, price) VALUES (:title, :price)'),
+                     [{'title': f'dream {i}', 'price': i % 500} for i in range(rows)])
+
+
+def run(engine, readers, writers, seconds):
+    stop = time.monotonic() + seconds
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def reader():
+        done = errors = 0
+        while time.monotonic() < stop:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT count(*), avg(price) FROM dream WHERE price > :p'),
+                                 {'p': done % 500}).one()
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts['reads'] += done
+            counts['errors'] += errors
+
+    def writer():
+        done = errors = 0
+        while time.monotonic() < stop:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text('UPDATE dream SET price = price + 1 WHERE id = :id'),
+                                 {'id': done % 1000 + 1})
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts['writes'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {name: value / seconds if name != 'errors' else value for name, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    for label, profile in (('default', False), ('production profile', True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            engine = make_engine(path, profile)
+            seed(engine, args.rows)
+            result = run(engine, args.readers, args.writers, args.seconds)
+            engine.dispose()
+        print(f"{label:>20}: {result['reads']:9.0f} reads/s  {result['writes']:8.0f} writes/s  "
+              f"{result['errors']:5d} lock errors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measure worker startup: module import, create_app() and the first request.
+
+Each sample runs in a fresh interpreter, like a newly forked gunicorn
+worker without --preload. The database must already be migrated.
+
+Usage: python -m benchmarks.startup [--runs 10] [--path /]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+application = app_module.create_app()
+created = time.perf_counter()
+response = application.test_client().get(sys.argv[1])
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (finished - created) * 1000,
+    'status': response.status_code,
+}))
+"""
+
+
+def sample(path):
+    output = subprocess.run([sys.executable, '-c', PROBE, path], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import plus first-request latency')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    samples = [sample(args.path) for _ in range(args.runs)]
+    statuses = {s['status'] for s in samples}
+    print(f'{args.runs} fresh interpreters, first request GET {args.path} (status {", ".join(map(str, statuses))})')
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms'):
+        values = [s[key] for s in samples]
+        print(f'{key:>17}: median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}')
+    totals = [s['import_ms'] + s['create_app_ms'] + s['first_request_ms'] for s in samples]
+    print(f"{'total_ms':>17}: median {statistics.median(totals):8.1f}")
+
+
+if __name__ == '__main__':
+    main()
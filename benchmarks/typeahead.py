@@ -0,0 +1,129 @@
+"""
+Time typeahead lookups in the in-memory prefix index against LIKE queries.
+
+Builds the index over synthetic dream titles and reports build time and
+lookup latency percentiles for prefixes of one to eight characters, then
+runs a sample of the same prefixes as `LIKE 'q%'` queries ordered by
+rating on a scratch SQLite copy of the titles. Checks every result
+against a brute-force scan, before and after applying a batch of
+renames, rating changes and deletes through the overlay. Never touches
+DATABASE_URL.
+
+Usage: python -m benchmarks.typeahead [--titles 1000000] [--lookups 20000] [--sql-lookups 50]
+"""
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from benchmarks.seed_data import ADJECTIVES, NOUNS
+
+
+def make_titles(count, rng):
+    patterns = ('The {adjective} {noun}', '{Adjective} {noun} of the {other}', 'A {noun} made of {other}s')
+    for n in range(1, count + 1):
+        title = rng.choice(patterns).format(adjective=rng.choice(ADJECTIVES), Adjective=rng.choice(ADJECTIVES).title(),
+                                            noun=rng.choice(NOUNS), other=rng.choice(NOUNS))
+        if rng.random() < 0.5:
+            title += f' #{rng.randint(1, 99999)}'
+        yield n, title, round(rng.uniform(0, 5), 1)
+
+
+def brute_force(entries, prefix, k):
+    key = prefix.casefold()
+    matches = [entry for entry in entries.values() if entry[1].casefold().startswith(key)]
+    matches.sort(key=lambda entry: (-entry[2], entry[1].casefold(), entry[0]))
+    return matches[:k]
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return {name: timings[min(len(timings) - 1, int(len(timings) * q))] * 1e6
+            for name, q in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--titles', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--sql-lookups', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=8)
+    parser.add_argument('--checks', type=int, default=200, help='prefixes checked against a brute-force scan')
+    args = parser.parse_args()
+
+    from typeahead import PrefixIndex
+
+    rng = random.Random(42)
+    entries = {entry[0]: entry for entry in make_titles(args.titles, rng)}
+    started = time.perf_counter()
+    index = PrefixIndex(entries.values())
+    print(f'Built index over {len(index):,} titles in {time.perf_counter() - started:.1f}s')
+
+    titles = [entry[1] for entry in entries.values()]
+    prefixes = [rng.choice(titles)[:rng.randint(1, 8)] for _ in range(args.lookups)]
+
+    timings = []
+    gc.collect()  # don't bill the lookups for collecting the generated titles
+    for prefix in prefixes:
+        started = time.perf_counter()
+        index.search(prefix, args.limit)
+        timings.append(time.perf_counter() - started)
+    stats = percentiles(timings)
+    print(f'Index lookups ({args.lookups:,}): p50 {stats["p50"]:.0f}us, p99 {stats["p99"]:.0f}us, '
+          f'max {stats["max"]:.0f}us')
+
+    for prefix in prefixes[:args.checks]:
+        assert index.search(prefix, args.limit) == brute_force(entries, prefix, args.limit), prefix
+
+    # The same lookups as LIKE queries: SQLite has to scan and sort every match
+    path = os.path.join(tempfile.mkdtemp(), 'typeahead.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE dream (id INTEGER PRIMARY KEY, title VARCHAR(200), average_rating FLOAT)')
+    conn.executemany('INSERT INTO dream VALUES (?, ?, ?)', entries.values())
+    conn.commit()
+    timings = []
+    for prefix in prefixes[:args.sql_lookups]:
+        started = time.perf_counter()
+        conn.execute("SELECT id, title, average_rating FROM dream WHERE title LIKE ? ESCAPE '\\' "
+                     'ORDER BY average_rating DESC LIMIT ?',
+                     (prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%', args.limit)).fetchall()
+        timings.append(time.perf_counter() - started)
+    conn.close()
+    print(f'LIKE queries ({args.sql_lookups}):      median {statistics.median(timings) * 1000:.1f}ms, '
+          f'max {max(timings) * 1000:.1f}ms')
+
+    # Changes go to the overlay; results must match a scan of the changed data
+    changes = {}
+    for entry_id in rng.sample(sorted(entries), 1500):
+        kind = rng.random()
+        if kind < 0.3:
+            changes[entry_id] = None
+            del entries[entry_id]
+        else:
+            title = entries[entry_id][1] if kind < 0.6 else rng.choice(titles)[:12] + ' (renamed)'
+            changes[entry_id] = (title, round(rng.uniform(0, 5), 1))
+            entries[entry_id] = (entry_id, title, changes[entry_id][1])
+    for n in range(500):
+        entry_id = args.titles + n + 1
+        changes[entry_id] = (f'{rng.choice(titles)[:10]} new {n}', 5.0)
+        entries[entry_id] = (entry_id, *changes[entry_id])
+    index.apply(changes)
+
+    timings = []
+    gc.collect()  # don't bill the lookups for collecting the generated titles
+    for prefix in prefixes:
+        started = time.perf_counter()
+        index.search(prefix, args.limit)
+        timings.append(time.perf_counter() - started)
+    stats = percentiles(timings)
+    for prefix in prefixes[:args.checks]:
+        assert index.search(prefix, args.limit) == brute_force(entries, prefix, args.limit), prefix
+    print(f'With {len(index.overlay):,} overlay changes: p50 {stats["p50"]:.0f}us, p99 {stats["p99"]:.0f}us; '
+          f'results match a full scan')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Time the weekly bonus job on a large user table.
+
+Compares a per-user ORM loop (on a sample, extrapolated) with the chunked
+set-based job in bonus.py, reports how long each chunk holds the write
+lock, and checks that a run killed halfway resumes without paying anyone
+twice, in points or in the ledger. Uses a scratch SQLite file, so it never
+touches DATABASE_URL.
+
+Usage: python -m benchmarks.weekly_bonus [--users 1000000] [--orm-users 20000] [--chunk-size 5000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.seed_data import chunked_execute
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+def seed_users(db, users):
+    from sqlalchemy import insert
+    from models import User
+    joined = datetime(2020, 1, 1)  # before every week the benchmark pays
+    rows = ({'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+             'points': 1000, 'created_at': joined} for n in range(1, users + 1))
+    with db.engine.begin() as conn:
+        chunked_execute(conn, insert(User), rows, 20000)
+
+
+def total_points(db):
+    from sqlalchemy import func, select
+    from models import User
+    with db.engine.connect() as conn:
+        return conn.execute(select(func.sum(User.points))).scalar()
+
+
+def ledger_bonuses(db):
+    from sqlalchemy import func, select
+    from models import LedgerEntry
+    with db.engine.connect() as conn:
+        return conn.execute(select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+                            .where(LedgerEntry.kind == 'bonus')).scalar()
+
+
+def orm_loop(db, users, amount):
+    """What a naive job does: load every user and bump points one object at a time"""
+    from models import User
+    started = time.perf_counter()
+    for user in User.query.filter(User.id <= users).all():
+        user.points += amount
+    db.session.commit()
+    return time.perf_counter() - started
+
+
+def timed_chunks(crash_after=None):
+    """Wrap bonus._pay_chunk to record each chunk's duration, optionally failing after N chunks"""
+    import bonus
+    original = bonus._pay_chunk
+    durations = []
+
+    def wrapper(conn, run, chunk_size):
+        if crash_after is not None and len(durations) >= crash_after:
+            raise SimulatedCrash()
+        started = time.perf_counter()
+        original(conn, run, chunk_size)
+        durations.append(time.perf_counter() - started)
+
+    bonus._pay_chunk = wrapper
+    return durations, lambda: setattr(bonus, '_pay_chunk', original)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--orm-users', type=int, default=20000, help='users in the ORM loop sample')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    from bonus import pay_weekly_bonus
+
+    path = os.path.join(tempfile.mkdtemp(), 'bonus.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    amount = app.config['WEEKLY_BONUS_POINTS']
+    with app.app_context():
+        init_db()
+        started = time.perf_counter()
+        seed_users(db, args.users)
+        print(f'Seeded {args.users:,} users in {time.perf_counter() - started:.1f}s ({path})')
+
+        sample = min(args.orm_users, args.users)
+        elapsed = orm_loop(db, sample, amount)
+        print(f'ORM loop:      {sample:,} users in {elapsed:.2f}s '
+              f'-> ~{elapsed * args.users / sample:.0f}s for {args.users:,}, in one transaction')
+
+        before = total_points(db)
+        durations, restore = timed_chunks()
+        started = time.perf_counter()
+        run = pay_weekly_bonus('2026-W01', args.chunk_size)
+        elapsed = time.perf_counter() - started
+        restore()
+        assert total_points(db) - before == run.users_credited * amount == args.users * amount
+        print(f'Set-based job: {run.users_credited:,} users in {elapsed:.2f}s, {len(durations)} chunks of '
+              f'{args.chunk_size:,}; write lock held p50 {statistics.median(durations) * 1000:.1f}ms, '
+              f'max {max(durations) * 1000:.1f}ms')
+
+        # Kill a run halfway, then resume it
+        before = total_points(db)
+        durations, restore = timed_chunks(crash_after=len(durations) // 2)
+        try:
+            pay_weekly_bonus('2026-W02', args.chunk_size)
+        except SimulatedCrash:
+            pass
+        restore()
+        partial = total_points(db) - before
+        run = pay_weekly_bonus('2026-W02', args.chunk_size)
+        again = pay_weekly_bonus('2026-W02', args.chunk_size)
+        paid = total_points(db) - before
+        assert paid == args.users * amount and again.users_credited == run.users_credited
+        assert ledger_bonuses(db) == 2 * args.users * amount  # one ledger entry per credit, none doubled
+        print(f'Crash/resume:  {partial // amount:,} users paid before the crash, '
+              f'{paid // amount:,} after resuming, rerun paid nothing extra')
+
+
+if __name__ == '__main__':
+    main()
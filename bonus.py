@@ -0,0 +1,108 @@
+"""
+Weekly bonus points for Neural Dreams Inc.
+Each ISO week gets one bonus_run row. Users are credited in id-ordered
+chunks by set-based UPDATEs, and every chunk advances the run's
+last_user_id in the same transaction, so a crashed or interrupted run
+resumes where it stopped and nobody is paid twice. The same transaction
+appends each credit to the points ledger.
+
+    flask --app app weekly-bonus                  # the current week
+    flask --app app weekly-bonus --week 2026-W42  # pay or resume a given week
+"""
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from ledger import record_many
+from models import BonusRun, User
+
+
+def week_key(day):
+    """ISO week of a date, e.g. 2026-W42"""
+    year, week, _ = day.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def week_start(run_key):
+    """Monday 00:00 of an ISO week key; raises ValueError when malformed"""
+    return datetime.strptime(run_key + '-1', '%G-W%V-%u')
+
+
+def _get_or_create_run(run_key, amount):
+    table = BonusRun.__table__
+    with db.engine.begin() as conn:
+        run = conn.execute(select(table).where(table.c.run_key == run_key)).first()
+    if run is not None:
+        return run
+    try:
+        with db.engine.begin() as conn:
+            # Users who joined before the week started are eligible, fixed for every resume
+            conn.execute(insert(table).values(run_key=run_key, amount=amount, eligible_before=week_start(run_key),
+                                              last_user_id=0, users_credited=0, started_at=datetime.utcnow()))
+    except IntegrityError:
+        pass  # another process created it first
+    with db.engine.begin() as conn:
+        return conn.execute(select(table).where(table.c.run_key == run_key)).one()
+
+
+def _pay_chunk(conn, run, chunk_size):
+    """Credit the next chunk of users, or mark the run finished when none are left"""
+    runs = BonusRun.__table__
+    low = run.last_user_id
+    high = conn.execute(select(User.id).where(User.id > low).order_by(User.id)
+                        .offset(chunk_size - 1).limit(1)).scalar()
+    if high is None:
+        high = conn.execute(select(func.max(User.id)).where(User.id > low)).scalar()
+    if high is None:
+        conn.execute(update(runs).where(runs.c.id == run.id, runs.c.finished_at.is_(None))
+                     .values(finished_at=datetime.utcnow()))
+        return
+
+    # Claim the range first: if another process already moved the cursor, pay nothing
+    claimed = conn.execute(update(runs).where(runs.c.id == run.id, runs.c.last_user_id == low)
+                           .values(last_user_id=high)).rowcount
+    if claimed:
+        eligible = (User.id > low, User.id <= high,
+                    or_(User.created_at.is_(None), User.created_at < run.eligible_before))
+        credited = conn.execute(update(User.__table__).where(*eligible)
+                                .values(points=User.points + run.amount)).rowcount
+        record_many(conn, select(User.id).where(*eligible), run.amount, 'bonus', run.id)
+        conn.execute(update(runs).where(runs.c.id == run.id)
+                     .values(users_credited=runs.c.users_credited + credited))
+
+
+def pay_weekly_bonus(run_key=None, chunk_size=None):
+    """Pay (or resume paying) a week's bonus; returns the finished BonusRun row"""
+    run_key = run_key or week_key(datetime.utcnow())
+    chunk_size = chunk_size or current_app.config['WEEKLY_BONUS_CHUNK_SIZE']
+    run = _get_or_create_run(run_key, current_app.config['WEEKLY_BONUS_POINTS'])
+    runs = BonusRun.__table__
+    while run.finished_at is None:
+        # One short transaction per chunk; the cursor and the credits commit together
+        with db.engine.begin() as conn:
+            _pay_chunk(conn, run, chunk_size)
+            run = conn.execute(select(runs).where(runs.c.id == run.id)).one()
+    return run
+
+
+@click.command('weekly-bonus')
+@with_appcontext
+@click.option('--week', help='ISO week to pay, e.g. 2026-W42 [default: the current week].')
+@click.option('--chunk-size', type=int, help='Users credited per transaction [default: WEEKLY_BONUS_CHUNK_SIZE].')
+def weekly_bonus_command(week, chunk_size):
+    """Credit WEEKLY_BONUS_POINTS to every eligible user, once per week."""
+    if week:
+        try:
+            week_start(week)
+        except ValueError:
+            raise click.BadParameter('Use an ISO week such as 2026-W42.', param_hint='--week')
+    run = pay_weekly_bonus(week, chunk_size)
+    click.echo(f'{run.run_key}: {run.users_credited} user(s) credited {run.amount} points '
+               f'(finished {run.finished_at:%Y-%m-%d %H:%M:%S}).')
+
+
+def init_bonus(app):
+    app.cli.add_command(weekly_bonus_command)
@@ -0,0 +1,454 @@
+"""
+Shared cache for Neural Dreams Inc.
+One Cache API over three backends: an in-process LRU (single worker only),
+a SQLite file shared by all workers on a host, and Redis. Entries can carry
+tags such as 'dream:12'; invalidating a tag stores a new version for it in
+the backend, so every worker sees the invalidation on its next read
+"""
+import hashlib
+import hmac
+import math
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from replicas import RoutingSession
+
+MISSING = object()
+
+
+def _take_token(state, now, capacity, rate):
+    """Refill a (tokens, updated) bucket up to `now` and take one token from it"""
+    tokens, updated = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, (tokens - 1, now)
+    return False, (tokens, now)
+
+
+class LocalBackend:
+    """Thread-safe LRU in this process; invalidations do not reach other workers"""
+
+    shared = False
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+        return MISSING if entry is None else entry[0]
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._live(key, time.monotonic()) is not None:
+                return False
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def take_token(self, key, capacity, rate, now):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            allowed, state = _take_token(entry and entry[0], now, capacity, rate)
+            # An entry that outlived a full refill would read the same as a missing one
+            self._entries[key] = (state, time.monotonic() + capacity / rate)
+            self._entries.move_to_end(key)
+        return allowed
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SignedPickle:
+    """Pickles values behind an HMAC of the app's secret key, so entries that
+    someone else planted or altered in a shared backend are never unpickled"""
+
+    def __init__(self, secret):
+        if isinstance(secret, str):
+            secret = secret.encode()
+        self.key = hashlib.sha256(b'neuraldreams-cache:' + secret).digest()
+
+    def dumps(self, value):
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return hmac.new(self.key, payload, hashlib.sha256).digest() + payload
+
+    def loads(self, blob):
+        signature, payload = bytes(blob[:32]), bytes(blob[32:])
+        if not hmac.compare_digest(signature, hmac.new(self.key, payload, hashlib.sha256).digest()):
+            return MISSING
+        return pickle.loads(payload)
+
+
+class SQLiteBackend:
+    """Entries in a WAL-mode SQLite file that all workers on the host share"""
+
+    shared = True
+    PRUNE_EVERY = 500  # writes between sweeps of expired rows
+
+    def __init__(self, path, secret):
+        self.path = path
+        self.serializer = SignedPickle(secret)
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._conn().execute('CREATE TABLE IF NOT EXISTS cache_entries '
+                             '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)')
+        _check_private(path)
+
+    def _conn(self):
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value, expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return MISSING
+        return self.serializer.loads(row[0])
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        now = time.time()
+        placeholders = ','.join('?' * len(keys))
+        rows = self._conn().execute(f'SELECT key, value, expires FROM cache_entries WHERE key IN ({placeholders})',
+                                    list(keys)).fetchall()
+        found = {key: self.serializer.loads(value) for key, value, expires in rows if expires is None or expires >= now}
+        return [found.get(key, MISSING) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)',
+                     (key, self.serializer.dumps(value), expires))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM cache_entries WHERE expires < ?', (time.time(),))
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM cache_entries WHERE key = ? AND expires < ?', (key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)',
+                                  (key, self.serializer.dumps(value), now + ttl if ttl else None))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def take_token(self, key, capacity, rate, now):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value, expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            state = None
+            if row is not None and (row[1] is None or row[1] >= time.time()):
+                state = self.serializer.loads(row[0])
+            allowed, state = _take_token(None if state is MISSING else state, now, capacity, rate)
+            conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)',
+                         (key, self.serializer.dumps(state), time.time() + capacity / rate))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache_entries')
+
+
+class RedisBackend:
+    """Entries in Redis; pass `client` to use an existing or stand-in client"""
+
+    shared = True
+    # Token buckets are plain hashes updated server-side, so concurrent workers never lose a take
+    TAKE_TOKEN_SCRIPT = """
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        redis.call('PEXPIRE', KEYS[1], ARGV[4])
+        return allowed
+    """
+
+    def __init__(self, url=None, client=None, prefix='nd:', secret=None):
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.serializer = SignedPickle(secret)
+        self._take_token = None
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return MISSING if raw is None else self.serializer.loads(raw)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return [MISSING if raw is None else self.serializer.loads(raw)
+                for raw in self.client.mget([self.prefix + key for key in keys])]
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, self.serializer.dumps(value),
+                        px=math.ceil(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(self.prefix + key, self.serializer.dumps(value),
+                                    nx=True, px=math.ceil(ttl * 1000) if ttl else None))
+
+    def take_token(self, key, capacity, rate, now):
+        if self._take_token is None:
+            self._take_token = self.client.register_script(self.TAKE_TOKEN_SCRIPT)
+        return bool(self._take_token(keys=[self.prefix + key],
+                                     args=[capacity, rate, repr(now), math.ceil(capacity / rate * 1000)]))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache:
+    """Tagged get/set with request coalescing on top of a backend"""
+
+    def __init__(self, backend, default_ttl=300, lock_timeout=10):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.lock_timeout = lock_timeout
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def tag_versions(self, tags):
+        """Current version of each tag, creating versions for tags never seen"""
+        if not tags:
+            return {}
+        tags = sorted(set(tags))
+        versions = dict(zip(tags, self.backend.get_many(['tag:' + tag for tag in tags])))
+        for tag, version in versions.items():
+            if version is MISSING:
+                # Create it now: if the version is later evicted, entries read as stale
+                token = uuid.uuid4().hex
+                if not self.backend.add('tag:' + tag, token):
+                    token = self.backend.get('tag:' + tag)
+                versions[tag] = token
+        return versions
+
+    def _lookup(self, key):
+        entry = self.backend.get(key)
+        if entry is MISSING:
+            return MISSING
+        value, versions = entry
+        if versions:
+            current = self.backend.get_many(['tag:' + tag for tag in versions])
+            if list(versions.values()) != current:
+                return MISSING
+        return value
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is MISSING else value
+
+    def set(self, key, value, ttl=None, tags=(), versions=None):
+        """Store `value`; pass `versions` from tag_versions() taken before computing it"""
+        if versions is None:
+            versions = self.tag_versions(tags)
+        self.backend.set(key, (value, versions), ttl or self.default_ttl)
+
+    def add(self, key, value, ttl=None):
+        """Store `value` only if `key` holds no live entry; True when stored"""
+        return self.backend.add(key, (value, {}), ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def take_token(self, key, capacity, rate):
+        """Take one token from the bucket `key` (`capacity` burst, refilled at
+        `rate` tokens per second); False when it is empty. Shared backends give
+        every worker the same bucket"""
+        return self.backend.take_token(key, capacity, rate, time.time())
+
+    def invalidate(self, *tags):
+        """Expire every entry carrying any of `tags`, in all workers"""
+        for tag in set(tags):
+            self.backend.set('tag:' + tag, uuid.uuid4().hex)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _flight_lock(self, key):
+        with self._flights_lock:
+            lock, waiters = self._flights.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._flights[key] = (lock, waiters + 1)
+        return lock
+
+    def _release_flight(self, key):
+        with self._flights_lock:
+            lock, waiters = self._flights[key]
+            if waiters == 1:
+                del self._flights[key]
+            else:
+                self._flights[key] = (lock, waiters - 1)
+
+    def get_or_set(self, key, producer, ttl=None, tags=()):
+        """Get `key`, or compute it with `producer` exactly once across threads and workers"""
+        value = self._lookup(key)
+        if value is not MISSING:
+            return value
+
+        lock = self._flight_lock(key)
+        try:
+            # Threads in this worker queue behind one producer
+            with lock:
+                value = self._lookup(key)
+                if value is not MISSING:
+                    return value
+                return self._produce(key, producer, ttl, tags)
+        finally:
+            self._release_flight(key)
+
+    def _produce(self, key, producer, ttl, tags):
+        # Read versions first so an invalidation during `producer` wins
+        versions = self.tag_versions(tags)
+        lock_key = 'lock:' + key
+        if self.backend.add(lock_key, os.getpid(), self.lock_timeout):
+            try:
+                value = producer()
+                self.set(key, value, ttl, versions=versions)
+                return value
+            finally:
+                self.backend.delete(lock_key)
+
+        # Another worker is producing it: wait for its result
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.005
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+            value = self._lookup(key)
+            if value is not MISSING:
+                return value
+            if self.backend.get(lock_key) is MISSING:
+                break
+        value = producer()
+        self.set(key, value, ttl, versions=versions)
+        return value
+
+
+def _check_private(path):
+    """Refuse a cache file other users own or can write: its entries are unpickled"""
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise ValueError(f'CACHE_URL {path} must be owned by this user and not writable by group or others')
+
+
+def create_backend(name, url=None, max_entries=10000, prefix='nd:', secret=None):
+    if name == 'local':
+        return LocalBackend(max_entries)
+    if name == 'sqlite':
+        return SQLiteBackend(url, secret)
+    if name == 'redis':
+        return RedisBackend(url, prefix=prefix, secret=secret)
+    raise ValueError(f'Unknown cache backend: {name}')
+
+
+def get_cache():
+    """Get the cache for the current app"""
+    return current_app.extensions['cache']
+
+
+def invalidate_on_commit(db_session, *tags):
+    """Invalidate tags when the session commits, for changes made without ORM objects"""
+    db_session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_tags(db_session, flush_context):
+    tags = db_session.info.setdefault('cache_tags', set())
+    for obj in (*db_session.new, *db_session.dirty, *db_session.deleted):
+        cache_tags = getattr(obj, 'cache_tags', None)
+        if cache_tags is not None:
+            tags.update(cache_tags())
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_committed(db_session):
+    tags = db_session.info.pop('cache_tags', None)
+    if tags and has_app_context() and 'cache' in current_app.extensions:
+        current_app.extensions['cache'].invalidate(*tags)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_tags(db_session):
+    db_session.info.pop('cache_tags', None)
+
+
+def init_cache(app):
+    """Create the app's cache from CACHE_BACKEND and CACHE_URL"""
+    url = app.config['CACHE_URL']
+    if app.config['CACHE_BACKEND'] == 'sqlite' and not url:
+        url = os.path.join(app.instance_path, 'cache.sqlite')
+    backend = create_backend(app.config['CACHE_BACKEND'], url, app.config['CACHE_MAX_ENTRIES'],
+                             app.config['CACHE_KEY_PREFIX'], app.config['SECRET_KEY'])
+    if not backend.shared:
+        app.logger.info('Using the in-process cache; invalidations will not reach other workers')
+    app.extensions['cache'] = Cache(backend, app.config['CACHE_DEFAULT_TTL'], app.config['CACHE_LOCK_TIMEOUT'])
+    return app.extensions['cache']
@@ -0,0 +1,147 @@
+"""
+Shopping cart and bulk checkout for Neural Dreams Inc.
+The cart is a list of dream ids in the Flask session. Checkout validates
+every item with set-based queries, then charges the buyer, credits the
+authors, inserts the purchases and writes the ledger in one transaction:
+a cart is bought whole or not at all.
+"""
+from flask import current_app, session
+from sqlalchemy import bindparam, insert, update
+from extensions import db
+from models import Dream, Purchase, User
+import metrics
+
+CART_SESSION_KEY = 'cart'
+
+
+def get_cart():
+    """Dream ids in the current session's cart, in the order they were added"""
+    return list(session.get(CART_SESSION_KEY, []))
+
+
+def _save_cart(dream_ids):
+    session[CART_SESSION_KEY] = dream_ids
+
+
+def add_to_cart(dream_id):
+    """Add a dream to the cart; returns False when the cart is full"""
+    cart = get_cart()
+    if dream_id in cart:
+        return True
+    if len(cart) >= current_app.config['CART_MAX_ITEMS']:
+        return False
+    _save_cart(cart + [dream_id])
+    return True
+
+
+def remove_from_cart(*dream_ids):
+    _save_cart([dream_id for dream_id in get_cart() if dream_id not in dream_ids])
+
+
+def clear_cart():
+    session.pop(CART_SESSION_KEY, None)
+
+
+def validate_cart(buyer, dream_ids):
+    """Check a cart with one query for the dreams and one for ownership.
+
+    Returns (dreams, problems, total): the dreams found in cart order,
+    {dream id: reason} for items that cannot be bought, and the cost of
+    the rest.
+    """
+    from archive import purchased_dream_ids
+    from dream_utils import card_columns
+    dream_ids = list(dict.fromkeys(dream_ids))
+    found = {dream.id: dream for dream in
+             Dream.query.options(card_columns()).filter(Dream.id.in_(dream_ids)).all()} if dream_ids else {}
+    owned = purchased_dream_ids(buyer.id, list(found))
+    problems = {}
+    for dream_id in dream_ids:
+        dream = found.get(dream_id)
+        if dream is None:
+            problems[dream_id] = 'This dream is no longer available'
+        elif dream.author_id == buyer.id:
+            problems[dream_id] = 'You cannot purchase your own dreams'
+        elif dream_id in owned:
+            problems[dream_id] = 'You have already purchased this dream'
+    dreams = [found[dream_id] for dream_id in dream_ids if dream_id in found]
+    total = sum(dream.price for dream in dreams if dream.id not in problems)
+    return dreams, problems, total
+
+
+def _buy_all(buyer, dreams, total):
+    """Apply every balance change and insert for a validated cart; returns False if the buyer can't pay"""
+    from cache import invalidate_on_commit
+    from counters import record_sales
+    from ledger import record_entries
+
+    # Conditional debit: a concurrent purchase can't take the balance below zero
+    users = User.__table__
+    charged = db.session.execute(update(users).where(users.c.id == buyer.id, users.c.points >= total)
+                                 .values(points=users.c.points - total)).rowcount
+    if not charged:
+        return False
+
+    purchases = db.session.execute(
+        insert(Purchase).returning(Purchase.id, Purchase.dream_id, sort_by_parameter_order=True),
+        [{'buyer_id': buyer.id, 'dream_id': dream.id, 'price_paid': dream.price} for dream in dreams],
+    ).all()
+
+    credits = {}
+    for dream in dreams:
+        credits[dream.author_id] = credits.get(dream.author_id, 0) + dream.price
+    db.session.execute(update(users).where(users.c.id == bindparam('_author'))
+                       .values(points=users.c.points + bindparam('_amount')),
+                       [{'_author': author_id, '_amount': amount} for author_id, amount in credits.items()])
+
+    by_id = {dream.id: dream for dream in dreams}
+    entries = []
+    for purchase_id, dream_id in purchases:
+        dream = by_id[dream_id]
+        entries.append({'user_id': buyer.id, 'amount': -dream.price, 'kind': 'purchase', 'ref_id': purchase_id})
+        entries.append({'user_id': dream.author_id, 'amount': dream.price, 'kind': 'sale', 'ref_id': purchase_id})
+    record_entries(entries)
+    record_sales(dreams)
+
+    # Core statements skip the ORM's cache tag collection, so name the tags here
+    invalidate_on_commit(db.session, f'user:{buyer.id}',
+                         *{f'user:{author_id}' for author_id in credits},
+                         *{f'dream:{dream.id}' for dream in dreams})
+    return True
+
+
+def checkout(buyer, dream_ids):
+    """Buy every dream in a cart in one transaction.
+
+    Returns (success, message, problems). When any item fails validation
+    nothing is bought and `problems` maps those dream ids to reasons; a
+    failure while writing rolls the whole cart back.
+    """
+    from dream_utils import update_user_dream_tag
+
+    if not dream_ids:
+        return False, 'Your cart is empty', {}
+    dreams, problems, total = validate_cart(buyer, dream_ids)
+    if problems:
+        metrics.inc('purchases_total', {'result': 'rejected'}, len(dream_ids))
+        return False, 'Some dreams in your cart cannot be purchased', problems
+    if buyer.points < total:
+        metrics.inc('purchases_total', {'result': 'rejected'}, len(dreams))
+        return False, f'Insufficient points. You need {total - buyer.points} more points', {}
+
+    try:
+        if not _buy_all(buyer, dreams, total):
+            db.session.rollback()
+            metrics.inc('purchases_total', {'result': 'rejected'}, len(dreams))
+            return False, 'Insufficient points for this cart', {}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        metrics.inc('purchases_total', {'result': 'error'}, len(dreams))
+        current_app.logger.error(f"Checkout error: {e}")
+        return False, 'An error occurred during checkout', {}
+
+    metrics.inc('purchases_total', {'result': 'success'}, len(dreams))
+    # One tag recompute for the whole cart
+    update_user_dream_tag(buyer.id)
+    return True, f'Purchased {len(dreams)} dream{"s" if len(dreams) != 1 else ""} for {total} points!', {}
@@ -4,6 +4,19 @@ class Config:
     SECRET_KEY = os.environ.get('SESSION_SECRET') or 'neural-dreams-secret-key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///neural_dreams.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Comma-separated read replica URLs, e.g. a second SQLite file when testing locally
+    DATABASE_REPLICA_URLS = [url.strip() for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url.strip()]
+    REPLICA_STICKY_SECONDS = 5  # keep a writer's reads on the primary this long
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_LEVELS = os.environ.get('LOG_LEVELS') or 'sqlalchemy.engine=WARNING,werkzeug=INFO'  # per-module overrides
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or ('text' if os.environ.get('FLASK_DEBUG') == '1' else 'json')
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE') or 0.1)  # fraction of DEBUG records kept
+    LOG_QUEUE_SIZE = 10000  # records beyond this are dropped rather than blocking requests
+    # X-Forwarded-For/-Proto/-Host hops to trust; set them only behind a proxy that
+    # overwrites these headers, or clients can spoof their IP (throttling) and host
+    PROXY_X_FOR = int(os.environ.get('PROXY_X_FOR') or 0)
+    PROXY_X_PROTO = int(os.environ.get('PROXY_X_PROTO') or 0)
+    PROXY_X_HOST = int(os.environ.get('PROXY_X_HOST') or 0)
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
@@ -12,4 +25,94 @@ class Config:
     
     # Points system
     STARTING_POINTS = 1000
+    CART_MAX_ITEMS = 50  # dreams per cart checkout
     WEEKLY_BONUS_POINTS = 100
+    WEEKLY_BONUS_CHUNK_SIZE = 5000  # users credited per transaction (flask --app app weekly-bonus)
+
+    # Password hashing (changing the method rehashes passwords on next login)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    # Hashes running at once across every worker sharing CACHE_BACKEND (per worker with 'local')
+    PASSWORD_HASH_BUDGET = int(os.environ.get('PASSWORD_HASH_BUDGET') or 2)
+    PASSWORD_HASH_QUEUE_TIMEOUT = 1.0  # seconds to wait for a free hashing slot
+    
+    # Login throttling: burst size and refill rate in attempts per second, kept in the shared cache
+    LOGIN_USERNAME_BURST = 5
+    LOGIN_USERNAME_RATE = 1 / 30
+    LOGIN_IP_BURST = 20
+    LOGIN_IP_RATE = 1 / 6
+    SIGNUP_IP_BURST = 3
+    SIGNUP_IP_RATE = 1 / 300
+    
+    # SQLite production profile
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000)
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database file to memory-map
+    SQLITE_CACHE_SIZE_KB = 64 * 1024  # page cache per connection
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE') or 5)
+    SQLITE_MAX_OVERFLOW = 10
+    
+    # Request profiling: 'off', 'headers' or 'panel' (headers plus an in-page panel)
+    PROFILING_MODE = os.environ.get('PROFILING') or ('panel' if os.environ.get('FLASK_DEBUG') == '1' else 'off')
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE') or 0)  # fraction of requests logged
+    PROFILING_DUPLICATE_THRESHOLD = 3  # same statement this many times in a request suggests N+1
+    
+    # Metrics: workers share counters through files in METRICS_DIR (empty it on deploy)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_SECONDS = 5
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # optional bearer token for /metrics
+    
+    # Response compression (brotli when the package is installed, else gzip)
+    COMPRESS_MIN_SIZE = 1024  # bytes; smaller bodies are not worth the CPU
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5
+    
+    # Shared cache: 'local' (per worker), 'sqlite' (CACHE_URL is a file path all
+    # workers on the host share; instance/cache.sqlite when unset) or 'redis'
+    # (CACHE_URL is a redis:// URL). Shared entries are signed with SECRET_KEY
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'local'
+    CACHE_URL = os.environ.get('CACHE_URL')
+    CACHE_KEY_PREFIX = 'nd:'
+    CACHE_DEFAULT_TTL = 300
+    CACHE_MAX_ENTRIES = 10000  # local backend only
+    CACHE_LOCK_TIMEOUT = 10  # seconds other workers wait for one worker to fill a key
+    FACET_CACHE_TTL = 3600  # unfiltered sidebar counts; dream changes invalidate them sooner
+    USER_STATS_CACHE_TTL = 60  # also bounds staleness when stats are read from a lagging replica
+    
+    # Full-page cache for anonymous views of home, marketplace and dream detail
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL') or 30)  # seconds; 0 disables
+    
+    # Rendered template fragments ({% cache %} blocks) and compiled template bytecode
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL') or 600)  # seconds; 0 disables
+    JINJA_BYTECODE_CACHE = os.environ.get('JINJA_BYTECODE_CACHE', '1') == '1'
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')  # unset: Jinja's private per-user temp dir
+    
+    # Purchases and ratings older than this move to the archive tables (flask --app app archive)
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 365)
+    ARCHIVE_BATCH_SIZE = 2000  # rows moved per transaction
+    
+    # Points ledger snapshots and verification walk users in batches of this size (flask --app app ledger)
+    LEDGER_BATCH_SIZE = 5000
+    # Entries younger than this stay in the tail, so a snapshot never skips a transaction still committing
+    LEDGER_SNAPSHOT_LAG_SECONDS = 300
+    
+    # Typeahead: each worker keeps a prefix index of dream titles and usernames (GET /api/v1/typeahead)
+    TYPEAHEAD_LIMIT = 8  # suggestions of each kind unless ?limit= asks otherwise
+    TYPEAHEAD_MAX_LIMIT = 20
+    TYPEAHEAD_SYNC_SECONDS = 5  # how often a worker reads the changes other workers committed
+    TYPEAHEAD_MAX_OVERLAY = 2000  # changes kept beside the sorted index before it is rebuilt
+    TYPEAHEAD_LOG_KEEP_SECONDS = 3600  # change log retention; a worker idle for longer rebuilds instead
+    TYPEAHEAD_LOG_LAG_SECONDS = 60  # how long a skipped change id is awaited (its transaction may still commit)
+    
+    # Bulk dream import: a manifest plus a zip of images (Share Your Dream > Import, or flask --app app import-dreams)
+    IMPORT_MAX_CONTENT_LENGTH = 512 * 1024 * 1024  # per upload; replaces MAX_CONTENT_LENGTH for the import page
+    IMPORT_CHUNK_SIZE = 200  # dreams inserted per transaction
+    IMPORT_IMAGE_WORKERS = int(os.environ.get('IMPORT_IMAGE_WORKERS') or 4)  # threads resizing images
+    IMPORT_MAX_IMAGE_BYTES = 20 * 1024 * 1024  # uncompressed size of one image in the zip
+    IMPORT_MAX_ERRORS = 100  # problems listed in the report; the rest are only counted
+    IMPORT_FOLDER = os.environ.get('IMPORT_FOLDER')  # web uploads waiting for their background job; instance/imports when unset
+    IMPORT_JOB_WORKERS = 1  # background imports per worker process; more queue up
+    IMPORT_STALE_SECONDS = 600  # a running job with no progress for this long was cut off (e.g. a worker restart)
+    
+    # ASGI serving (asgi.py): the read views await async engines on the event loop
+    # (pip install uvicorn a2wsgi, and aiosqlite or asyncpg); everything else runs on the WSGI app
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE') or 10)  # per engine, plus as much overflow
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS') or 8)  # threads running the WSGI requests
@@ -0,0 +1,139 @@
+"""
+Denormalized sales counters for Neural Dreams Inc.
+Dream.purchase_count, User.sales_count and User.total_earnings are bumped
+by atomic UPDATEs inside the purchase transaction, so listings can sort
+and badge by sales without joining purchases. These commands rebuild
+them from the purchase rows (archived history included) and report drift.
+
+    flask --app app counters check      # list rows whose counters disagree
+    flask --app app counters backfill   # recompute every counter
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, func, select, union_all, update
+from extensions import db
+from models import Dream, DreamHistory, Purchase, User, UserHistory
+
+counters_cli = AppGroup('counters', help='Check and rebuild the sales counters.')
+
+
+def record_sale(dream, price):
+    """Bump the dream's and its author's sales counters in the current transaction"""
+    from typeahead import update_on_commit
+    db.session.execute(update(Dream).where(Dream.id == dream.id)
+                       .values(purchase_count=Dream.purchase_count + 1))
+    author = db.session.execute(update(User).where(User.id == dream.author_id)
+                                .values(sales_count=User.sales_count + 1, total_earnings=User.total_earnings + price)
+                                .returning(User.id, User.username, User.sales_count)).one()
+    # Core UPDATEs leave no attribute history for the typeahead's flush hook, which ranks usernames by sales
+    update_on_commit(db.session, users={author.id: (author.username, author.sales_count)})
+
+
+def record_sales(dreams):
+    """Bump the counters for several sales at once: one UPDATE for the dreams, one executemany for the authors"""
+    by_author = {}
+    for dream in dreams:
+        sales, earnings = by_author.get(dream.author_id, (0, 0))
+        by_author[dream.author_id] = (sales + 1, earnings + dream.price)
+    db.session.execute(update(Dream).where(Dream.id.in_([dream.id for dream in dreams]))
+                       .values(purchase_count=Dream.purchase_count + 1))
+    users = User.__table__
+    db.session.execute(
+        update(users).where(users.c.id == bindparam('_author'))
+        .values(sales_count=users.c.sales_count + bindparam('_sales'),
+                total_earnings=users.c.total_earnings + bindparam('_earnings')),
+        [{'_author': author_id, '_sales': sales, '_earnings': earnings}
+         for author_id, (sales, earnings) in by_author.items()],
+    )
+    _rank_authors(by_author)
+
+
+def _rank_authors(author_ids):
+    """Queue the authors' new sales counts for the typeahead, which can't see Core UPDATEs"""
+    from typeahead import update_on_commit
+    authors = db.session.execute(select(User.id, User.username, User.sales_count).where(User.id.in_(list(author_ids))))
+    update_on_commit(db.session, users={author.id: (author.username, author.sales_count) for author in authors})
+
+
+def expected_dream_counts():
+    """Subquery of (dream_id, purchases) from hot purchases plus the archived rollup"""
+    rows = union_all(
+        select(Purchase.dream_id, func.count().label('purchases')).group_by(Purchase.dream_id),
+        select(DreamHistory.dream_id, DreamHistory.purchases.label('purchases')),
+    ).subquery()
+    return select(rows.c.dream_id, func.sum(rows.c.purchases).label('purchases')) \
+        .group_by(rows.c.dream_id).subquery('expected_dream_counts')
+
+
+def expected_user_sales():
+    """Subquery of (user_id, sales, earnings) from hot purchases plus the archived rollup"""
+    rows = union_all(
+        select(Dream.author_id.label('user_id'), func.count().label('sales'),
+               func.sum(Purchase.price_paid).label('earnings'))
+        .join(Dream, Purchase.dream_id == Dream.id).group_by(Dream.author_id),
+        select(UserHistory.user_id, UserHistory.sales, UserHistory.earnings),
+    ).subquery()
+    return select(rows.c.user_id, func.sum(rows.c.sales).label('sales'), func.sum(rows.c.earnings).label('earnings')) \
+        .group_by(rows.c.user_id).subquery('expected_user_sales')
+
+
+def backfill(conn):
+    """Recompute every counter with set-based UPDATEs; safe to rerun"""
+    dreams, users = Dream.__table__, User.__table__
+    expected = expected_dream_counts()
+    conn.execute(update(dreams).where(dreams.c.purchase_count != 0).values(purchase_count=0))
+    conn.execute(update(dreams).where(dreams.c.id == expected.c.dream_id)
+                 .values(purchase_count=expected.c.purchases))
+    expected = expected_user_sales()
+    conn.execute(update(users).where((users.c.sales_count != 0) | (users.c.total_earnings != 0))
+                 .values(sales_count=0, total_earnings=0))
+    conn.execute(update(users).where(users.c.id == expected.c.user_id)
+                 .values(sales_count=expected.c.sales, total_earnings=expected.c.earnings))
+
+
+def find_drift(conn, limit=20):
+    """Get (dreams, users) whose counters disagree with the purchase rows, up to `limit` each"""
+    expected = expected_dream_counts()
+    dreams = conn.execute(
+        select(Dream.id, Dream.purchase_count, func.coalesce(expected.c.purchases, 0))
+        .outerjoin(expected, expected.c.dream_id == Dream.id)
+        .where(Dream.purchase_count != func.coalesce(expected.c.purchases, 0))
+        .order_by(Dream.id).limit(limit)
+    ).all()
+    expected = expected_user_sales()
+    sales, earnings = func.coalesce(expected.c.sales, 0), func.coalesce(expected.c.earnings, 0)
+    users = conn.execute(
+        select(User.id, User.sales_count, sales, User.total_earnings, earnings)
+        .outerjoin(expected, expected.c.user_id == User.id)
+        .where((User.sales_count != sales) | (User.total_earnings != earnings))
+        .order_by(User.id).limit(limit)
+    ).all()
+    return dreams, users
+
+
+@counters_cli.command('backfill')
+def backfill_command():
+    """Recompute purchase and sales counters from the purchase rows."""
+    with db.engine.begin() as conn:
+        backfill(conn)
+    click.echo('Counters rebuilt.')
+
+
+@counters_cli.command('check')
+@click.option('--limit', default=20, show_default=True, help='Mismatches to list per table.')
+def check_command(limit):
+    """Report counters that disagree with the purchase rows."""
+    with db.engine.connect() as conn:
+        dreams, users = find_drift(conn, limit)
+    for dream_id, stored, expected in dreams:
+        click.echo(f'dream {dream_id}: purchase_count {stored}, expected {expected}')
+    for user_id, sales, expected_sales, earnings, expected_earnings in users:
+        click.echo(f'user {user_id}: sales_count {sales} (expected {expected_sales}), '
+                   f'total_earnings {earnings} (expected {expected_earnings})')
+    if dreams or users:
+        raise click.ClickException('Counters have drifted; run `flask --app app counters backfill`.')
+    click.echo('All counters match.')
+
+
+def init_counters(app):
+    app.cli.add_command(counters_cli)
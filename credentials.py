@@ -0,0 +1,128 @@
+"""
+Credential verification service for Neural Dreams Inc.
+Caps concurrent password hashing across all workers and throttles login
+attempts, both through the shared cache
+"""
+import os
+import random
+import time
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot frees up within the queue timeout"""
+
+
+class Throttle:
+    """Token buckets keyed by an arbitrary string (username, IP...).
+
+    The buckets live in the app cache, so with a shared CACHE_BACKEND every
+    worker draws on the same budget and restarts don't refill it.
+    """
+
+    def __init__(self, cache, name, capacity, rate):
+        self.cache = cache
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+
+    def allow(self, key):
+        """Consume one token for `key`; False when the key is over its budget"""
+        return self.cache.take_token(f'throttle:{self.name}:{key}', self.capacity, self.rate)
+
+
+class CredentialService:
+    """Hashes and verifies passwords within a deployment-wide concurrency budget.
+
+    Each hash holds one of `budget` slot keys in the shared cache while it
+    runs on the request thread; callers that find every slot taken retry
+    until `queue_timeout`, then get HashingBusy, so a login burst sheds load
+    instead of occupying every worker. Slots expire after `slot_ttl` in case
+    a worker dies mid-hash.
+    """
+
+    def __init__(self, cache, method, budget, queue_timeout, slot_ttl=30):
+        self.cache = cache
+        self.method = method
+        self.budget = budget
+        self.queue_timeout = queue_timeout
+        self.slot_ttl = slot_ttl
+        # Stored hashes carry the full parameters ('pbkdf2' is stored as 'pbkdf2:sha256:1000000')
+        self.method_prefix = generate_password_hash('', method).split('$', 1)[0]
+
+    def _acquire_slot(self):
+        deadline = time.monotonic() + self.queue_timeout
+        delay = 0.005
+        while True:
+            for slot in random.sample(range(self.budget), self.budget):
+                key = f'pwhash-slot:{slot}'
+                if self.cache.add(key, os.getpid(), self.slot_ttl):
+                    return key
+            if time.monotonic() >= deadline:
+                raise HashingBusy()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def _run(self, fn, *args):
+        slot = self._acquire_slot()
+        try:
+            return fn(*args)
+        finally:
+            self.cache.delete(slot)
+
+    def hash_password(self, password):
+        """Hash a new password with the current cost parameters"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, password_hash):
+        """Check whether a stored hash was made with outdated cost parameters"""
+        return password_hash.split('$', 1)[0] != self.method_prefix
+
+    def verify_password(self, user, password):
+        """Check a user's password, upgrading the stored hash if its parameters changed.
+
+        The caller is responsible for committing the session after a successful login.
+        """
+        if not user.password_hash:
+            return False
+        if not self._run(check_password_hash, user.password_hash, password):
+            return False
+        if self.needs_rehash(user.password_hash):
+            user.password_hash = self.hash_password(password)
+        return True
+
+
+def init_credentials(app, cache):
+    """Create the app's credential service and login/signup throttles from its config"""
+    config = app.config
+    app.extensions['credentials'] = CredentialService(
+        cache,
+        method=config['PASSWORD_HASH_METHOD'],
+        budget=config['PASSWORD_HASH_BUDGET'],
+        queue_timeout=config['PASSWORD_HASH_QUEUE_TIMEOUT'],
+    )
+    app.extensions['throttles'] = {
+        'login_username': Throttle(cache, 'login-username', config['LOGIN_USERNAME_BURST'], config['LOGIN_USERNAME_RATE']),
+        'login_ip': Throttle(cache, 'login-ip', config['LOGIN_IP_BURST'], config['LOGIN_IP_RATE']),
+        'signup_ip': Throttle(cache, 'signup-ip', config['SIGNUP_IP_BURST'], config['SIGNUP_IP_RATE']),
+    }
+
+
+def get_credential_service():
+    """Get the app's credential service"""
+    return current_app.extensions['credentials']
+
+
+def allow_login_attempt(username, ip):
+    """Apply per-username and per-IP login throttling"""
+    throttles = current_app.extensions['throttles']
+    # Check both so a sprayed username still drains the attacker's IP bucket
+    ip_ok = throttles['login_ip'].allow(ip or 'unknown')
+    username_ok = throttles['login_username'].allow((username or '').lower())
+    return ip_ok and username_ok
+
+
+def allow_signup_attempt(ip):
+    """Apply per-IP signup throttling"""
+    return current_app.extensions['throttles']['signup_ip'].allow(ip or 'unknown')
@@ -0,0 +1,371 @@
+"""
+Bulk dream import for Neural Dreams Inc.
+A seller uploads a manifest (CSV, NDJSON or a JSON array) with title,
+description, category, price and optional image columns, plus a zip of
+the images it names. Rows are validated as they are read and imported in
+chunks: a thread pool resizes the chunk's images, then its dreams go in
+with one Core INSERT in their own transaction. Invalid rows are skipped
+and reported. The seller's dream tag is recomputed once at the end.
+Web uploads run in a background thread of the worker that received them,
+with progress written to an ImportJob row that the import page polls.
+
+    flask --app app import-dreams alice dreams.csv --images images.zip
+"""
+import csv
+import io
+import json
+import os
+import posixpath
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select, update
+from extensions import db
+from models import Dream, ImportJob, User, make_excerpt
+
+MANIFEST_FORMATS = ('csv', 'ndjson', 'json')
+MANIFEST_COLUMNS = ('title', 'description', 'category', 'price', 'image')
+
+# Same rules as DreamForm
+TITLE_LENGTH = (5, 200)
+MIN_DESCRIPTION_LENGTH = 20
+PRICE_RANGE = (1, 10000)
+
+
+def manifest_format(filename):
+    """The manifest format named by a file extension; raises ValueError for anything else"""
+    fmt = filename.rsplit('.', 1)[-1].lower()
+    if fmt not in MANIFEST_FORMATS:
+        raise ValueError(f'The manifest must be a {", ".join("." + fmt for fmt in MANIFEST_FORMATS)} file')
+    return fmt
+
+
+def read_manifest(stream, filename):
+    """Yield (row number, row) from a binary manifest stream, one row at a time.
+
+    The format comes from the file extension. The row number is the CSV or
+    NDJSON line, or the position in a JSON array; rows that don't parse
+    come back as None.
+    """
+    fmt = manifest_format(filename)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for number, line in enumerate(text, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+    else:
+        # A JSON array has to be parsed whole; uploads are bounded by IMPORT_MAX_CONTENT_LENGTH
+        try:
+            rows = json.load(text)
+        except ValueError:
+            raise ValueError('The manifest is not valid JSON')
+        if not isinstance(rows, list):
+            raise ValueError('A JSON manifest must be an array of dreams')
+        yield from enumerate(rows, 1)
+
+
+def open_images(stream):
+    """{name: ZipInfo} for the files in an image zip, by full path and by bare file name"""
+    archive = zipfile.ZipFile(stream)
+    members = {}
+    for info in archive.infolist():
+        if not info.is_dir():
+            members[info.filename] = info
+            members.setdefault(posixpath.basename(info.filename), info)
+    return archive, members
+
+
+def validate_row(row, members, max_image_bytes):
+    """Check one manifest row; returns (values, None) or (None, reason)"""
+    from dream_utils import allowed_file
+    if not isinstance(row, dict):
+        return None, 'Not a valid JSON object'
+    title = str(row.get('title') or '').strip()
+    description = str(row.get('description') or '').strip()
+    category = str(row.get('category') or '').strip().lower()
+    image = str(row.get('image') or '').strip()
+
+    if not TITLE_LENGTH[0] <= len(title) <= TITLE_LENGTH[1]:
+        return None, f'Title must be between {TITLE_LENGTH[0]} and {TITLE_LENGTH[1]} characters'
+    if len(description) < MIN_DESCRIPTION_LENGTH:
+        return None, f'Description must be at least {MIN_DESCRIPTION_LENGTH} characters'
+    if category not in current_app.config['DREAM_CATEGORIES']:
+        return None, f'Unknown category "{category}"'
+    try:
+        price = int(str(row.get('price')).strip())
+    except ValueError:
+        return None, 'Price must be a whole number'
+    if not PRICE_RANGE[0] <= price <= PRICE_RANGE[1]:
+        return None, f'Price must be between {PRICE_RANGE[0]:,} and {PRICE_RANGE[1]:,} points'
+    if image:
+        if not allowed_file(image):
+            return None, f'{image} is not a jpg, jpeg, png or gif image'
+        if image not in members:
+            return None, f'{image} is not in the image zip'
+        if members[image].file_size > max_image_bytes:
+            return None, f'{image} is larger than {max_image_bytes // (1024 * 1024)}MB'
+    return {'title': title, 'description': description, 'category': category, 'price': price, 'image': image}, None
+
+
+def _save_image(archive, member, folder):
+    from dream_utils import resize_dream_image
+    filename = str(uuid.uuid4()) + '.' + member.filename.rsplit('.', 1)[1].lower()
+    # ZipFile serialises reads of its underlying file, so workers can read members side by side
+    with archive.open(member) as source:
+        resize_dream_image(source, os.path.join(folder, filename))
+    return filename
+
+
+class _Import:
+    """State of one import run"""
+
+    def __init__(self, author, archive, members, pool):
+        config = current_app.config
+        self.author = author
+        self.archive = archive
+        self.members = members
+        self.pool = pool
+        self.folder = config['UPLOAD_FOLDER']
+        self.max_errors = config['IMPORT_MAX_ERRORS']
+        self.report = {'rows': 0, 'imported': 0, 'images': 0, 'failed': 0, 'errors': [], 'seconds': 0.0}
+
+    def fail(self, number, reason):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < self.max_errors:
+            self.report['errors'].append((number, reason))
+
+    def import_chunk(self, chunk):
+        from cache import invalidate_on_commit
+        from dream_utils import delete_dream_image
+        from facets import count_new_dreams
+        from typeahead import update_on_commit
+
+        # Workers stream their members straight from the zip, so only IMPORT_IMAGE_WORKERS images are in memory
+        futures = {number: self.pool.submit(_save_image, self.archive, self.members[values['image']], self.folder)
+                   for number, values in chunk if values['image']}
+        rows = []
+        for number, values in chunk:
+            image_filename = None
+            if number in futures:
+                try:
+                    image_filename = futures[number].result()
+                except Exception as e:
+                    current_app.logger.error(f"Error importing image {values['image']}: {e}")
+                    self.fail(number, f"{values['image']} could not be read as an image")
+                    continue
+            rows.append((number, {
+                'title': values['title'],
+                'description': values['description'],
+                'excerpt': make_excerpt(values['description']),
+                'category': values['category'],
+                'price': values['price'],
+                'image_filename': image_filename,
+                'author_id': self.author.id,
+            }))
+        if not rows:
+            return
+
+        dreams = [dream for _, dream in rows]
+        try:
+            ids = db.session.execute(insert(Dream).returning(Dream.id, sort_by_parameter_order=True), dreams).scalars().all()
+            # Core inserts skip the ORM hooks that keep these up to date
+            count_new_dreams(db.session, dreams)
+            update_on_commit(db.session, dreams={dream_id: (dream['title'], 0.0) for dream_id, dream in zip(ids, dreams)})
+            invalidate_on_commit(db.session, 'dreams', 'leaderboard', f'user:{self.author.id}')
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error importing dreams: {e}")
+            for number, dream in rows:
+                delete_dream_image(dream['image_filename'])
+                self.fail(number, 'Could not be saved; nothing from this batch was imported')
+            return
+        self.report['imported'] += len(ids)
+        self.report['images'] += sum(1 for dream in dreams if dream['image_filename'])
+
+
+def import_dreams(author, manifest, manifest_name, images=None, progress=None):
+    """Import a manifest of dreams for `author`, with images from an optional zip stream.
+
+    Returns a report dict: rows read, dreams imported, images saved, rows
+    that failed, the first IMPORT_MAX_ERRORS (row number, reason) pairs
+    and the seconds taken. `progress(report)` is called after each chunk.
+    Raises ValueError when the manifest or zip can't be read at all.
+    """
+    from dream_utils import update_user_dream_tag
+    config = current_app.config
+    started = time.perf_counter()
+    archive, members = None, {}
+    if images is not None:
+        try:
+            archive, members = open_images(images)
+        except zipfile.BadZipFile:
+            raise ValueError('The images file is not a valid zip archive')
+
+    try:
+        with ThreadPoolExecutor(max_workers=config['IMPORT_IMAGE_WORKERS'], thread_name_prefix='import-images') as pool:
+            run = _Import(author, archive, members, pool)
+            chunk = []
+            try:
+                for number, row in read_manifest(manifest, manifest_name):
+                    run.report['rows'] += 1
+                    values, reason = validate_row(row, members, config['IMPORT_MAX_IMAGE_BYTES'])
+                    if reason:
+                        run.fail(number, reason)
+                        continue
+                    chunk.append((number, values))
+                    if len(chunk) >= config['IMPORT_CHUNK_SIZE']:
+                        run.import_chunk(chunk)
+                        chunk = []
+                        if progress:
+                            progress(run.report)
+            except UnicodeDecodeError:
+                raise ValueError(f"The manifest is not UTF-8 text; {run.report['imported']} dreams before "
+                                 f"row {run.report['rows'] + 1} were imported")
+            if chunk:
+                run.import_chunk(chunk)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    # One tag recompute for the whole import
+    if run.report['imported']:
+        update_user_dream_tag(author.id)
+    run.report['seconds'] = time.perf_counter() - started
+    return run.report
+
+
+def _import_folder(app):
+    return app.config['IMPORT_FOLDER'] or os.path.join(app.instance_path, 'imports')
+
+
+def _record_progress(job_id, report, **values):
+    """Copy an import report into its job row, in a transaction of its own"""
+    with db.engine.begin() as conn:
+        conn.execute(update(ImportJob).where(ImportJob.id == job_id).values(
+            rows=report['rows'], imported=report['imported'], images=report['images'], failed=report['failed'],
+            errors=json.dumps(report['errors']), updated_at=datetime.utcnow(), **values))
+
+
+def _finish_job(job_id, **values):
+    with db.engine.begin() as conn:
+        now = datetime.utcnow()
+        conn.execute(update(ImportJob).where(ImportJob.id == job_id).values(updated_at=now, finished_at=now, **values))
+
+
+def start_import_job(author, manifest, images=None):
+    """Save an uploaded manifest (and optional image zip) and import it in the background.
+
+    `manifest` and `images` are werkzeug FileStorage objects. Returns the
+    ImportJob; raises ValueError when the manifest type isn't supported.
+    """
+    manifest_format(manifest.filename)
+    app = current_app._get_current_object()
+    folder = _import_folder(app)
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    job = ImportJob(author_id=author.id, manifest_name=posixpath.basename(manifest.filename)[-255:])
+    db.session.add(job)
+    db.session.commit()
+
+    # The request's upload streams close with the request, so the job reads copies on disk
+    paths = {'manifest': os.path.join(folder, f'{job.id}-manifest')}
+    try:
+        manifest.save(paths['manifest'])
+        if images is not None:
+            paths['images'] = os.path.join(folder, f'{job.id}-images.zip')
+            images.save(paths['images'])
+        app.extensions['dream_import'].submit(_run_job, app, job.id, paths)
+    except Exception:
+        _remove_files(paths)
+        _finish_job(job.id, status='failed', message='The upload could not be saved')
+        raise
+    return job
+
+
+def _run_job(app, job_id, paths):
+    with app.app_context():
+        # Everything after the job row was committed runs inside the try, so no failure leaves it 'queued'
+        try:
+            job = db.session.get(ImportJob, job_id)
+            author = db.session.get(User, job.author_id)
+            with db.engine.begin() as conn:
+                conn.execute(update(ImportJob).where(ImportJob.id == job_id)
+                             .values(status='running', updated_at=datetime.utcnow()))
+            with open(paths['manifest'], 'rb') as manifest, \
+                    (open(paths['images'], 'rb') if 'images' in paths else nullcontext()) as images:
+                report = import_dreams(author, manifest, job.manifest_name, images,
+                                       lambda report: _record_progress(job_id, report))
+        except ValueError as e:
+            _fail_job(app, job_id, str(e))
+        except Exception as e:
+            app.logger.exception(f'Import job {job_id} failed: {e}')
+            _fail_job(app, job_id, 'The import stopped unexpectedly; the dreams imported before that were kept')
+        else:
+            _record_progress(job_id, report, status='done', finished_at=datetime.utcnow())
+        finally:
+            _remove_files(paths)
+            db.session.remove()
+
+
+def _fail_job(app, job_id, message):
+    try:
+        _finish_job(job_id, status='failed', message=message)
+    except Exception:
+        app.logger.exception(f'Could not mark import job {job_id} failed')
+
+
+def _remove_files(paths):
+    for path in paths.values():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@click.command('import-dreams')
+@with_appcontext
+@click.argument('username')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', type=click.Path(exists=True, dir_okay=False), help='Zip of the images the manifest names.')
+def import_command(username, manifest, images):
+    """Import the dreams in MANIFEST (.csv, .ndjson or .json) for USERNAME."""
+    author = db.session.execute(select(User).where(User.username == username)).scalar()
+    if author is None:
+        raise click.ClickException(f'No user named {username}.')
+
+    def progress(report):
+        click.echo(f"{report['rows']:,} rows read, {report['imported']:,} imported, {report['failed']:,} failed")
+
+    image_file = open(images, 'rb') if images else None
+    try:
+        with open(manifest, 'rb') as manifest_file:
+            report = import_dreams(author, manifest_file, manifest, image_file, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if image_file is not None:
+            image_file.close()
+    for number, reason in report['errors']:
+        click.echo(f'Row {number}: {reason}', err=True)
+    click.echo(f"Imported {report['imported']:,} of {report['rows']:,} dreams ({report['images']:,} images) "
+               f"in {report['seconds']:.1f}s; {report['failed']:,} failed.")
+
+
+def init_dream_import(app):
+    # Background runner for web uploads; threads start on the first job, so forked workers each get their own
+    app.extensions['dream_import'] = ThreadPoolExecutor(max_workers=app.config['IMPORT_JOB_WORKERS'],
+                                                        thread_name_prefix='import-job')
+    app.cli.add_command(import_command)
@@ -1,9 +1,14 @@
 import os
+import threading
+import time
 import uuid
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 from flask import current_app
+from sqlalchemy import event
 from models import Dream, Rating
+from replicas import RoutingSession, read_only
+import metrics
 from datetime import datetime, timedelta
 
 def allowed_file(filename):
@@ -11,6 +16,18 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
 
+def resize_dream_image(source, filepath):
+    """Shrink an image file or stream to at most 800x600 and save it; needs no app context"""
+    started = time.perf_counter()
+    try:
+        from PIL import Image
+        image = Image.open(source)
+        # Resize image to max 800x600 while maintaining aspect ratio
+        image.thumbnail((800, 600), Image.Resampling.LANCZOS)
+        image.save(filepath, optimize=True, quality=85)
+    finally:
+        metrics.observe('image_processing_seconds', time.perf_counter() - started)
+
 def save_dream_image(image_file):
     """Save uploaded image and return filename"""
     if image_file and allowed_file(image_file.filename):
@@ -20,10 +37,7 @@ def save_dream_image(image_file):
         
         # Resize and save image
         try:
-            image = Image.open(image_file)
-            # Resize image to max 800x600 while maintaining aspect ratio
-            image.thumbnail((800, 600), Image.Resampling.LANCZOS)
-            image.save(filepath, optimize=True, quality=85)
+            resize_dream_image(image_file, filepath)
             return filename
         except Exception as e:
             current_app.logger.error(f"Error saving image: {e}")
@@ -40,46 +54,123 @@ def delete_dream_image(filename):
         except Exception as e:
             current_app.logger.error(f"Error deleting image: {e}")
 
+_file_executor = None
+_file_executor_lock = threading.Lock()
+
+def delete_dream_image_on_commit(db_session, filename):
+    """Delete an image file in the background once the session's transaction commits"""
+    if filename:
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        db_session.info.setdefault('files_to_delete', []).append(path)
+
+def _remove_files(paths, logger):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting image: {e}")
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _delete_committed_files(db_session):
+    global _file_executor
+    paths = db_session.info.pop('files_to_delete', None)
+    if not paths:
+        return
+    logger = current_app.logger
+    with _file_executor_lock:
+        if _file_executor is None:
+            # Created on first use so each forked worker gets its own thread
+            _file_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='uploads')
+    _file_executor.submit(_remove_files, paths, logger)
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _keep_rolled_back_files(db_session, previous_transaction):
+    db_session.info.pop('files_to_delete', None)
+
+@read_only
 def calculate_dream_rating(dream_id):
     """Calculate and update average rating for a dream"""
-    from app import db
-    ratings = db.session.query(Rating).filter_by(dream_id=dream_id).all()
-    if ratings:
-        average = sum(r.rating for r in ratings) / len(ratings)
-        return round(average, 1), len(ratings)
+    from archive import rating_totals
+    count, total = rating_totals(dream_id)
+    if count:
+        return round(total / count, 1), count
     return 0.0, 0
 
-def get_dream_of_the_week():
-    """Get the highest-rated dream from the past week"""
-    from app import db
-    week_ago = datetime.utcnow() - timedelta(days=7)
-    
-    # Get dreams from the past week with highest rating
-    dream_of_week = db.session.query(Dream).filter(
-        Dream.created_at >= week_ago,
-        Dream.total_ratings > 0
-    ).order_by(Dream.average_rating.desc(), Dream.total_ratings.desc()).first()
-    
-    # If no dreams this week, get overall highest rated
-    if not dream_of_week:
-        dream_of_week = db.session.query(Dream).filter(
-            Dream.total_ratings > 0
-        ).order_by(Dream.average_rating.desc(), Dream.total_ratings.desc()).first()
-    
-    return dream_of_week
+@read_only
+def dream_of_the_week_query(since=None):
+    """Statement for the highest-rated dream created since `since` (any time when None)"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import joinedload
+    query = select(Dream).options(card_columns(), joinedload(Dream.author)).filter(Dream.total_ratings > 0)
+    if since is not None:
+        query = query.filter(Dream.created_at >= since)
+    return query.order_by(Dream.average_rating.desc(), Dream.total_ratings.desc()).limit(1)
 
+@read_only
 def get_trending_dreams(limit=6):
     """Get trending dreams based on recent ratings and purchases"""
-    from app import db
+    from extensions import db
     week_ago = datetime.utcnow() - timedelta(days=7)
     
     # Dreams with recent activity (ratings or purchases)
-    trending = db.session.query(Dream).filter(
+    trending = db.session.query(Dream).options(card_columns()).filter(
         Dream.created_at >= week_ago
     ).order_by(Dream.average_rating.desc(), Dream.total_ratings.desc()).limit(limit).all()
     
     return trending
 
+@read_only
+def get_similar_dreams(dream, limit=4):
+    """Get dreams often bought together with this one, precomputed by the recommender"""
+    from models import DreamSimilarity
+    return Dream.query.options(card_columns()).join(DreamSimilarity, DreamSimilarity.similar_dream_id == Dream.id) \
+        .filter(DreamSimilarity.dream_id == dream.id) \
+        .order_by(DreamSimilarity.rank) \
+        .limit(limit).all()
+
+def card_columns():
+    """Loader option for listing cards: they show the stored excerpt, so skip the full description"""
+    from sqlalchemy.orm import defer
+    return defer(Dream.description)
+
+# sort_by option -> (column, descending)
+DREAM_SORTS = {
+    'newest': (Dream.created_at, True),
+    'oldest': (Dream.created_at, False),
+    'price_low': (Dream.price, False),
+    'price_high': (Dream.price, True),
+    'rating_high': (Dream.average_rating, True),
+    'rating_low': (Dream.average_rating, False),
+    'best_selling': (Dream.purchase_count, True),
+}
+
+def filter_dreams(query, search_query='', category='', min_price=None, max_price=None):
+    """Apply the marketplace search filters to a Dream query"""
+    from sqlalchemy import or_
+    if search_query:
+        query = query.filter(or_(
+            Dream.title.contains(search_query),
+            Dream.description.contains(search_query)
+        ))
+    if category:
+        query = query.filter(Dream.category == category)
+    if min_price is not None:
+        query = query.filter(Dream.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Dream.price <= max_price)
+    return query
+
+def sort_dreams(query, sort_by):
+    """Order a Dream query by a marketplace sort option, with id as tie-breaker"""
+    if sort_by not in DREAM_SORTS:
+        return query
+    column, descending = DREAM_SORTS[sort_by]
+    if descending:
+        return query.order_by(column.desc(), Dream.id.desc())
+    return query.order_by(column.asc(), Dream.id.asc())
+
 def format_price(price):
     """Format price with dream points symbol"""
     return f"✨ {price:,} points"
@@ -107,22 +198,24 @@ def validate_purchase(user, dream):
         return False, f"Insufficient points. You need {dream.price - user.points} more points"
     
     # Check if already purchased
-    from app import db
-    from models import Purchase
-    existing_purchase = db.session.query(Purchase).filter_by(buyer_id=user.id, dream_id=dream.id).first()
-    if existing_purchase:
+    from archive import has_purchased
+    if has_purchased(user.id, dream.id):
         return False, "You have already purchased this dream"
     
     return True, "Purchase valid"
 
 def process_dream_purchase(buyer, dream):
     """Process dream purchase transaction"""
-    from app import db
+    from extensions import db
     from models import Purchase
+    from cache import invalidate_on_commit
+    from counters import record_sale
+    from ledger import record
     
     # Validate purchase
     is_valid, message = validate_purchase(buyer, dream)
     if not is_valid:
+        metrics.inc('purchases_total', {'result': 'rejected'})
         return False, message
     
     try:
@@ -139,8 +232,16 @@ def process_dream_purchase(buyer, dream):
         purchase.price_paid = dream.price
         
         db.session.add(purchase)
+        db.session.flush()
+        record(buyer.id, -dream.price, 'purchase', purchase.id)
+        record(dream.author_id, dream.price, 'sale', purchase.id)
+        # Sales counters move in the same transaction; the seller's stats change too
+        record_sale(dream, dream.price)
+        invalidate_on_commit(db.session, f'user:{dream.author_id}')
         db.session.commit()
         
+        metrics.inc('purchases_total', {'result': 'success'})
+        
         # Update buyer's dream tag after purchase
         update_user_dream_tag(buyer.id)
         
@@ -148,32 +249,62 @@ def process_dream_purchase(buyer, dream):
     
     except Exception as e:
         db.session.rollback()
+        metrics.inc('purchases_total', {'result': 'error'})
         current_app.logger.error(f"Purchase error: {e}")
         return False, "An error occurred during purchase"
 
+def save_dream_rating(user, dream, rating_value, review):
+    """Create or update a user's rating of a dream and refresh its average"""
+    from extensions import db
+    from archive import restore_rating
+    existing_rating = Rating.query.filter_by(rater_id=user.id, dream_id=dream.id).first() \
+        or restore_rating(user.id, dream.id)
+    
+    if existing_rating:
+        # Update existing rating
+        existing_rating.rating = rating_value
+        existing_rating.review = review
+    else:
+        # Create new rating
+        rating = Rating()
+        rating.rater_id = user.id
+        rating.dream_id = dream.id
+        rating.rating = rating_value
+        rating.review = review
+        db.session.add(rating)
+    
+    # Reviews are part of the dream's public representation
+    dream.updated_at = datetime.utcnow()
+    db.session.commit()
+    
+    # Update dream's average rating
+    dream.update_rating()
+
+@read_only
 def get_user_stats(user):
-    """Get comprehensive user statistics"""
-    from models import Dream, Purchase, Rating
-    from sqlalchemy import func
+    """Get comprehensive user statistics, cached until the user's data changes"""
+    from cache import get_cache
+    return get_cache().get_or_set(f'user-stats:{user.id}', lambda: _compute_user_stats(user),
+                                  ttl=current_app.config['USER_STATS_CACHE_TTL'], tags=(f'user:{user.id}',))
+
+def _compute_user_stats(user):
+    from models import Dream
+    from archive import user_totals
+    from ledger import totals as ledger_totals
     
+    # Purchase and rating totals include archived history
+    totals = user_totals(user.id)
     stats = {
         'dreams_posted': Dream.query.filter_by(author_id=user.id).count(),
-        'dreams_purchased': Purchase.query.filter_by(buyer_id=user.id).count(),
-        'total_earnings': 0,
-        'total_spent': 0,
+        'dreams_purchased': totals['purchases'],
+        'total_earnings': user.total_earnings,
+        'total_spent': ledger_totals(user.id)['spent'],
         'average_rating_received': 0.0,
-        'ratings_given': Rating.query.filter_by(rater_id=user.id).count()
+        'ratings_given': totals['ratings_given']
     }
     
-    # Calculate earnings
-    from app import db
+    from extensions import db
     from sqlalchemy import func
-    earnings = db.session.query(func.sum(Purchase.price_paid)).join(Dream).filter(Dream.author_id == user.id).scalar()
-    stats['total_earnings'] = earnings or 0
-    
-    # Calculate spending
-    spending = db.session.query(func.sum(Purchase.price_paid)).filter(Purchase.buyer_id == user.id).scalar()
-    stats['total_spent'] = spending or 0
     
     # Calculate average rating received
     avg_rating = db.session.query(func.avg(Dream.average_rating)).filter(
@@ -0,0 +1,181 @@
+"""
+Streaming exports for Neural Dreams Inc.
+Sales, purchases and ratings are read with a streaming cursor (`yield_per`)
+and written out as CSV or NDJSON one row at a time, so memory stays flat
+however long the history is.
+
+    flask --app app export sales alice --format csv --since 2024-01-01 -o sales.csv
+"""
+import csv
+import io
+import sys
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import Dream, User
+from archive import purchase_history, rating_history
+from serializers import dumps
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+YIELD_PER = 1000  # rows fetched from the cursor at a time
+FLUSH_BYTES = 64 * 1024  # buffer output into chunks of about this size
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')  # string cells a spreadsheet would run as formulas
+
+
+def _sales(user_id):
+    purchases = purchase_history()
+    buyer = aliased(User)
+    return (select(purchases.id.label('purchase_id'), purchases.purchase_date, Dream.id.label('dream_id'),
+                   Dream.title.label('dream_title'), buyer.username.label('buyer'), purchases.price_paid)
+            .join(Dream, purchases.dream_id == Dream.id)
+            .join(buyer, purchases.buyer_id == buyer.id)
+            .where(Dream.author_id == user_id), purchases.purchase_date, purchases.id)
+
+
+def _purchases(user_id):
+    purchases = purchase_history()
+    seller = aliased(User)
+    return (select(purchases.id.label('purchase_id'), purchases.purchase_date, Dream.id.label('dream_id'),
+                   Dream.title.label('dream_title'), seller.username.label('seller'), purchases.price_paid)
+            .join(Dream, purchases.dream_id == Dream.id)
+            .join(seller, Dream.author_id == seller.id)
+            .where(purchases.buyer_id == user_id), purchases.purchase_date, purchases.id)
+
+
+def _ratings_given(user_id):
+    ratings = rating_history()
+    return (select(ratings.id.label('rating_id'), ratings.created_at, Dream.id.label('dream_id'),
+                   Dream.title.label('dream_title'), ratings.rating, ratings.review)
+            .join(Dream, ratings.dream_id == Dream.id)
+            .where(ratings.rater_id == user_id), ratings.created_at, ratings.id)
+
+
+def _ratings_received(user_id):
+    ratings = rating_history()
+    rater = aliased(User)
+    return (select(ratings.id.label('rating_id'), ratings.created_at, Dream.id.label('dream_id'),
+                   Dream.title.label('dream_title'), rater.username.label('rater'), ratings.rating, ratings.review)
+            .join(Dream, ratings.dream_id == Dream.id)
+            .join(rater, ratings.rater_id == rater.id)
+            .where(Dream.author_id == user_id), ratings.created_at, ratings.id)
+
+
+# Export name -> builder returning (select, date column, id column)
+EXPORTS = {
+    'sales': _sales,
+    'purchases': _purchases,
+    'ratings-given': _ratings_given,
+    'ratings-received': _ratings_received,
+}
+
+
+def parse_date(raw):
+    """Parse a YYYY-MM-DD date; returns None for an empty value and raises ValueError when malformed"""
+    if not raw:
+        return None
+    return datetime.strptime(raw, '%Y-%m-%d')
+
+
+def export_query(name, user_id, since=None, until=None):
+    """Build the export select for a user; `until` is an inclusive day"""
+    stmt, date_column, id_column = EXPORTS[name](user_id)
+    if since is not None:
+        stmt = stmt.where(date_column >= since)
+    if until is not None:
+        stmt = stmt.where(date_column < until + timedelta(days=1))
+    return stmt.order_by(date_column, id_column)
+
+
+def stream_rows(stmt):
+    """Get (column names, result) for a select read through a streaming cursor"""
+    result = db.session.execute(stmt.execution_options(yield_per=YIELD_PER))
+    return list(result.keys()), result
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    # A leading quote makes the spreadsheet show the cell as text
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_format_value(value) for value in row])
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(columns, rows):
+    chunk, size = [], 0
+    for row in rows:
+        line = dumps(dict(zip(columns, row))) + b'\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    yield b''.join(chunk)
+
+
+def iter_export(name, user_id, fmt='csv', since=None, until=None):
+    """Yield the export as chunks of CSV text or NDJSON bytes"""
+    columns, rows = stream_rows(export_query(name, user_id, since, until))
+    try:
+        yield from (iter_csv if fmt == 'csv' else iter_ndjson)(columns, rows)
+    finally:
+        rows.close()
+
+
+def export_filename(name, username, fmt, since=None, until=None):
+    span = ''
+    if since or until:
+        span = f"_{since:%Y%m%d}" if since else '_start'
+        span += f"-{until:%Y%m%d}" if until else '-now'
+    return f'{username}-{name}{span}.{fmt}'
+
+
+@click.command('export')
+@with_appcontext
+@click.argument('name', type=click.Choice(sorted(EXPORTS)))
+@click.argument('username')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+@click.option('--since', help='First day to include (YYYY-MM-DD).')
+@click.option('--until', help='Last day to include (YYYY-MM-DD).')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), help='File to write; stdout by default.')
+def export_command(name, username, fmt, since, until, output):
+    """Stream one user's NAME history to a file or stdout."""
+    try:
+        since, until = parse_date(since), parse_date(until)
+    except ValueError:
+        raise click.BadParameter('Dates must look like YYYY-MM-DD.')
+    user = db.session.execute(select(User.id).where(User.username == username)).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}.')
+
+    binary = fmt != 'csv'
+    if output:
+        target = open(output, 'wb' if binary else 'w', newline='' if not binary else None)
+    else:
+        target = sys.stdout.buffer if binary else sys.stdout
+    try:
+        for chunk in iter_export(name, user.id, fmt, since, until):
+            target.write(chunk)
+    finally:
+        if output:
+            target.close()
+
+
+def init_exports(app):
+    app.cli.add_command(export_command)
@@ -0,0 +1,31 @@
+"""
+Flask extension instances for Neural Dreams Inc.
+Created unbound here and attached to an app in create_app(), so importing
+models or routes never builds an application
+"""
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import LoginManager
+from sqlalchemy.orm import DeclarativeBase
+from replicas import RoutingSession
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
+
+
+def insert_or_ignore(conn, table):
+    """INSERT ... ON CONFLICT DO NOTHING on the two databases the app runs on,
+    for creating rows another transaction may be creating at the same time"""
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).on_conflict_do_nothing()
+
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'  # type: ignore
+login_manager.login_message = 'Please log in to access this dreamy marketplace.'
+login_manager.login_message_category = 'info'
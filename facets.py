@@ -0,0 +1,173 @@
+"""
+Faceted counts for the marketplace filter sidebar.
+Searches get per-category and per-price-bucket counts from one grouped
+query (plus a per-category one under a price filter). The unfiltered
+counts live in the facet_count table, which is kept up to date in the
+same flush that creates, edits or deletes a dream, and are served from
+the app cache, so the default sidebar costs no query.
+
+    flask --app app facets rebuild   # recount after bulk loads that bypass the ORM
+"""
+from bisect import bisect_left
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, case, delete, event, func, insert, inspect, select, update
+from extensions import db, insert_or_ignore
+from models import Dream, FacetCount
+from replicas import RoutingSession
+
+facets_cli = AppGroup('facets', help='Maintain the marketplace facet counts.')
+
+# (low, high) price bounds, inclusive; None is open-ended. Run `facets rebuild` after changing them
+PRICE_BUCKETS = ((1, 50), (51, 100), (101, 250), (251, 500), (501, None))
+_UPPER_BOUNDS = [high for _, high in PRICE_BUCKETS[:-1]]
+
+
+def price_bucket(price):
+    """Index of the PRICE_BUCKETS entry a price falls in"""
+    return bisect_left(_UPPER_BOUNDS, price)
+
+
+def price_bucket_column():
+    """SQL expression matching price_bucket()"""
+    return case(*((Dream.price <= high, index) for index, high in enumerate(_UPPER_BOUNDS)),
+                else_=len(_UPPER_BOUNDS))
+
+
+def _grouped(query):
+    bucket = price_bucket_column()
+    return {(category, bucket_index): count for category, bucket_index, count in
+            query.with_entities(Dream.category, bucket, func.count()).group_by(Dream.category, bucket)}
+
+
+def _load_unfiltered():
+    return {(row.category, row.price_bucket): row.dreams
+            for row in db.session.execute(select(FacetCount).where(FacetCount.dreams > 0)).scalars()}
+
+
+def unfiltered_counts():
+    """{(category, price bucket): dreams} over every dream, from the app cache"""
+    from cache import get_cache
+    return get_cache().get_or_set('facet-counts', _load_unfiltered,
+                                  ttl=current_app.config['FACET_CACHE_TTL'], tags=('facets',))
+
+
+def facet_counts(search_query='', category='', min_price=None, max_price=None):
+    """Sidebar counts for a marketplace search.
+
+    Each facet ignores its own filter so the sidebar can offer the
+    alternatives: category counts honour the search and price range,
+    price bucket counts honour the search and category.
+    """
+    from dream_utils import filter_dreams
+    if search_query:
+        cells = _grouped(filter_dreams(Dream.query, search_query))
+    else:
+        cells = unfiltered_counts()
+
+    buckets = [0] * len(PRICE_BUCKETS)
+    for (cell_category, bucket), count in cells.items():
+        if not category or cell_category == category:
+            buckets[bucket] += count
+    if min_price is None and max_price is None:
+        categories = {}
+        for (cell_category, _), count in cells.items():
+            categories[cell_category] = categories.get(cell_category, 0) + count
+    else:
+        categories = dict(filter_dreams(Dream.query, search_query, '', min_price, max_price)
+                          .with_entities(Dream.category, func.count()).group_by(Dream.category).all())
+    return {
+        'total': sum(categories.values()),
+        'categories': categories,
+        'price_buckets': [(low, high, count) for (low, high), count in zip(PRICE_BUCKETS, buckets)],
+    }
+
+
+def _committed(obj, name):
+    history = inspect(obj).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(obj, name)
+
+
+def _facet_deltas(db_session):
+    deltas = {}
+
+    def add(category, price, amount):
+        key = (category, price_bucket(price))
+        deltas[key] = deltas.get(key, 0) + amount
+
+    for dream in db_session.new:
+        if isinstance(dream, Dream):
+            add(dream.category, dream.price, 1)
+    for dream in db_session.deleted:
+        if isinstance(dream, Dream):
+            add(_committed(dream, 'category'), _committed(dream, 'price'), -1)
+    for dream in db_session.dirty:
+        if isinstance(dream, Dream) and (inspect(dream).attrs.category.history.has_changes()
+                                         or inspect(dream).attrs.price.history.has_changes()):
+            add(_committed(dream, 'category'), _committed(dream, 'price'), -1)
+            add(dream.category, dream.price, 1)
+    return {key: amount for key, amount in deltas.items() if amount}
+
+
+def apply_deltas(conn, deltas):
+    """Add {(category, price bucket): delta} to facet_count, creating missing rows"""
+    table = FacetCount.__table__
+    existing = set(conn.execute(select(table.c.category, table.c.price_bucket)
+                                .where(table.c.category.in_({category for category, _ in deltas}))).all())
+    missing = [{'category': category, 'price_bucket': bucket, 'dreams': 0}
+               for category, bucket in deltas if (category, bucket) not in existing]
+    if missing:
+        # Another transaction may be adding the first dream to the same cell; its row is as good as ours
+        conn.execute(insert_or_ignore(conn, table), missing)
+    conn.execute(
+        update(table).where(table.c.category == bindparam('_category'), table.c.price_bucket == bindparam('_bucket'))
+        .values(dreams=table.c.dreams + bindparam('_delta')),
+        [{'_category': category, '_bucket': bucket, '_delta': amount} for (category, bucket), amount in deltas.items()],
+    )
+
+
+def count_new_dreams(db_session, dreams):
+    """Add dreams inserted without ORM objects (dicts with category and price) in the session's transaction"""
+    from cache import invalidate_on_commit
+    deltas = {}
+    for dream in dreams:
+        key = (dream['category'], price_bucket(dream['price']))
+        deltas[key] = deltas.get(key, 0) + 1
+    if deltas:
+        apply_deltas(db_session.connection(), deltas)
+        invalidate_on_commit(db_session, 'facets')
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _maintain_facets(db_session, flush_context):
+    # History is still available here, and the UPDATEs join the flush's transaction
+    deltas = _facet_deltas(db_session)
+    if deltas:
+        from cache import invalidate_on_commit
+        apply_deltas(db_session.connection(), deltas)
+        invalidate_on_commit(db_session, 'facets')
+
+
+def rebuild(conn):
+    """Recount facet_count from the dream table"""
+    bucket = price_bucket_column()
+    conn.execute(delete(FacetCount))
+    conn.execute(insert(FacetCount).from_select(
+        ['category', 'price_bucket', 'dreams'],
+        select(Dream.category, bucket, func.count()).group_by(Dream.category, bucket),
+    ))
+
+
+@facets_cli.command('rebuild')
+def rebuild_command():
+    """Recount the unfiltered facet counts from the dreams."""
+    from cache import get_cache
+    with db.engine.begin() as conn:
+        rebuild(conn)
+    get_cache().invalidate('facets')
+    click.echo('Facet counts rebuilt.')
+
+
+def init_facets(app):
+    app.cli.add_command(facets_cli)
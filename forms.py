@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, PasswordField, TextAreaField, SelectField, IntegerField, SubmitField, HiddenField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, NumberRange, ValidationError
 from models import User
@@ -57,6 +57,16 @@ class DreamForm(FlaskForm):
     ])
     submit = SubmitField('Share Your Dream')
 
+class DreamImportForm(FlaskForm):
+    manifest = FileField('Dream Manifest', validators=[
+        FileRequired('Please choose a manifest file'),
+        FileAllowed(['csv', 'ndjson', 'json'], 'The manifest must be a .csv, .ndjson or .json file')
+    ])
+    images = FileField('Dream Images', validators=[
+        FileAllowed(['zip'], 'Please upload the images as a .zip file')
+    ])
+    submit = SubmitField('Import Dreams')
+
 class RatingForm(FlaskForm):
     rating = SelectField('Rating', 
                         choices=[(i, f'{i} Star{"s" if i != 1 else ""}') for i in range(1, 6)],
@@ -67,6 +77,9 @@ class RatingForm(FlaskForm):
     submit = SubmitField('Submit Rating')
 
 class SearchForm(FlaskForm):
+    class Meta:
+        csrf = False  # submitted by GET; a token would also keep listings out of the page cache
+
     query = StringField('Search Dreams...')
     category = SelectField('Category', 
                           choices=[('', 'All Categories')] + [(cat, cat.title()) for cat in Config.DREAM_CATEGORIES])
@@ -78,7 +91,8 @@ class SearchForm(FlaskForm):
                                 ('price_low', 'Price: Low to High'),
                                 ('price_high', 'Price: High to Low'),
                                 ('rating_high', 'Highest Rated'),
-                                ('rating_low', 'Lowest Rated')])
+                                ('rating_low', 'Lowest Rated'),
+                                ('best_selling', 'Best Selling')])
     submit = SubmitField('Search Dreams')
 
 class ProfileForm(FlaskForm):
@@ -0,0 +1,160 @@
+"""
+HTTP response layer for Neural Dreams Inc.
+Compresses text responses, adds weak ETags so browsers can revalidate with
+a 304, and serves anonymous page views from a short-lived page cache
+"""
+import gzip
+import hashlib
+from urllib.parse import urlencode
+from flask import Response, current_app, g, request, session
+from flask_login import current_user
+from cache import get_cache
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+                      'application/javascript', 'image/svg+xml'}
+
+# Anonymous views that render the same page for every visitor
+PAGE_CACHE_ENDPOINTS = {'home', 'marketplace.index', 'marketplace.dream_detail'}
+
+
+def body_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def choose_encoding(accept_encodings):
+    """Pick the best supported encoding from the request's Accept-Encoding"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=current_app.config['BROTLI_QUALITY'])
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(body, compresslevel=current_app.config['GZIP_LEVEL'], mtime=0)
+
+
+def page_cache_key():
+    """Cache key from host, path and the query string with its arguments sorted"""
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f'page:{request.host}{request.path}?{query}'
+
+
+def page_cache_tags():
+    """Tags whose invalidation should drop the current page"""
+    if request.endpoint == 'marketplace.dream_detail':
+        dream_id = request.view_args['id']
+        # Rating history shows rater names; the author panel shows the author's
+        # name, rating, dreams and sales, which change under the user:{id} tag
+        tags = [f'dream:{dream_id}', 'recommendations', 'usernames']
+        author_id = _dream_author_id(dream_id)
+        if author_id is not None:
+            tags.append(f'user:{author_id}')
+        return tuple(tags)
+    return ('dreams',)
+
+
+def _dream_author_id(dream_id):
+    from sqlalchemy import select
+    from extensions import db
+    from models import Dream
+    from replicas import read_only_scope
+    with read_only_scope():
+        return db.session.scalar(select(Dream.author_id).where(Dream.id == dream_id))
+
+
+def _page_cacheable():
+    return (request.method in ('GET', 'HEAD')
+            and request.endpoint in PAGE_CACHE_ENDPOINTS
+            and not current_user.is_authenticated
+            and '_flashes' not in session)
+
+
+def _serve_cached_page():
+    if not _page_cacheable():
+        return None
+    key = page_cache_key()
+    entry = get_cache().get(key)
+    metrics.record_cache('page', entry is not None)
+    if entry is None:
+        g._page_cache_key = key
+        # Versions from before the render, so a write committed meanwhile wins
+        g._page_cache_versions = get_cache().tag_versions(page_cache_tags())
+        return None
+
+    g._page_cache_entry = entry
+    response = Response(entry['body'], content_type=entry['content_type'])
+    response.headers['X-Page-Cache'] = 'HIT'
+    return response
+
+
+def _store_page(response):
+    key = g.pop('_page_cache_key', None)
+    # Never share a page whose render touched the session (e.g. a CSRF token)
+    if key and response.status_code == 200 and not response.direct_passthrough and not session.modified:
+        body = response.get_data()
+        entry = {'body': body, 'content_type': response.content_type, 'etag': body_etag(body), 'encoded': {}}
+        if len(body) >= current_app.config['COMPRESS_MIN_SIZE']:
+            # Compress once here so hits in any worker reuse it
+            for encoding in ('br', 'gzip') if brotli is not None else ('gzip',):
+                entry['encoded'][encoding] = compress(body, encoding)
+        get_cache().set(key, entry, current_app.config['PAGE_CACHE_TTL'], versions=g.pop('_page_cache_versions'))
+        g._page_cache_entry = entry
+        response.headers['X-Page-Cache'] = 'MISS'
+    return response
+
+
+def _compress_response(response):
+    if (request.method not in ('GET', 'HEAD') or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    entry = g.get('_page_cache_entry')
+    if entry is not None and body != entry['body']:
+        entry = None  # something (e.g. the profiling panel) changed the body
+
+    etag, weak = response.get_etag()
+    if etag is None:
+        etag, weak = (entry['etag'] if entry else body_etag(body)), True
+        response.set_etag(etag, weak=True)
+    if request.endpoint in PAGE_CACHE_ENDPOINTS or entry is not None:
+        response.headers.setdefault('Cache-Control', 'no-cache')
+    response.make_conditional(request)
+    if response.status_code == 304 or len(body) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    encoded = entry['encoded'].get(encoding) if entry else None
+    if encoded is None:
+        encoded = compress(body, encoding)
+    response.set_data(encoded)
+    response.headers['Content-Encoding'] = encoding
+    if not weak:
+        # Byte-for-byte different from the uncompressed representation
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_http_cache(app):
+    """Set up compression, ETags and the anonymous page cache (stored in the app cache)"""
+    if app.config['PAGE_CACHE_TTL'] > 0:
+        # Registered after profiling and metrics so cache hits are still timed
+        app.before_request(_serve_cached_page)
+        app.after_request(_store_page)
+    # after_request hooks run in reverse order; compression must see the final body
+    app.after_request_funcs.setdefault(None, []).insert(0, _compress_response)
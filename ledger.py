@@ -0,0 +1,217 @@
+"""
+Points ledger for Neural Dreams Inc.
+Every change to User.points appends a ledger_entry row in the same
+transaction: signup grants, purchases, sales and weekly bonuses (plus one
+opening entry per user from the migration that introduced the ledger).
+Balance snapshots fold a user's entries into running totals, so balance,
+earnings and spending queries read one snapshot plus the short tail of
+entries after it.
+
+    flask --app app ledger snapshot   # fold settled entries into new snapshots
+    flask --app app ledger verify     # check User.points against the ledger
+"""
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, func, insert, literal, select
+from extensions import db
+from models import BalanceSnapshot, LedgerEntry, User
+
+ledger_cli = AppGroup('ledger', help='Snapshot and verify the points ledger.')
+
+EARNED = case((LedgerEntry.kind == 'sale', LedgerEntry.amount), else_=0)
+SPENT = case((LedgerEntry.kind == 'purchase', -LedgerEntry.amount), else_=0)
+
+
+def record(user_id, amount, kind, ref_id=None):
+    """Append a ledger entry to the current session's transaction"""
+    db.session.add(LedgerEntry(user_id=user_id, amount=amount, kind=kind, ref_id=ref_id))
+
+
+def record_entries(entries):
+    """Append several entries (dicts of user_id, amount, kind, ref_id) to the current transaction at once"""
+    if entries:
+        now = datetime.utcnow()
+        db.session.execute(insert(LedgerEntry), [{'created_at': now, **entry} for entry in entries])
+
+
+def record_many(conn, user_ids, amount, kind, ref_id=None):
+    """Append the same entry for every user id a select returns, in one INSERT ... SELECT"""
+    rows = select(user_ids.subquery().c[0], literal(amount), literal(kind), literal(ref_id),
+                  literal(datetime.utcnow()))
+    conn.execute(insert(LedgerEntry).from_select(['user_id', 'amount', 'kind', 'ref_id', 'created_at'], rows))
+
+
+def totals(user_id, when=None):
+    """A user's ledger balance, sales earnings and purchase spending, now or as of `when`"""
+    snapshots = BalanceSnapshot.query.filter(BalanceSnapshot.user_id == user_id)
+    if when is not None:
+        snapshots = snapshots.filter(BalanceSnapshot.as_of <= when)
+    snapshot = snapshots.order_by(BalanceSnapshot.entry_id.desc()).first()
+
+    tail = db.session.query(
+        func.coalesce(func.sum(LedgerEntry.amount), 0), func.coalesce(func.sum(EARNED), 0),
+        func.coalesce(func.sum(SPENT), 0)
+    ).filter(LedgerEntry.user_id == user_id, LedgerEntry.id > (snapshot.entry_id if snapshot else 0))
+    if when is not None:
+        tail = tail.filter(LedgerEntry.created_at <= when)
+    balance, earned, spent = tail.one()
+    if snapshot is not None:
+        balance, earned, spent = balance + snapshot.balance, earned + snapshot.earned, spent + snapshot.spent
+    return {'balance': balance, 'earned': earned, 'spent': spent}
+
+
+def balance_at(user_id, when):
+    """A user's points balance at a past moment"""
+    return totals(user_id, when)['balance']
+
+
+def _latest_snapshots(low, high):
+    """Subquery of the newest snapshot of each user in (low, high]"""
+    newest = select(BalanceSnapshot.user_id, func.max(BalanceSnapshot.entry_id).label('entry_id')) \
+        .where(BalanceSnapshot.user_id > low, BalanceSnapshot.user_id <= high) \
+        .group_by(BalanceSnapshot.user_id).subquery()
+    return select(BalanceSnapshot).join(newest, and_(BalanceSnapshot.user_id == newest.c.user_id,
+                                                     BalanceSnapshot.entry_id == newest.c.entry_id)) \
+        .subquery('latest')
+
+
+def _tails(low, high, through=None):
+    """Subquery of per-user sums of the entries after each user's newest snapshot"""
+    latest = _latest_snapshots(low, high)
+    stmt = select(
+        LedgerEntry.user_id, func.max(LedgerEntry.id).label('entry_id'),
+        func.max(LedgerEntry.created_at).label('as_of'), func.sum(LedgerEntry.amount).label('amount'),
+        func.sum(EARNED).label('earned'), func.sum(SPENT).label('spent'),
+    ).outerjoin(latest, latest.c.user_id == LedgerEntry.user_id).where(
+        LedgerEntry.user_id > low, LedgerEntry.user_id <= high,
+        LedgerEntry.id > func.coalesce(latest.c.entry_id, 0),
+    )
+    if through is not None:
+        stmt = stmt.where(LedgerEntry.id <= through)
+    return stmt.group_by(LedgerEntry.user_id).subquery('tail')
+
+
+def _next_high(conn, low, batch_size):
+    """The last user id of the batch after `low`, or None when no users are left"""
+    high = conn.execute(select(User.id).where(User.id > low).order_by(User.id)
+                        .offset(batch_size - 1).limit(1)).scalar()
+    if high is None:
+        high = conn.execute(select(func.max(User.id)).where(User.id > low)).scalar()
+    return high
+
+
+def snapshot_range(conn, low, high, through=None):
+    """Write a new snapshot for every user in (low, high] with entries past their last one"""
+    latest, tail = _latest_snapshots(low, high), _tails(low, high, through)
+    rows = select(
+        tail.c.user_id, tail.c.entry_id,
+        func.coalesce(latest.c.balance, 0) + tail.c.amount,
+        func.coalesce(latest.c.earned, 0) + tail.c.earned,
+        func.coalesce(latest.c.spent, 0) + tail.c.spent,
+        tail.c.as_of, literal(datetime.utcnow()),
+    ).outerjoin(latest, latest.c.user_id == tail.c.user_id)
+    columns = ['user_id', 'entry_id', 'balance', 'earned', 'spent', 'as_of', 'taken_at']
+    return conn.execute(insert(BalanceSnapshot).from_select(columns, rows)).rowcount
+
+
+def take_snapshots(batch_size=None):
+    """Fold settled entries into snapshots, one batch of users per transaction; returns snapshots written"""
+    batch_size = batch_size or current_app.config['LEDGER_BATCH_SIZE']
+    settled = datetime.utcnow() - timedelta(seconds=current_app.config['LEDGER_SNAPSHOT_LAG_SECONDS'])
+    with db.engine.connect() as conn:
+        through = conn.execute(select(func.max(LedgerEntry.id)).where(LedgerEntry.created_at < settled)).scalar()
+    written, low = 0, 0
+    while through is not None:
+        with db.engine.begin() as conn:
+            high = _next_high(conn, low, batch_size)
+            if high is None:
+                break
+            written += snapshot_range(conn, low, high, through)
+        low = high
+    return written
+
+
+def find_mismatches(batch_size=None):
+    """Yield (user id, points, ledger balance) for users whose points disagree with the ledger.
+
+    Users are checked one id batch at a time, each with a single grouped
+    query, so memory stays flat on any number of users.
+    """
+    batch_size = batch_size or current_app.config['LEDGER_BATCH_SIZE']
+    low = 0
+    while True:
+        with db.engine.connect() as conn:
+            high = _next_high(conn, low, batch_size)
+            if high is None:
+                return
+            latest, tail = _latest_snapshots(low, high), _tails(low, high)
+            points = func.coalesce(User.points, 0)
+            expected = func.coalesce(latest.c.balance, 0) + func.coalesce(tail.c.amount, 0)
+            rows = conn.execute(
+                select(User.id, points, expected)
+                .outerjoin(latest, latest.c.user_id == User.id)
+                .outerjoin(tail, tail.c.user_id == User.id)
+                .where(User.id > low, User.id <= high, points != expected)
+                .order_by(User.id)
+            ).all()
+        yield from rows
+        low = high
+
+
+def backfill(conn):
+    """Seed the ledger of an existing database: past purchases and sales, then an opening entry per user.
+
+    Each opening entry is dated when the user joined and holds whatever
+    points the purchase history does not explain (the signup grant,
+    bonuses, sales of deleted dreams).
+    """
+    from sqlalchemy import union_all
+    from archive import purchase_history
+    from models import Dream
+    purchases = purchase_history()
+    movements = union_all(
+        select(purchases.buyer_id.label('user_id'), (-purchases.price_paid).label('amount'),
+               literal('purchase').label('kind'), purchases.id.label('ref_id'),
+               purchases.purchase_date.label('created_at')),
+        select(Dream.author_id, purchases.price_paid, literal('sale'), purchases.id, purchases.purchase_date)
+        .join(Dream, purchases.dream_id == Dream.id),
+    ).subquery('movements')
+    explained = select(movements.c.user_id, func.sum(movements.c.amount).label('amount')) \
+        .group_by(movements.c.user_id).subquery('explained')
+    columns = ['user_id', 'amount', 'kind', 'ref_id', 'created_at']
+    conn.execute(insert(LedgerEntry).from_select(columns, select(
+        User.id, func.coalesce(User.points, 0) - func.coalesce(explained.c.amount, 0), literal('opening'),
+        literal(None), func.coalesce(User.created_at, datetime.utcnow()),
+    ).outerjoin(explained, explained.c.user_id == User.id).order_by(User.id)))
+    conn.execute(insert(LedgerEntry).from_select(columns, select(
+        movements.c.user_id, movements.c.amount, movements.c.kind, movements.c.ref_id,
+        func.coalesce(movements.c.created_at, datetime.utcnow()),
+    ).order_by(movements.c.created_at, movements.c.ref_id, movements.c.kind)))
+
+
+@ledger_cli.command('snapshot')
+@click.option('--batch-size', type=int, help='Users per transaction [default: LEDGER_BATCH_SIZE].')
+def snapshot_command(batch_size):
+    """Fold settled ledger entries into per-user balance snapshots."""
+    click.echo(f'Wrote {take_snapshots(batch_size)} snapshot(s).')
+
+
+@ledger_cli.command('verify')
+@click.option('--batch-size', type=int, help='Users checked per query [default: LEDGER_BATCH_SIZE].')
+@click.option('--limit', default=20, show_default=True, help='Mismatches to list.')
+def verify_command(batch_size, limit):
+    """Check every user's points against the ledger."""
+    mismatches = 0
+    for user_id, points, expected in find_mismatches(batch_size):
+        mismatches += 1
+        if mismatches <= limit:
+            click.echo(f'user {user_id}: points {points}, ledger {expected}')
+    if mismatches:
+        raise click.ClickException(f'{mismatches} user(s) disagree with the ledger.')
+    click.echo('All balances match the ledger.')
+
+
+def init_ledger(app):
+    app.cli.add_command(ledger_cli)
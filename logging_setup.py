@@ -0,0 +1,166 @@
+"""
+Logging pipeline for Neural Dreams Inc.
+Request threads only put records on a bounded queue; a background
+QueueListener formats them as JSON lines and does the actual I/O
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with request context fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in ('request_id', 'endpoint', 'method', 'path'):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        # Queued records carry the traceback already formatted, in exc_text
+        exc_text = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exc_text:
+            entry['exc_info'] = exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the request id and endpoint while still on the request thread"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.endpoint = request.endpoint
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG records; INFO and above always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never block a request on logging: drop records when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # The base class folds the traceback into msg; keep it in exc_text so the
+        # listener's formatter decides where it goes (a field of its own in JSON)
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def parse_levels(spec):
+    """Parse 'sqlalchemy.engine=WARNING,werkzeug=INFO' into a dict"""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+
+def _echo_request_id(response):
+    if 'request_id' in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+def configure_logging(level='INFO', module_levels=None, fmt='json', debug_sample_rate=1.0,
+                      queue_size=10000, stream=None):
+    """Route all logging through a queue drained by a background listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s',
+                                              defaults={'request_id': '-'}))
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(RequestContextFilter())
+    if debug_sample_rate < 1.0:
+        handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def init_logging(app):
+    """Configure the logging pipeline from app config and tag requests with ids"""
+    configure_logging(
+        level=app.config['LOG_LEVEL'],
+        module_levels=parse_levels(app.config['LOG_LEVELS']),
+        fmt=app.config['LOG_FORMAT'],
+        debug_sample_rate=app.config['LOG_DEBUG_SAMPLE_RATE'],
+        queue_size=app.config['LOG_QUEUE_SIZE'],
+    )
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
@@ -0,0 +1,290 @@
+"""
+Metrics for Neural Dreams Inc.
+A small Prometheus-compatible registry. Each gunicorn worker keeps its own
+counters and periodically writes them to METRICS_DIR; /metrics sums the
+files of all workers so the numbers cover the whole deployment.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from config import Config
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+IMAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint', LATENCY_BUCKETS),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result', None),
+    'image_processing_seconds': ('histogram', 'Time spent resizing and saving uploaded images', IMAGE_BUCKETS),
+    'purchases_total': ('counter', 'Dream purchase attempts by result', None),
+    'db_pool_checkouts_total': ('counter', 'Connections checked out of the pool', None),
+    'db_pool_connections_total': ('counter', 'New DBAPI connections opened by the pool', None),
+    'db_pool_saturated_checkouts_total': ('counter', 'Checkouts made while every pooled connection was busy (overflow in use)', None),
+    'db_pool_checkout_timeouts_total': ('counter', 'Requests that gave up waiting for a pooled connection', None),
+    'db_pool_size': ('gauge', 'Configured pool size', None),
+    'db_pool_checked_out': ('gauge', 'Connections currently checked out', None),
+    'db_pool_overflow': ('gauge', 'Overflow connections currently open', None),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+class Registry:
+    """Counters and histograms for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(counts), total, count]
+                               for (name, labels), (counts, total, count) in self.histograms.items()],
+            }
+
+
+registry = Registry()
+_engines = {}  # label -> engine, for pool gauges
+_flusher = None
+# Process-wide, like the registry; init_metrics takes them from the app config
+_settings = {'dir': Config.METRICS_DIR, 'flush_seconds': Config.METRICS_FLUSH_SECONDS}
+_flusher_lock = threading.Lock()
+
+
+def inc(name, labels=None, amount=1):
+    """Increment a counter"""
+    registry.inc(name, labels, amount)
+    _ensure_flusher()
+
+
+def observe(name, value, labels=None):
+    """Record a value in a histogram"""
+    registry.observe(name, value, labels)
+    _ensure_flusher()
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup"""
+    inc('cache_requests_total', {'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+
+def _metrics_dir():
+    return _settings['dir']
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(_metrics_dir(), f'metrics-{pid or os.getpid()}.json')
+
+
+def _collect_gauges():
+    gauges = []
+    for label, engine in _engines.items():
+        pool = engine.pool
+        for name, method in (('db_pool_size', 'size'), ('db_pool_checked_out', 'checkedout'),
+                             ('db_pool_overflow', 'overflow')):
+            if hasattr(pool, method):
+                gauges.append([name, [['engine', label], ['pid', str(os.getpid())]], getattr(pool, method)()])
+    return gauges
+
+
+def flush():
+    """Write this process's metrics where other workers can read them"""
+    if not _metrics_dir():
+        return
+    snapshot = registry.snapshot()
+    snapshot['gauges'] = _collect_gauges()
+    snapshot['written'] = time.time()
+    os.makedirs(_metrics_dir(), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=_metrics_dir(), prefix='.metrics-')
+    with os.fdopen(fd, 'w') as tmp:
+        json.dump(snapshot, tmp)
+    os.replace(tmp_path, _snapshot_path())
+
+
+def _ensure_flusher():
+    global _flusher
+    # A forked worker inherits the parent's flag but not its thread
+    if (_flusher is not None and _flusher[0] == os.getpid()) or not _metrics_dir():
+        return
+    with _flusher_lock:
+        if _flusher is not None and _flusher[0] == os.getpid():
+            return
+
+        def loop():
+            while True:
+                time.sleep(_settings['flush_seconds'])
+                try:
+                    flush()
+                except OSError:
+                    pass
+
+        thread = threading.Thread(target=loop, name='metrics-flush', daemon=True)
+        thread.start()
+        _flusher = (os.getpid(), thread)
+
+
+def _merged_snapshots():
+    snapshots = [registry.snapshot()]
+    snapshots[0]['gauges'] = _collect_gauges()
+    directory = _metrics_dir()
+    if directory and os.path.isdir(directory):
+        own = os.path.basename(_snapshot_path())
+        stale_after = time.time() - 3 * _settings['flush_seconds']
+        for filename in os.listdir(directory):
+            if not filename.startswith('metrics-') or filename == own:
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # Counters of exited workers still count; their gauges do not
+            if snapshot.get('written', 0) < stale_after:
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+
+    counters, histograms, gauges = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            entry = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+        for name, labels, value in snapshot.get('gauges', []):
+            gauges[(name, tuple(map(tuple, labels)))] = value
+    return counters, histograms, gauges
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format"""
+    counters, histograms, gauges = _merged_snapshots()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if kind == 'histogram':
+            series = sorted((k, v) for k, v in histograms.items() if k[0] == name)
+        else:
+            source = counters if kind == 'counter' else gauges
+            series = sorted((k, v) for k, v in source.items() if k[0] == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (_, labels), value in series:
+            if kind != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + [float('inf')], counts):
+                cumulative += bucket_count
+                le = '+Inf' if math.isinf(bound) else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def instrument_engine(engine, label):
+    """Count pool checkouts and connections for an engine"""
+    _engines[label] = engine
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        inc('db_pool_checkouts_total', {'engine': label})
+        pool = engine.pool
+        if hasattr(pool, 'overflow') and pool.overflow() > 0:
+            inc('db_pool_saturated_checkouts_total', {'engine': label})
+
+    def on_connect(dbapi_connection, connection_record):
+        inc('db_pool_connections_total', {'engine': label})
+
+    event.listen(engine, 'checkout', on_checkout)
+    event.listen(engine, 'connect', on_connect)
+
+
+def _start_timer():
+    g._metrics_started = time.perf_counter()
+
+
+def _record_latency(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None and request.endpoint != 'metrics':
+        observe('http_request_duration_seconds', time.perf_counter() - started, {
+            'endpoint': request.endpoint or 'unmatched',
+            'method': request.method,
+            'status': str(response.status_code),
+        })
+    return response
+
+
+def _record_pool_timeout(exc):
+    if isinstance(exc, PoolTimeoutError):
+        inc('db_pool_checkout_timeouts_total')
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app, db):
+    """Register request timing, pool instrumentation and the /metrics endpoint"""
+    _settings.update(dir=app.config['METRICS_DIR'], flush_seconds=app.config['METRICS_FLUSH_SECONDS'])
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            instrument_engine(engine, bind_key or 'primary')
+    for index, engine in enumerate(app.extensions.get('db_replicas', {}).get('engines', [])):
+        instrument_engine(engine, f'replica{index}')
+
+    app.before_request(_start_timer)
+    app.after_request(_record_latency)
+    app.teardown_request(_record_pool_timeout)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
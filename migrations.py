@@ -0,0 +1,222 @@
+"""
+Schema management for Neural Dreams Inc.
+New databases get the full schema from the models; existing databases
+are brought up to date by the ordered migration steps below. Each step
+runs once and is recorded in the schema_migrations table.
+
+    flask --app app init-db    # create a new database
+    flask --app app migrate    # apply pending migrations
+"""
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, inspect, select, text
+from extensions import db
+
+# (migration id, function) in the order they must run
+MIGRATIONS = []
+
+
+def migration(migration_id):
+    """Register a migration step"""
+    def decorator(fn):
+        MIGRATIONS.append((migration_id, fn))
+        return fn
+    return decorator
+
+
+def has_column(conn, table, column):
+    """Check whether a table already has a column"""
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table, column, ddl):
+    """Add a column unless it already exists (ddl is the type and constraints)"""
+    if not has_column(conn, table, column):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def rebuild_sqlite_table(conn, table):
+    """Recreate a SQLite table from its model definition, keeping its rows.
+
+    SQLite cannot change constraints in place, so this renames the table,
+    creates it afresh, copies the rows and drops the old copy, all in one
+    transaction.
+    """
+    if not conn.connection.dbapi_connection.in_transaction:
+        # pysqlite runs DDL outside a transaction unless one is already open
+        conn.exec_driver_sql('BEGIN')
+    old = f'_{table.name}_old'
+    for index in inspect(conn).get_indexes(table.name):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old}"'))
+    table.create(conn)
+    columns = ', '.join(f'"{column.name}"' for column in table.c)
+    conn.execute(text(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{old}"'))
+    conn.execute(text(f'DROP TABLE "{old}"'))
+
+
+def set_foreign_key_ondelete(conn, table, column, ondelete):
+    """Make the foreign key on `column` use ON DELETE `ondelete` (table is the model's Table)"""
+    for fk in inspect(conn).get_foreign_keys(table.name):
+        if fk['constrained_columns'] != [column]:
+            continue
+        if (fk['options'].get('ondelete') or '').upper() == ondelete:
+            return
+        if conn.dialect.name == 'sqlite':
+            rebuild_sqlite_table(conn, table)
+            return
+        referred = f'"{fk["referred_table"]}" ({", ".join(fk["referred_columns"])})'
+        conn.execute(text(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{fk["name"]}"'))
+        conn.execute(text(f'ALTER TABLE "{table.name}" ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({column}) '
+                          f'REFERENCES {referred} ON DELETE {ondelete}'))
+
+
+@migration('0001_dream_updated_at')
+def add_dream_updated_at(conn):
+    add_column(conn, 'dream', 'updated_at', 'TIMESTAMP')
+    conn.execute(text('UPDATE dream SET updated_at = created_at WHERE updated_at IS NULL'))
+
+
+@migration('0002_sales_counters')
+def add_sales_counters(conn):
+    from counters import backfill
+    add_column(conn, 'dream', 'purchase_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'user', 'sales_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'user', 'total_earnings', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_dream_purchase_count ON dream (purchase_count, id)'))
+    backfill(conn)
+
+
+@migration('0003_dream_cascade_deletes')
+def cascade_dream_deletes(conn):
+    from models import Purchase, Rating
+    for table in (Purchase.__table__, Rating.__table__):
+        # Rows the old ORM cascade missed would fail the new constraint
+        conn.execute(text(f'DELETE FROM "{table.name}" WHERE dream_id NOT IN (SELECT id FROM dream)'))
+        set_foreign_key_ondelete(conn, table, 'dream_id', 'CASCADE')
+        # Without an index the cascade scans the whole child table per deleted dream
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table.name}_dream_id ON "{table.name}" (dream_id)'))
+
+
+@migration('0004_dream_excerpt')
+def add_dream_excerpt(conn):
+    from sqlalchemy import case, func, update
+    from models import Dream, EXCERPT_LENGTH
+    add_column(conn, 'dream', 'excerpt', f"VARCHAR({EXCERPT_LENGTH + 3}) NOT NULL DEFAULT ''")
+    # Same rule as models.make_excerpt, in one set-based UPDATE. Setting updated_at to itself
+    # keeps its onupdate from stamping every dream, which would change every Last-Modified/ETag
+    columns = Dream.__table__.c
+    conn.execute(update(Dream.__table__).values(excerpt=case(
+        (func.length(columns.description) > EXCERPT_LENGTH, func.substr(columns.description, 1, EXCERPT_LENGTH) + '...'),
+        else_=columns.description,
+    ), updated_at=columns.updated_at))
+
+
+@migration('0005_points_ledger')
+def add_points_ledger(conn):
+    from ledger import backfill, snapshot_range
+    from models import User
+    backfill(conn)
+    high = conn.execute(select(func.max(User.id))).scalar()
+    if high is not None:
+        snapshot_range(conn, 0, high)
+
+
+@migration('0006_facet_counts')
+def add_facet_counts(conn):
+    from facets import rebuild
+    rebuild(conn)
+
+
+@migration('0007_autoincrement_ids')
+def autoincrement_hot_ids(conn):
+    from models import Purchase, PurchaseArchive, Rating, RatingArchive
+    if conn.dialect.name != 'sqlite':
+        return  # sequences never hand out an id twice
+    for table, archive in ((Purchase.__table__, PurchaseArchive.__table__), (Rating.__table__, RatingArchive.__table__)):
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {'name': table.name}).scalar()
+        if 'AUTOINCREMENT' not in ddl.upper():
+            rebuild_sqlite_table(conn, table)
+        # Start above every id handed out so far, including ones that only survive in the archive
+        high = max(conn.execute(select(func.max(table.c.id))).scalar() or 0,
+                   conn.execute(select(func.max(archive.c.id))).scalar() or 0)
+        if conn.execute(text('UPDATE sqlite_sequence SET seq = max(seq, :high) WHERE name = :name'),
+                        {'high': high, 'name': table.name}).rowcount == 0:
+            conn.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :high)'),
+                         {'high': high, 'name': table.name})
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'id VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def _applied(conn):
+    return {row[0] for row in conn.execute(text('SELECT id FROM schema_migrations'))}
+
+
+def _record(conn, migration_id):
+    conn.execute(text('INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :at)'),
+                 {'id': migration_id, 'at': datetime.utcnow()})
+
+
+def init_db():
+    """Create the full schema and mark every migration as applied"""
+    import models  # noqa: F401 - register the tables
+    db.create_all()
+    with db.engine.begin() as conn:
+        _ensure_version_table(conn)
+        applied = _applied(conn)
+        for migration_id, _ in MIGRATIONS:
+            if migration_id not in applied:
+                _record(conn, migration_id)
+
+
+def upgrade():
+    """Apply pending migrations; returns the ids that ran"""
+    import models  # noqa: F401 - register the tables
+    with db.engine.connect() as conn:
+        fresh = not inspect(conn).has_table('user')
+    if fresh:
+        init_db()
+        return []
+
+    # Tables added since the database was created need no migration step
+    db.create_all()
+    ran = []
+    with db.engine.begin() as conn:
+        _ensure_version_table(conn)
+        applied = _applied(conn)
+    for migration_id, fn in MIGRATIONS:
+        if migration_id in applied:
+            continue
+        with db.engine.begin() as conn:
+            fn(conn)
+            _record(conn, migration_id)
+        ran.append(migration_id)
+    return ran
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create all tables for a new database."""
+    init_db()
+    click.echo('Database initialized.')
+
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """Bring an existing database up to date."""
+    ran = upgrade()
+    click.echo(f"Applied {len(ran)} migration(s){': ' + ', '.join(ran) if ran else ''}.")
+
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
@@ -1,7 +1,18 @@
-from app import db
+from extensions import db
 from flask_login import UserMixin
 from datetime import datetime
 from sqlalchemy import func
+from sqlalchemy.orm import validates
+
+# Listing cards show at most this many characters of a description
+EXCERPT_LENGTH = 200
+
+def make_excerpt(description):
+    """The card snippet for a description: its first EXCERPT_LENGTH characters, with '...' when cut"""
+    description = description or ''
+    if len(description) > EXCERPT_LENGTH:
+        return description[:EXCERPT_LENGTH] + '...'
+    return description
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,6 +23,9 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     bio = db.Column(db.Text)
     dream_tag = db.Column(db.String(50))  # User's dream specialization tag
+    # Lifetime sales of the user's dreams, kept up to date by process_dream_purchase
+    sales_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_earnings = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     dreams = db.relationship('Dream', backref='author', lazy=True, cascade='all, delete-orphan')
@@ -21,6 +35,13 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
     
+    def cache_tags(self):
+        """Cache tags to invalidate when this user changes"""
+        tags = {f'user:{self.id}'}
+        if db.inspect(self).attrs.username.history.has_changes():
+            tags.update(('dreams', 'usernames'))  # listings show author names, dream pages rater names
+        return tags
+    
     def get_average_rating(self):
         """Calculate average rating for dreams sold by this user"""
         avg = db.session.query(func.avg(Dream.average_rating)).filter_by(author_id=self.id).scalar()
@@ -28,33 +49,52 @@ class User(UserMixin, db.Model):
     
     def get_total_sales(self):
         """Get total number of dreams sold"""
-        return Purchase.query.filter_by(dream_id=Dream.id).join(Dream).filter_by(author_id=self.id).count()
+        return self.sales_count
 
 class Dream(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
+    # Derived from description on write, so listings never load the full text
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 3), nullable=False, default='', server_default='')
     category = db.Column(db.String(50), nullable=False)  # surreal, funny, scary, romantic, bizarre
     price = db.Column(db.Integer, nullable=False)  # Price in points
     image_filename = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     average_rating = db.Column(db.Float, default=0.0)
     total_ratings = db.Column(db.Integer, default=0)
+    purchase_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # lifetime sales
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
-    # Relationships
-    purchases = db.relationship('Purchase', backref='dream', lazy=True, cascade='all, delete-orphan')
-    ratings = db.relationship('Rating', backref='dream', lazy=True, cascade='all, delete-orphan')
+    # Relationships; the database deletes purchases and ratings with the dream (ON DELETE CASCADE)
+    purchases = db.relationship('Purchase', backref='dream', lazy=True, cascade='all, delete-orphan',
+                                passive_deletes=True)
+    ratings = db.relationship('Rating', backref='dream', lazy=True, cascade='all, delete-orphan',
+                              passive_deletes=True)
+    
+    # Backs the best_selling sort
+    __table_args__ = (db.Index('ix_dream_purchase_count', 'purchase_count', 'id'),)
     
     def __repr__(self):
         return f'<Dream {self.title}>'
     
+    @validates('description')
+    def _set_excerpt(self, key, description):
+        self.excerpt = make_excerpt(description)
+        return description
+    
+    def cache_tags(self):
+        """Cache tags to invalidate when this dream changes"""
+        return {f'dream:{self.id}', f'user:{self.author_id}', 'dreams', 'leaderboard'}
+    
     def update_rating(self):
-        """Update average rating based on all ratings"""
-        ratings = Rating.query.filter_by(dream_id=self.id).all()
-        if ratings:
-            self.average_rating = sum(r.rating for r in ratings) / len(ratings)
-            self.total_ratings = len(ratings)
+        """Update average rating based on all ratings, archived ones included"""
+        from archive import rating_totals
+        count, total = rating_totals(self.id)
+        if count:
+            self.average_rating = total / count
+            self.total_ratings = count
         else:
             self.average_rating = 0.0
             self.total_ratings = 0
@@ -64,35 +104,186 @@ class Dream(db.Model):
         """Check if dream is purchased by given user"""
         if not user.is_authenticated:
             return False
-        return Purchase.query.filter_by(buyer_id=user.id, dream_id=self.id).first() is not None
+        from archive import has_purchased
+        return has_purchased(user.id, self.id)
     
     def get_user_rating(self, user):
         """Get rating given by specific user"""
         if not user.is_authenticated:
             return None
-        rating = Rating.query.filter_by(rater_id=user.id, dream_id=self.id).first()
+        rating = Rating.query.filter_by(rater_id=user.id, dream_id=self.id).first() \
+            or RatingArchive.query.filter_by(rater_id=user.id, dream_id=self.id).first()
         return rating.rating if rating else None
 
 class Purchase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id'), nullable=False)
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False, index=True)
     purchase_date = db.Column(db.DateTime, default=datetime.utcnow)
     price_paid = db.Column(db.Integer, nullable=False)  # Points paid at time of purchase
     
+    # Ids are never reused, so they can't collide with archived purchases
+    __table_args__ = {'sqlite_autoincrement': True}
+    
     def __repr__(self):
         return f'<Purchase {self.buyer_id} -> {self.dream_id}>'
+    
+    def cache_tags(self):
+        return {f'dream:{self.dream_id}', f'user:{self.buyer_id}'}
 
 class Rating(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     rater_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id'), nullable=False)
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False, index=True)
     rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
     review = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Ensure one rating per user per dream
-    __table_args__ = (db.UniqueConstraint('rater_id', 'dream_id', name='unique_user_dream_rating'),)
+    # Ensure one rating per user per dream; ids are never reused, so they can't collide with archived ratings
+    __table_args__ = (db.UniqueConstraint('rater_id', 'dream_id', name='unique_user_dream_rating'),
+                      {'sqlite_autoincrement': True})
     
     def __repr__(self):
         return f'<Rating {self.rating}/5 for Dream {self.dream_id}>'
+    
+    def cache_tags(self):
+        return {f'dream:{self.dream_id}', f'user:{self.rater_id}', 'leaderboard'}
+
+class DreamSimilarity(db.Model):
+    """Top co-purchase neighbours of a dream, written by the recommender batch job"""
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 is the most similar
+    similar_dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)  # cosine similarity, 0-1
+    
+    def __repr__(self):
+        return f'<DreamSimilarity {self.dream_id} -> {self.similar_dream_id} ({self.score:.2f})>'
+
+class RecommenderState(db.Model):
+    """Watermarks of the last recommender run, for incremental refreshes"""
+    id = db.Column(db.Integer, primary_key=True)
+    last_purchase_id = db.Column(db.Integer, nullable=False, default=0)
+    last_rating_id = db.Column(db.Integer, nullable=False, default=0)
+    built_at = db.Column(db.DateTime)
+
+class PurchaseArchive(db.Model):
+    """Purchases moved out of the purchase table by the archival job, with their original ids"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False, index=True)
+    purchase_date = db.Column(db.DateTime)
+    price_paid = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (db.Index('ix_purchase_archive_buyer_dream', 'buyer_id', 'dream_id'),)
+
+class RatingArchive(db.Model):
+    """Ratings moved out of the rating table by the archival job, with their original ids"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rater_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), nullable=False, index=True)
+    rating = db.Column(db.Integer, nullable=False)
+    review = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.UniqueConstraint('rater_id', 'dream_id', name='unique_archived_user_dream_rating'),)
+
+class UserHistory(db.Model):
+    """Per-user totals of archived purchases and ratings"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    purchases = db.Column(db.Integer, nullable=False, default=0)
+    spent = db.Column(db.Integer, nullable=False, default=0)
+    sales = db.Column(db.Integer, nullable=False, default=0)
+    earnings = db.Column(db.Integer, nullable=False, default=0)
+    ratings_given = db.Column(db.Integer, nullable=False, default=0)
+
+class DreamHistory(db.Model):
+    """Per-dream totals of archived purchases and ratings"""
+    dream_id = db.Column(db.Integer, db.ForeignKey('dream.id', ondelete='CASCADE'), primary_key=True)
+    purchases = db.Column(db.Integer, nullable=False, default=0)
+    ratings = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FacetCount(db.Model):
+    """Number of dreams per category and price bucket, for the marketplace sidebar"""
+    category = db.Column(db.String(50), primary_key=True)
+    price_bucket = db.Column(db.Integer, primary_key=True)  # index into facets.PRICE_BUCKETS
+    dreams = db.Column(db.Integer, nullable=False, default=0)
+
+class LedgerEntry(db.Model):
+    """One movement of a user's points; rows are only ever appended"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)  # signed: credits are positive
+    kind = db.Column(db.String(20), nullable=False)  # opening, grant, purchase, sale, bonus
+    ref_id = db.Column(db.Integer)  # purchase id or bonus run id
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_ledger_entry_user_id', 'user_id', 'id'),)
+
+class BalanceSnapshot(db.Model):
+    """A user's ledger totals up to and including entry_id"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    entry_id = db.Column(db.Integer, primary_key=True)
+    balance = db.Column(db.Integer, nullable=False)
+    earned = db.Column(db.Integer, nullable=False)  # from sales
+    spent = db.Column(db.Integer, nullable=False)  # on purchases
+    as_of = db.Column(db.DateTime, nullable=False)  # created_at of entry_id
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BonusRun(db.Model):
+    """One weekly bonus payout; last_user_id is the resume point of an unfinished run"""
+    id = db.Column(db.Integer, primary_key=True)
+    run_key = db.Column(db.String(20), unique=True, nullable=False)  # ISO week, e.g. 2026-W42
+    amount = db.Column(db.Integer, nullable=False)  # points per eligible user
+    eligible_before = db.Column(db.DateTime, nullable=False)  # users created before this are paid
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    users_credited = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<BonusRun {self.run_key}>'
+
+class TypeaheadChange(db.Model):
+    """A committed title, username or score change, replayed by every worker's typeahead index"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'dream' or 'user'
+    entry_id = db.Column(db.Integer, nullable=False)
+    text = db.Column(db.String(200))  # None once the dream or user is deleted
+    score = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    # Workers read on from the last id they saw, so ids must only grow
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    def __repr__(self):
+        return f'<TypeaheadChange {self.kind} {self.entry_id}>'
+
+class ImportJob(db.Model):
+    """One bulk import uploaded through the web, run in the background; the import page polls it"""
+    id = db.Column(db.Integer, primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    manifest_name = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    images = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=False, default='[]')  # JSON [[row number, reason], ...]
+    message = db.Column(db.Text)  # why the whole job failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # last progress; a stuck job stops moving it
+    finished_at = db.Column(db.DateTime)
+    
+    @property
+    def error_list(self):
+        import json
+        return json.loads(self.errors)
+    
+    @property
+    def seconds(self):
+        return ((self.finished_at or self.updated_at) - self.created_at).total_seconds()
+    
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.status}>'
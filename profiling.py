@@ -0,0 +1,153 @@
+"""
+Per-request profiling for Neural Dreams Inc.
+Counts SQL queries, DB time and template render time per endpoint and
+flags statements repeated within one request (the usual N+1 pattern)
+"""
+import random
+import re
+import time
+from collections import Counter
+from flask import current_app, g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+from markupsafe import escape
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|:\w+)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalize a SQL statement so repeated executions compare equal"""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    return _IN_LIST.sub('(?, ...)', shape)
+
+
+class RequestProfile:
+    """Timings and query shapes collected while handling one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.shapes = Counter()
+        self._template_started = []
+
+    def duplicates(self, threshold=None):
+        """Get statement shapes executed at least `threshold` times, most repeated first"""
+        threshold = threshold or current_app.config['PROFILING_DUPLICATE_THRESHOLD']
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+
+def current_profile():
+    """Get the profile for the current request, if profiling is active"""
+    if not has_app_context():
+        return None
+    return g.get('_request_profile')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is not None:
+        conn.info.setdefault('_profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is None:
+        return
+    started = conn.info.get('_profile_started')
+    if started:
+        profile.db_time += time.perf_counter() - started.pop()
+    profile.query_count += 1
+    profile.shapes[statement_shape(statement)] += 1
+
+
+def _before_render(app, template, context, **extra):
+    profile = current_profile()
+    if profile is not None:
+        profile._template_started.append(time.perf_counter())
+
+
+def _after_render(app, template, context, **extra):
+    profile = current_profile()
+    if profile is not None and profile._template_started:
+        started = profile._template_started.pop()
+        # Only the outermost render counts; includes are part of it
+        if not profile._template_started:
+            profile.template_time += time.perf_counter() - started
+
+
+def _start_profile():
+    g._request_profile = RequestProfile()
+
+
+def _finish_profile(response):
+    profile = g.pop('_request_profile', None)
+    if profile is None:
+        return response
+
+    duplicates = profile.duplicates()
+    mode = current_app.config['PROFILING_MODE']
+    if mode in ('headers', 'panel'):
+        response.headers['X-DB-Query-Count'] = str(profile.query_count)
+        response.headers['X-DB-Time-ms'] = f'{profile.db_time * 1000:.1f}'
+        response.headers['X-Template-Time-ms'] = f'{profile.template_time * 1000:.1f}'
+        response.headers['X-DB-Duplicate-Statements'] = str(len(duplicates))
+        response.headers['Server-Timing'] = (
+            f'db;desc="{profile.query_count} queries";dur={profile.db_time * 1000:.1f}, '
+            f'tpl;dur={profile.template_time * 1000:.1f}, '
+            f'total;dur={profile.total_time * 1000:.1f}'
+        )
+    if mode == 'panel' and response.mimetype == 'text/html' and not response.direct_passthrough:
+        _inject_panel(response, profile, duplicates)
+
+    sample_rate = current_app.config['PROFILING_SAMPLE_RATE']
+    if sample_rate and random.random() < sample_rate:
+        current_app.logger.info(
+            f"profile endpoint={request.endpoint} status={response.status_code} "
+            f"queries={profile.query_count} db_ms={profile.db_time * 1000:.1f} "
+            f"template_ms={profile.template_time * 1000:.1f} total_ms={profile.total_time * 1000:.1f} "
+            f"duplicate_statements={len(duplicates)}"
+        )
+    return response
+
+
+def _inject_panel(response, profile, duplicates):
+    body = response.get_data(as_text=True)
+    if '</body>' not in body:
+        return
+    rows = ''.join(
+        f'<li><strong>{count}&times;</strong> <code>{escape(shape[:200])}</code></li>'
+        for shape, count in duplicates[:10]
+    )
+    panel = (
+        '<div id="profiling-panel" style="position:fixed;bottom:0;right:0;z-index:9999;max-width:40rem;'
+        'max-height:40vh;overflow:auto;background:#222;color:#eee;font-size:12px;padding:.5rem;opacity:.9">'
+        f'<div>{escape(request.endpoint or "-")}: {profile.query_count} queries, '
+        f'{profile.db_time * 1000:.1f} ms DB, {profile.template_time * 1000:.1f} ms templates, '
+        f'{profile.total_time * 1000:.1f} ms total</div>'
+        + (f'<div>Possible N+1 statements:</div><ul style="margin:0">{rows}</ul>' if rows else '')
+        + '</div>'
+    )
+    response.set_data(body.replace('</body>', panel + '</body>', 1))
+
+
+def init_profiling(app):
+    """Install the profiling hooks when a profiling mode or log sampling is enabled"""
+    if app.config['PROFILING_MODE'] not in ('headers', 'panel') and not app.config['PROFILING_SAMPLE_RATE']:
+        return False
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    return True
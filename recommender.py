@@ -0,0 +1,207 @@
+"""
+Co-purchase recommendations for Neural Dreams Inc.
+A batch job turns purchases and ratings into a sparse user x dream matrix,
+computes item-item cosine similarity with SciPy and stores the top
+neighbours of each dream in dream_similarity, so the detail page needs a
+single indexed lookup.
+
+    flask --app app recommendations build     # full rebuild (e.g. nightly)
+    flask --app app recommendations refresh   # only dreams touched since the last run
+
+Needs numpy and scipy, which only the batch job imports.
+"""
+import time
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, select, union, update
+from extensions import db
+from archive import purchase_history, rating_history
+from models import DreamSimilarity, Purchase, Rating, RecommenderState
+
+TOP_K = 10
+BLOCK_SIZE = 1024  # dreams per similarity block; bounds peak memory
+INSERT_CHUNK = 5000
+
+recommendations_cli = AppGroup('recommendations', help='Build the similar-dreams table.')
+
+
+def _require_scipy():
+    try:
+        import numpy  # noqa: F401
+        import scipy.sparse  # noqa: F401
+    except ImportError:
+        raise click.ClickException('The recommender needs numpy and scipy: pip install numpy scipy')
+
+
+def load_matrix(conn):
+    """Build the user x dream interaction matrix (archived history included) and the dream id of each column.
+
+    A purchase counts 1; when the buyer also rated the dream the weight
+    becomes rating / 3, so 5 stars pulls harder than a plain purchase and
+    1 star much less.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    purchase_rows, rating_rows = purchase_history(), rating_history()
+    purchases = np.array(conn.execute(select(purchase_rows.buyer_id, purchase_rows.dream_id)).all(),
+                         dtype=np.int64).reshape(-1, 2)
+    ratings = np.array(conn.execute(select(rating_rows.rater_id, rating_rows.dream_id, rating_rows.rating)).all(),
+                       dtype=np.int64).reshape(-1, 3)
+
+    user_ids, user_index = np.unique(np.concatenate([purchases[:, 0], ratings[:, 0]]), return_inverse=True)
+    dream_ids, dream_index = np.unique(np.concatenate([purchases[:, 1], ratings[:, 1]]), return_inverse=True)
+    n_purchases = len(purchases)
+    shape = (len(user_ids), len(dream_ids))
+
+    bought = sparse.csr_matrix((np.ones(n_purchases), (user_index[:n_purchases], dream_index[:n_purchases])),
+                               shape=shape)
+    bought.data[:] = 1.0  # duplicate purchases collapse to one
+    rated = sparse.csr_matrix((ratings[:, 2] / 3, (user_index[n_purchases:], dream_index[n_purchases:])),
+                              shape=shape)
+    # Ratings replace the plain purchase weight where both exist
+    matrix = bought - bought.multiply(rated > 0) + rated
+    matrix.eliminate_zeros()
+    return matrix.tocsc(), dream_ids
+
+
+def top_neighbours(matrix, dream_ids, columns, k=TOP_K):
+    """Yield DreamSimilarity rows for the given column positions"""
+    import numpy as np
+    from scipy import sparse
+
+    # Unit-length columns make the dot product the cosine similarity
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    norms[norms == 0] = 1.0
+    unit = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+
+    for start in range(0, len(columns), BLOCK_SIZE):
+        block = columns[start:start + BLOCK_SIZE]
+        similarity = (unit[:, block].T @ unit).tocsr()
+        for row, column in enumerate(block):
+            begin, end = similarity.indptr[row], similarity.indptr[row + 1]
+            neighbours = similarity.indices[begin:end]
+            scores = similarity.data[begin:end]
+            keep = neighbours != column
+            neighbours, scores = neighbours[keep], scores[keep]
+            # Highest score first, ties broken by the newer dream so reruns agree
+            order = np.lexsort((-dream_ids[neighbours], -scores))[:k]
+            dream_id = int(dream_ids[column])
+            for rank, position in enumerate(order):
+                yield {
+                    'dream_id': dream_id,
+                    'rank': rank,
+                    'similar_dream_id': int(dream_ids[neighbours[position]]),
+                    'score': min(float(scores[position]), 1.0),
+                }
+
+
+def _write_rows(conn, rows):
+    batch, written = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            conn.execute(insert(DreamSimilarity), batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        conn.execute(insert(DreamSimilarity), batch)
+        written += len(batch)
+    return written
+
+
+def _watermarks(conn):
+    return (conn.execute(select(func.coalesce(func.max(Purchase.id), 0))).scalar(),
+            conn.execute(select(func.coalesce(func.max(Rating.id), 0))).scalar())
+
+
+def _save_state(conn, last_purchase_id, last_rating_id):
+    values = {'last_purchase_id': last_purchase_id, 'last_rating_id': last_rating_id,
+              'built_at': datetime.utcnow()}
+    if conn.execute(select(RecommenderState.id).where(RecommenderState.id == 1)).first():
+        conn.execute(update(RecommenderState).where(RecommenderState.id == 1).values(**values))
+    else:
+        conn.execute(insert(RecommenderState).values(id=1, **values))
+
+
+def build(k=TOP_K):
+    """Recompute neighbours for every dream; returns (dreams, rows written)"""
+    with db.engine.begin() as conn:
+        # Taken first: anything newer is picked up again by the next refresh
+        last_purchase_id, last_rating_id = _watermarks(conn)
+        matrix, dream_ids = load_matrix(conn)
+        conn.execute(delete(DreamSimilarity))
+        written = _write_rows(conn, top_neighbours(matrix, dream_ids, list(range(len(dream_ids))), k))
+        _save_state(conn, last_purchase_id, last_rating_id)
+    return len(dream_ids), written
+
+
+def refresh(k=TOP_K):
+    """Recompute neighbours only for dreams whose similarities can have changed.
+
+    A new purchase or rating changes its dream's column, and with it the
+    score against every dream that shares a buyer with it. Edited ratings
+    keep their id, so a periodic full build is still needed to pick them up.
+    """
+    import numpy as np
+
+    with db.engine.connect() as conn:
+        state = conn.execute(select(RecommenderState).where(RecommenderState.id == 1)).first()
+    if state is None:
+        return build(k)
+
+    with db.engine.begin() as conn:
+        last_purchase_id, last_rating_id = _watermarks(conn)
+        changed_ids = conn.execute(union(
+            select(Purchase.dream_id).where(Purchase.id > state.last_purchase_id),
+            select(Rating.dream_id).where(Rating.id > state.last_rating_id),
+        )).scalars().all()
+        if not changed_ids:
+            return 0, 0
+
+        matrix, dream_ids = load_matrix(conn)
+        changed = np.searchsorted(dream_ids, changed_ids)
+        users = np.unique(matrix[:, changed].nonzero()[0])
+        affected = np.unique(matrix.tocsr()[users].nonzero()[1]).tolist()
+        affected_ids = [int(dream_ids[column]) for column in affected]
+
+        for start in range(0, len(affected_ids), 500):
+            conn.execute(delete(DreamSimilarity).where(
+                DreamSimilarity.dream_id.in_(affected_ids[start:start + 500])))
+        written = _write_rows(conn, top_neighbours(matrix, dream_ids, affected, k))
+        _save_state(conn, last_purchase_id, last_rating_id)
+    return len(affected_ids), written
+
+
+def _invalidate_pages():
+    cache = current_app.extensions.get('cache')
+    if cache is not None:
+        cache.invalidate('recommendations')
+
+
+@recommendations_cli.command('build')
+@click.option('--top-k', default=TOP_K, show_default=True, help='Neighbours stored per dream.')
+def build_command(top_k):
+    """Rebuild similar dreams for the whole catalogue."""
+    _require_scipy()
+    started = time.perf_counter()
+    dreams, rows = build(top_k)
+    _invalidate_pages()
+    click.echo(f'Built {rows} neighbours for {dreams} dreams in {time.perf_counter() - started:.1f}s.')
+
+
+@recommendations_cli.command('refresh')
+@click.option('--top-k', default=TOP_K, show_default=True, help='Neighbours stored per dream.')
+def refresh_command(top_k):
+    """Update similar dreams affected by purchases and ratings since the last run."""
+    _require_scipy()
+    started = time.perf_counter()
+    dreams, rows = refresh(top_k)
+    _invalidate_pages()
+    click.echo(f'Refreshed {rows} neighbours for {dreams} dreams in {time.perf_counter() - started:.1f}s.')
+
+
+def init_recommender(app):
+    app.cli.add_command(recommendations_cli)
@@ -0,0 +1,125 @@
+"""
+Read replica routing for Neural Dreams Inc.
+Sends reads made inside read-only scopes to replica engines while keeping
+writes, and reads that follow a write, on the primary database
+"""
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlite_profile import engine_options, configure_sqlite_engine
+
+# Flask session key holding the time until which reads stay on the primary
+STICKY_SESSION_KEY = '_db_primary_until'
+
+# The AsyncReader whose engines serve this request, while asgi.py runs a view on the event loop
+serving_reader = ContextVar('serving_reader', default=None)
+
+
+class RoutingSession(Session):
+    """Session that picks a replica engine for reads inside a read-only scope"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        reader = serving_reader.get()
+        if reader is not None and bind is None:
+            return reader.bind(replica=not self._flushing and _should_use_replica(self, clause))
+        if bind is None and not self._flushing and _should_use_replica(self, clause):
+            replica = _next_replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _should_use_replica(db_session, clause):
+    if not has_app_context() or not g.get('_db_read_only'):
+        return False
+    if clause is not None and getattr(clause, 'is_dml', False):
+        return False
+    # Read-your-writes: once this session wrote, it keeps reading the primary
+    if db_session.info.get('wrote'):
+        return False
+    if has_request_context() and session.get(STICKY_SESSION_KEY, 0) > time.time():
+        return False
+    return True
+
+
+def reads_from_replica(db_session):
+    """Whether a read in `db_session` right now may go to a replica (the same rules get_bind uses)"""
+    return _should_use_replica(db_session, None)
+
+
+def _next_replica():
+    state = current_app.extensions.get('db_replicas')
+    if not state or not state['engines']:
+        return None
+    return next(state['cycle'])
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _mark_commit(db_session):
+    if db_session.info.get('wrote') and has_app_context():
+        g._db_committed_write = True
+
+
+@contextmanager
+def read_only_scope():
+    """Allow queries in this block to be served by a replica"""
+    if not has_app_context():
+        yield
+        return
+    depth = g.get('_db_read_only', 0)
+    g._db_read_only = depth + 1
+    try:
+        yield
+    finally:
+        g._db_read_only = depth
+
+
+def read_only(fn):
+    """Decorator for route handlers and helpers that only read from the database"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with read_only_scope():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _keep_writer_on_primary(response):
+    # Replicas lag; pin this browser's reads to the primary for a short while
+    if g.get('_db_committed_write'):
+        session[STICKY_SESSION_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+
+def init_replicas(app, urls=None):
+    """Create replica engines for the app from DATABASE_REPLICA_URLS"""
+    urls = app.config.get('DATABASE_REPLICA_URLS', []) if urls is None else urls
+    engines = []
+    for url in urls:
+        engine = create_engine(url, **engine_options(url, app.config))
+        configure_sqlite_engine(engine, app.config)
+        engines.append(engine)
+
+    app.extensions['db_replicas'] = {
+        'engines': engines,
+        'cycle': itertools.cycle(engines),
+    }
+    if engines:
+        app.after_request(_keep_writer_on_primary)
+        app.logger.info(f"Routing read-only queries to {len(engines)} replica(s)")
+    return engines
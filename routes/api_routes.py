@@ -0,0 +1,251 @@
+"""
+Versioned JSON API for Neural Dreams Inc.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import math
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, Response, current_app, request
+from flask_login import current_user
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import joinedload, load_only
+from extensions import db
+from replicas import read_only
+from models import Dream, User
+from archive import has_purchased, rating_history
+from async_db import gather
+from dream_utils import (DREAM_SORTS, filter_dreams, sort_dreams, validate_purchase, process_dream_purchase,
+                         save_dream_rating, get_user_stats)
+from typeahead import get_typeahead
+from serializers import DREAM_FIELDS, DEFAULT_LIST_FIELDS, dumps, parse_fields, dream_columns, serialize_dream, serialize_rating
+
+api_bp = Blueprint('api', __name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+DETAIL_RATINGS = 20
+
+
+def json_response(payload, status=200, last_modified=None):
+    """Serialize a payload and answer conditional GETs with 304 when it is unchanged"""
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    if request.method == 'GET' and status == 200:
+        response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Clients may keep a copy but must revalidate it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.make_conditional(request)
+    return response
+
+
+def api_error(message, status):
+    return json_response({'error': message}, status)
+
+
+def api_login_required(f):
+    """Like login_required, but answers with a JSON 401 instead of a redirect.
+
+    Writes must be sent as application/json: browsers cannot post that
+    cross-site without a CORS preflight, which stands in for the CSRF token.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return api_error('Authentication required', 401)
+        if request.method == 'POST' and not request.is_json:
+            return api_error('Expected an application/json body', 415)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def encode_cursor(value, dream_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(dumps([value, dream_id])).decode('ascii').rstrip('=')
+
+
+def decode_cursor(raw, column):
+    """Decode a cursor into (sort value, dream id); raises ValueError when malformed"""
+    try:
+        value, dream_id = json.loads(base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4)))
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not _is_int(dream_id):
+        raise ValueError('Invalid cursor')
+    # The value goes straight into the keyset comparison, so it must match the column's type
+    python_type = column.type.python_type
+    if python_type is datetime:
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+    elif python_type is int:
+        if not _is_int(value):
+            raise ValueError('Invalid cursor')
+    elif python_type is float:
+        if not (_is_int(value) or (isinstance(value, float) and math.isfinite(value))):
+            raise ValueError('Invalid cursor')
+    elif not isinstance(value, python_type):
+        raise ValueError('Invalid cursor')
+    return value, dream_id
+
+
+def _is_int(value):
+    # bool is an int subclass; databases take 64-bit integers
+    return type(value) is int and -2 ** 63 <= value < 2 ** 63
+
+
+def _get_dream(dream_id):
+    return db.session.get(Dream, dream_id)
+
+
+@api_bp.route('/dreams')
+@read_only
+def list_dreams():
+    sort_by = request.args.get('sort_by', 'newest')
+    if sort_by not in DREAM_SORTS:
+        return api_error(f'Unknown sort_by, expected one of: {", ".join(DREAM_SORTS)}', 400)
+    column, descending = DREAM_SORTS[sort_by]
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    fields = parse_fields(request.args.get('fields'), DREAM_FIELDS, DEFAULT_LIST_FIELDS)
+
+    query = filter_dreams(Dream.query,
+                          request.args.get('query', ''),
+                          request.args.get('category', ''),
+                          request.args.get('min_price', type=int),
+                          request.args.get('max_price', type=int))
+
+    # Keyset pagination: continue after the last (sort value, id) of the previous page
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            value, last_id = decode_cursor(cursor, column)
+        except ValueError as e:
+            return api_error(str(e), 400)
+        if descending:
+            query = query.filter(or_(column < value, and_(column == value, Dream.id < last_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, Dream.id > last_id)))
+
+    query = query.options(load_only(*dream_columns(fields), column))
+    if 'author' in fields:
+        query = query.options(joinedload(Dream.author).load_only(User.id, User.username))
+    dreams = sort_dreams(query, sort_by).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(dreams) > limit:
+        dreams = dreams[:limit]
+        next_cursor = encode_cursor(getattr(dreams[-1], column.key), dreams[-1].id)
+
+    return json_response({
+        'items': [serialize_dream(dream, fields) for dream in dreams],
+        'next_cursor': next_cursor,
+    })
+
+
+@api_bp.route('/dreams/<int:dream_id>')
+@read_only
+def dream_detail(dream_id):
+    # The dream and its latest ratings are independent: concurrent on the ASGI read path
+    statements = [select(Dream).options(joinedload(Dream.author)).where(Dream.id == dream_id)]
+    include_ratings = 'ratings' in request.args.get('include', '').split(',')
+    if include_ratings:
+        history = rating_history()
+        statements.append(select(history).options(joinedload(history.rater).load_only(User.username))
+                          .filter(history.dream_id == dream_id)
+                          .order_by(history.created_at.desc(), history.id.desc())
+                          .limit(DETAIL_RATINGS))
+    results = gather(*statements)
+    dream = results[0].scalar()
+    if dream is None:
+        return api_error('Dream not found', 404)
+    fields = parse_fields(request.args.get('fields'), DREAM_FIELDS, DREAM_FIELDS)
+    data = serialize_dream(dream, fields)
+    if include_ratings:
+        data['ratings'] = [serialize_rating(rating) for rating in results[1].scalars()]
+
+    # Viewer-specific state changes without touching the dream, so it disables Last-Modified
+    last_modified = dream.updated_at
+    if current_user.is_authenticated:
+        data['viewer'] = {
+            'is_author': dream.author_id == current_user.id,
+            'purchased': dream.is_purchased_by(current_user),
+            'can_purchase': validate_purchase(current_user, dream)[0],
+        }
+        last_modified = None
+
+    return json_response(data, last_modified=last_modified)
+
+
+@api_bp.route('/dreams/<int:dream_id>/purchase', methods=['POST'])
+@api_login_required
+def purchase_dream(dream_id):
+    dream = _get_dream(dream_id)
+    if dream is None:
+        return api_error('Dream not found', 404)
+
+    success, message = process_dream_purchase(current_user, dream)
+    if not success:
+        return api_error(message, 409)
+    return json_response({'purchased': True, 'dream_id': dream.id, 'points': current_user.points})
+
+
+@api_bp.route('/dreams/<int:dream_id>/rating', methods=['POST'])
+@api_login_required
+def rate_dream(dream_id):
+    dream = _get_dream(dream_id)
+    if dream is None:
+        return api_error('Dream not found', 404)
+
+    if not has_purchased(current_user.id, dream.id):
+        return api_error('You can only rate dreams you have purchased', 403)
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error('Expected a JSON object', 400)
+    rating_value = body.get('rating')
+    review = body.get('review') or ''
+    if not isinstance(rating_value, int) or isinstance(rating_value, bool) or not 1 <= rating_value <= 5:
+        return api_error('rating must be an integer from 1 to 5', 400)
+    if not isinstance(review, str) or len(review) > 500:
+        return api_error('review must be a string of at most 500 characters', 400)
+
+    save_dream_rating(current_user, dream, rating_value, review)
+    return json_response({
+        'dream_id': dream.id,
+        'rating': rating_value,
+        'average_rating': dream.average_rating,
+        'total_ratings': dream.total_ratings,
+    })
+
+
+@api_bp.route('/users/<username>/stats')
+@read_only
+def user_stats(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        return api_error('User not found', 404)
+
+    return json_response({
+        'username': user.username,
+        'dream_tag': user.dream_tag,
+        'member_since': user.created_at,
+        'stats': get_user_stats(user),
+    })
+
+
+@api_bp.route('/typeahead')
+def typeahead_suggestions():
+    """Dream titles and usernames starting with ?q=, best rated and best selling first, from memory"""
+    prefix = request.args.get('q', '').strip()[:200]
+    limit = min(max(request.args.get('limit', current_app.config['TYPEAHEAD_LIMIT'], type=int), 1),
+                current_app.config['TYPEAHEAD_MAX_LIMIT'])
+    dreams, users = get_typeahead().search(prefix, limit) if prefix else ([], [])
+    return json_response({
+        'dreams': [{'id': dream_id, 'title': title, 'average_rating': rating} for dream_id, title, rating in dreams],
+        'users': [{'username': username, 'sales_count': int(sales)} for _, username, sales in users],
+    })
@@ -1,10 +1,11 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from app import db
+from extensions import db
 from models import User
 from forms import LoginForm, SignupForm
 from config import Config
+from credentials import get_credential_service, allow_login_attempt, allow_signup_attempt, HashingBusy
+from ledger import record
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -15,9 +16,21 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        if not allow_login_attempt(form.username.data, request.remote_addr):
+            flash('Too many attempts to enter the dream realm. Please wait a moment and try again.', 'warning')
+            return render_template('login.html', form=form), 429
+        
         user = User.query.filter_by(username=form.username.data).first()
         
-        if user and user.password_hash and check_password_hash(user.password_hash, form.password.data):
+        try:
+            valid = user is not None and get_credential_service().verify_password(user, form.password.data)
+        except HashingBusy:
+            flash('The dream realm is very busy right now. Please try again in a moment.', 'warning')
+            return render_template('login.html', form=form), 503
+        
+        if valid:
+            # Persist a rehashed password if the hashing parameters changed
+            db.session.commit()
             login_user(user, remember=True)
             flash(f'Welcome back to the dream realm, {user.username}!', 'success')
             
@@ -36,15 +49,25 @@ def signup():
     
     form = SignupForm()
     if form.validate_on_submit():
+        if not allow_signup_attempt(request.remote_addr):
+            flash('Too many new dream walkers from your location. Please try again later.', 'warning')
+            return render_template('signup.html', form=form), 429
+        
         # Create new user
         user = User()
         user.username = form.username.data
         user.email = form.email.data
         if form.password.data:
-            user.password_hash = generate_password_hash(form.password.data)
+            try:
+                user.password_hash = get_credential_service().hash_password(form.password.data)
+            except HashingBusy:
+                flash('The dream realm is very busy right now. Please try again in a moment.', 'warning')
+                return render_template('signup.html', form=form), 503
         user.points = Config.STARTING_POINTS
         
         db.session.add(user)
+        db.session.flush()
+        record(user.id, Config.STARTING_POINTS, 'grant')
         db.session.commit()
         
         flash(f'Welcome to Neural Dreams Inc., {user.username}! You start with {Config.STARTING_POINTS} dream points.', 'success')
@@ -0,0 +1,54 @@
+"""
+Cart routes for Neural Dreams Inc.
+"""
+from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask_login import login_required, current_user
+from models import Dream
+from replicas import read_only
+from checkout import add_to_cart, checkout, clear_cart, get_cart, remove_from_cart, validate_cart
+
+cart_bp = Blueprint('cart', __name__)
+
+@cart_bp.route('/')
+@login_required
+@read_only
+def view_cart():
+    dreams, problems, total = validate_cart(current_user, get_cart())
+    # Deleted dreams have nothing to show; drop them quietly
+    gone = set(get_cart()) - {dream.id for dream in dreams}
+    if gone:
+        remove_from_cart(*gone)
+    return render_template('cart.html', dreams=dreams, problems=problems, total=total)
+
+@cart_bp.route('/add/<int:id>', methods=['POST'])
+@login_required
+def add(id):
+    dream = Dream.query.get_or_404(id)
+    if add_to_cart(dream.id):
+        flash(f'"{dream.title}" is in your cart.', 'success')
+    else:
+        flash('Your cart is full. Check out or remove a dream first.', 'warning')
+    return redirect(request.referrer or url_for('marketplace.dream_detail', id=id))
+
+@cart_bp.route('/remove/<int:id>', methods=['POST'])
+@login_required
+def remove(id):
+    remove_from_cart(id)
+    return redirect(url_for('cart.view_cart'))
+
+@cart_bp.route('/checkout', methods=['POST'])
+@login_required
+def checkout_cart():
+    success, message, problems = checkout(current_user, get_cart())
+    if success:
+        clear_cart()
+        flash(message, 'success')
+        return redirect(url_for('profile.purchases'))
+
+    # Nothing was bought; drop the items that can never succeed so the rest can be retried
+    if problems:
+        remove_from_cart(*problems)
+        flash(f'{message}. We removed {len(problems)} of them from your cart; nothing was charged.', 'danger')
+    else:
+        flash(message, 'danger')
+    return redirect(url_for('cart.view_cart'))
@@ -1,21 +1,24 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, abort, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
-from app import db
-from models import Dream, Purchase, Rating, User
-from forms import DreamForm, RatingForm, SearchForm
-from dream_utils import save_dream_image, delete_dream_image, process_dream_purchase, validate_purchase
-from sqlalchemy import or_, and_
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from extensions import db
+from replicas import read_only
+from models import Dream, User
+from forms import DreamForm, DreamImportForm, RatingForm, SearchForm
+from async_db import gather, paginate
+from archive import fold_dream_sales, purchased_dream_ids, rating_history
+from facets import facet_counts
+from dream_utils import save_dream_image, delete_dream_image, delete_dream_image_on_commit, process_dream_purchase, validate_purchase, filter_dreams, sort_dreams, save_dream_rating, get_similar_dreams, card_columns
 
 marketplace_bp = Blueprint('marketplace', __name__)
 
 @marketplace_bp.route('/')
+@read_only
 def index():
     form = SearchForm()
     page = request.args.get('page', 1, type=int)
     
-    # Base query
-    query = Dream.query
-    
     # Apply search filters
     search_query = request.args.get('query', '')
     category = request.args.get('category', '')
@@ -23,64 +26,60 @@ def index():
     max_price = request.args.get('max_price', type=int)
     sort_by = request.args.get('sort_by', 'newest')
     
-    if search_query:
-        query = query.filter(or_(
-            Dream.title.contains(search_query),
-            Dream.description.contains(search_query)
-        ))
-        form.query.data = search_query
-    
-    if category:
-        query = query.filter(Dream.category == category)
-        form.category.data = category
-    
-    if min_price is not None:
-        query = query.filter(Dream.price >= min_price)
-        form.min_price.data = min_price
+    query = filter_dreams(select(Dream).options(card_columns(), joinedload(Dream.author)),
+                          search_query, category, min_price, max_price)
+    form.query.data = search_query or None
+    form.category.data = category or None
     
-    if max_price is not None:
-        query = query.filter(Dream.price <= max_price)
-        form.max_price.data = max_price
+    # Sidebar counts: cached when unfiltered, one grouped query per search otherwise
+    facets = facet_counts(search_query, category, min_price, max_price)
+    form.category.choices = [('', f"All Categories ({facets['total']})")] + [
+        (cat, f"{cat.title()} ({facets['categories'].get(cat, 0)})") for cat in current_app.config['DREAM_CATEGORIES']
+    ]
+    form.min_price.data = min_price
+    form.max_price.data = max_price
     
     # Apply sorting
-    if sort_by == 'newest':
-        query = query.order_by(Dream.created_at.desc())
-    elif sort_by == 'oldest':
-        query = query.order_by(Dream.created_at.asc())
-    elif sort_by == 'price_low':
-        query = query.order_by(Dream.price.asc())
-    elif sort_by == 'price_high':
-        query = query.order_by(Dream.price.desc())
-    elif sort_by == 'rating_high':
-        query = query.order_by(Dream.average_rating.desc())
-    elif sort_by == 'rating_low':
-        query = query.order_by(Dream.average_rating.asc())
-    
+    query = sort_dreams(query, sort_by)
     form.sort_by.data = sort_by
     
-    # Paginate results
-    dreams = query.paginate(
-        page=page, per_page=12, error_out=False
-    )
+    # Paginate results: the page and the total count run concurrently on the ASGI read path
+    dreams = paginate(query, page, per_page=12)
+    
+    # Viewer's ownership for the whole page in one query (rendered outside the card cache)
+    owned_ids = set()
+    if current_user.is_authenticated:
+        owned_ids = purchased_dream_ids(current_user.id, [dream.id for dream in dreams.items])
     
-    return render_template('marketplace.html', dreams=dreams, form=form)
+    return render_template('marketplace.html', dreams=dreams, form=form, owned_ids=owned_ids, facets=facets)
 
 @marketplace_bp.route('/dream/<int:id>')
+@read_only
 def dream_detail(id):
-    dream = Dream.query.get_or_404(id)
-    rating_form = RatingForm()
-    rating_form.dream_id.data = id
+    # The dream and its full rating history don't depend on each other: concurrent on the ASGI read path
+    history = rating_history()
+    dream, ratings = gather(
+        select(Dream).options(joinedload(Dream.author)).where(Dream.id == id),
+        select(history).options(joinedload(history.rater)).filter(history.dream_id == id)
+            .order_by(history.created_at.desc()),
+    )
+    dream = dream.scalar()
+    if dream is None:
+        abort(404)
+    # The author panel lazy-loads their dreams; attach the (possibly detached) dream without a query
+    dream = db.session.merge(dream, load=False)
+    ratings = ratings.scalars().all()
     
     # Get user's existing rating
     user_rating = None
+    rating_form = None  # a form would put a CSRF token in the session and keep the page out of the page cache
     if current_user.is_authenticated:
+        rating_form = RatingForm()
+        rating_form.dream_id.data = id
         user_rating = dream.get_user_rating(current_user)
         if user_rating:
             rating_form.rating.data = user_rating
     
-    # Get all ratings for this dream
-    ratings = Rating.query.filter_by(dream_id=id).order_by(Rating.created_at.desc()).all()
-    
     # Check if user can purchase
     can_purchase = False
     purchase_message = ""
@@ -93,7 +92,8 @@ def dream_detail(id):
                          user_rating=user_rating,
                          ratings=ratings,
                          can_purchase=can_purchase,
-                         purchase_message=purchase_message)
+                         purchase_message=purchase_message,
+                         similar_dreams=get_similar_dreams(dream))
 
 @marketplace_bp.route('/post', methods=['GET', 'POST'])
 @login_required
@@ -130,6 +130,40 @@ def post_dream():
     
     return render_template('post_dream.html', form=form)
 
+@marketplace_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_dreams():
+    from dream_import import MANIFEST_COLUMNS, start_import_job
+    # Manifests and image zips are far bigger than a single post
+    request.max_content_length = current_app.config['IMPORT_MAX_CONTENT_LENGTH']
+    form = DreamImportForm()
+    
+    if form.validate_on_submit():
+        try:
+            # Big imports outlast the worker timeout, so they run in the background
+            job = start_import_job(current_user, form.manifest.data, form.images.data or None)
+        except ValueError as e:
+            flash(str(e), 'danger')
+        else:
+            return redirect(url_for('marketplace.import_status', job_id=job.id))
+    
+    return render_template('import_dreams.html', form=form, job=None, columns=MANIFEST_COLUMNS)
+
+@marketplace_bp.route('/import/<int:job_id>')
+@login_required
+def import_status(job_id):
+    from datetime import datetime, timedelta
+    from dream_import import MANIFEST_COLUMNS
+    from models import ImportJob
+    job = db.session.get(ImportJob, job_id)
+    if job is None or job.author_id != current_user.id:
+        abort(404)
+    # A job whose worker restarted never finishes; stop polling it
+    stalled = job.status in ('queued', 'running') and \
+        job.updated_at < datetime.utcnow() - timedelta(seconds=current_app.config['IMPORT_STALE_SECONDS'])
+    return render_template('import_dreams.html', form=DreamImportForm(), job=job, stalled=stalled,
+                           columns=MANIFEST_COLUMNS)
+
 @marketplace_bp.route('/buy/<int:id>', methods=['POST'])
 @login_required
 def buy_dream(id):
@@ -156,30 +190,7 @@ def rate_dream(id):
         return redirect(url_for('marketplace.dream_detail', id=id))
     
     if form.validate_on_submit():
-        # Check for existing rating
-        existing_rating = Rating.query.filter_by(
-            rater_id=current_user.id,
-            dream_id=id
-        ).first()
-        
-        if existing_rating:
-            # Update existing rating
-            existing_rating.rating = form.rating.data
-            existing_rating.review = form.review.data
-        else:
-            # Create new rating
-            rating = Rating()
-            rating.rater_id = current_user.id
-            rating.dream_id = id
-            rating.rating = form.rating.data
-            rating.review = form.review.data
-            db.session.add(rating)
-        
-        db.session.commit()
-        
-        # Update dream's average rating
-        dream.update_rating()
-        
+        save_dream_rating(current_user, dream, form.rating.data, form.review.data)
         flash('Thank you for rating this dream!', 'success')
     else:
         flash('Error submitting rating. Please try again.', 'danger')
@@ -233,11 +244,11 @@ def delete_dream(id):
         flash('You can only delete your own dreams.', 'danger')
         return redirect(url_for('marketplace.dream_detail', id=id))
     
-    # Delete associated image
-    if dream.image_filename:
-        delete_dream_image(dream.image_filename)
+    # The image goes once the delete has committed
+    delete_dream_image_on_commit(db.session, dream.image_filename)
     
-    # Delete dream (cascades to ratings and purchases)
+    # Delete dream; the database cascades to ratings and purchases. The author keeps the sales
+    fold_dream_sales(dream)
     db.session.delete(dream)
     db.session.commit()
     
@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from datetime import datetime
+from flask import Blueprint, Response, abort, render_template, redirect, url_for, flash, request, stream_with_context
 from flask_login import login_required, current_user
-from app import db
-from models import User, Dream, Purchase, Rating
+from extensions import db
+from replicas import read_only, read_only_scope
+from models import User, Dream
+from archive import purchase_history, rating_history
 from forms import ProfileForm
-from dream_utils import get_user_stats
+from dream_utils import card_columns, get_user_stats
 
 profile_bp = Blueprint('profile', __name__)
 
@@ -13,19 +16,21 @@ def index():
     return redirect(url_for('profile.view_profile', username=current_user.username))
 
 @profile_bp.route('/<username>')
+@read_only
 def view_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
     
     # Get user's dreams
-    dreams = Dream.query.filter_by(author_id=user.id).order_by(Dream.created_at.desc()).all()
+    dreams = Dream.query.options(card_columns()).filter_by(author_id=user.id).order_by(Dream.created_at.desc()).all()
     
     # Get user statistics
     stats = get_user_stats(user)
     
     # Get recent ratings received
-    recent_ratings = db.session.query(Rating, Dream).join(Dream).filter(
+    ratings = rating_history()
+    recent_ratings = db.session.query(ratings, Dream).options(card_columns()).join(Dream, ratings.dream_id == Dream.id).filter(
         Dream.author_id == user.id
-    ).order_by(Rating.created_at.desc()).limit(5).all()
+    ).order_by(ratings.created_at.desc()).limit(5).all()
     
     # Check if viewing own profile
     is_own_profile = current_user.is_authenticated and current_user.id == user.id
@@ -33,9 +38,10 @@ def view_profile(username):
     # Get purchased dreams if viewing own profile
     purchased_dreams = []
     if is_own_profile:
-        purchased_dreams = db.session.query(Dream, Purchase).join(Purchase).filter(
-            Purchase.buyer_id == user.id
-        ).order_by(Purchase.purchase_date.desc()).all()
+        purchases = purchase_history()
+        purchased_dreams = db.session.query(Dream, purchases).options(card_columns()).join(purchases, purchases.dream_id == Dream.id).filter(
+            purchases.buyer_id == user.id
+        ).order_by(purchases.purchase_date.desc()).all()
     
     return render_template('profile.html', 
                          user=user, 
@@ -51,6 +57,9 @@ def edit_profile():
     form = ProfileForm(current_user.username, current_user.email, obj=current_user)
     
     if form.validate_on_submit():
+        if form.username.data != current_user.username:
+            # Cached dream cards show the author's name; bump their version
+            Dream.query.filter_by(author_id=current_user.id).update({'updated_at': datetime.utcnow()})
         current_user.username = form.username.data
         current_user.email = form.email.data
         current_user.bio = form.bio.data
@@ -64,13 +73,15 @@ def edit_profile():
 
 @profile_bp.route('/purchases')
 @login_required
+@read_only
 def purchases():
     page = request.args.get('page', 1, type=int)
     
-    # Get purchases using traditional SQLAlchemy approach
-    purchases_data = db.session.query(Purchase, Dream).join(Dream).filter(
-        Purchase.buyer_id == current_user.id
-    ).order_by(Purchase.purchase_date.desc())
+    # Get purchases, archived ones included
+    history = purchase_history()
+    purchases_data = db.session.query(history, Dream).options(card_columns()).join(Dream, history.dream_id == Dream.id).filter(
+        history.buyer_id == current_user.id
+    ).order_by(history.purchase_date.desc())
     
     # Manual pagination
     total = purchases_data.count()
@@ -98,13 +109,15 @@ def purchases():
 
 @profile_bp.route('/sales')
 @login_required
+@read_only
 def sales():
     page = request.args.get('page', 1, type=int)
     
-    # Get sales using traditional SQLAlchemy approach
-    sales_data = db.session.query(Purchase, Dream).join(Dream).filter(
+    # Get sales, archived ones included
+    history = purchase_history()
+    sales_data = db.session.query(history, Dream).options(card_columns()).join(Dream, history.dream_id == Dream.id).filter(
         Dream.author_id == current_user.id
-    ).order_by(Purchase.purchase_date.desc())
+    ).order_by(history.purchase_date.desc())
     
     # Manual pagination
     total = sales_data.count()
@@ -132,26 +145,56 @@ def sales():
 
 @profile_bp.route('/ratings-given')
 @login_required
+@read_only
 def ratings_given():
     page = request.args.get('page', 1, type=int)
     
     from sqlalchemy import select
-    ratings_query = select(Rating, Dream).join(Dream).filter(
-        Rating.rater_id == current_user.id
-    ).order_by(Rating.created_at.desc())
+    history = rating_history()
+    ratings_query = select(history, Dream).options(card_columns()).join(Dream, history.dream_id == Dream.id).filter(
+        history.rater_id == current_user.id
+    ).order_by(history.created_at.desc())
     ratings = db.paginate(ratings_query, page=page, per_page=10, error_out=False)
     
     return render_template('ratings_given.html', ratings=ratings)
 
 @profile_bp.route('/ratings-received')
 @login_required
+@read_only
 def ratings_received():
     page = request.args.get('page', 1, type=int)
     
     from sqlalchemy import select
-    ratings_query = select(Rating, Dream).join(Dream).filter(
+    history = rating_history()
+    ratings_query = select(history, Dream).options(card_columns()).join(Dream, history.dream_id == Dream.id).filter(
         Dream.author_id == current_user.id
-    ).order_by(Rating.created_at.desc())
+    ).order_by(history.created_at.desc())
     ratings = db.paginate(ratings_query, page=page, per_page=10, error_out=False)
     
     return render_template('ratings_received.html', ratings=ratings)
+
+@profile_bp.route('/export/<name>')
+@login_required
+def export(name):
+    from exports import EXPORTS, FORMATS, export_filename, iter_export, parse_date
+    fmt = request.args.get('format', 'csv')
+    if name not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+    try:
+        since = parse_date(request.args.get('since'))
+        until = parse_date(request.args.get('until'))
+    except ValueError:
+        abort(400)
+    
+    user_id = current_user.id
+    
+    def generate():
+        # Runs after the view returns, so the read-only scope is opened here
+        with read_only_scope():
+            yield from iter_export(name, user_id, fmt, since, until)
+    
+    response = Response(stream_with_context(generate()), mimetype=FORMATS[fmt])
+    filename = export_filename(name, current_user.username, fmt, since, until)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
@@ -11,11 +11,13 @@ from user_tags import (
     ACHIEVEMENT_TAGS
 )
 from models import User
-from app import db
+from extensions import db
+from replicas import read_only
 
 tag_bp = Blueprint('tags', __name__, url_prefix='/tags')
 
 @tag_bp.route('/')
+@read_only
 def tag_leaderboard():
     """Display tag leaderboard and statistics"""
     leaderboard = get_tag_leaderboard()
@@ -28,6 +30,7 @@ def tag_leaderboard():
                          all_tags=all_tags)
 
 @tag_bp.route('/category/<category>')
+@read_only
 def users_by_category(category):
     """Display users with a specific tag"""
     users = get_users_by_tag(category)
@@ -64,6 +67,7 @@ def update_all_tags():
 
 @tag_bp.route('/my-tag')
 @login_required
+@read_only
 def my_tag():
     """Display current user's tag information"""
     from user_tags import get_user_tag_info, analyze_user_dream_preferences
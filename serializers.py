@@ -0,0 +1,78 @@
+"""
+Compact JSON serialization for the Neural Dreams API.
+Uses orjson when it is installed and falls back to the standard library
+"""
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# Public field name -> Dream column attribute it needs loaded
+DREAM_FIELDS = ('id', 'title', 'description', 'excerpt', 'category', 'price', 'image_url',
+                'created_at', 'updated_at', 'average_rating', 'total_ratings', 'purchase_count', 'author')
+DEFAULT_LIST_FIELDS = ('id', 'title', 'category', 'price', 'image_url', 'average_rating',
+                       'total_ratings', 'author')
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def dumps(payload):
+    """Serialize to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def parse_fields(raw, allowed, default):
+    """Turn a ?fields=a,b,c value into a tuple of known field names"""
+    if not raw:
+        return tuple(default)
+    requested = tuple(name.strip() for name in raw.split(',') if name.strip() in allowed)
+    return requested or tuple(default)
+
+
+def dream_columns(fields):
+    """Get the Dream column attributes needed to serialize `fields`"""
+    from models import Dream
+    columns = {Dream.id}
+    mapping = {
+        'title': Dream.title, 'description': Dream.description, 'excerpt': Dream.excerpt,
+        'category': Dream.category, 'price': Dream.price, 'image_url': Dream.image_filename,
+        'created_at': Dream.created_at,
+        'updated_at': Dream.updated_at, 'average_rating': Dream.average_rating,
+        'total_ratings': Dream.total_ratings, 'purchase_count': Dream.purchase_count,
+        'author': Dream.author_id,
+    }
+    columns.update(mapping[name] for name in fields if name in mapping)
+    return list(columns)
+
+
+def serialize_dream(dream, fields):
+    """Serialize a Dream with only the requested fields"""
+    from flask import url_for
+    data = {}
+    for name in fields:
+        if name == 'image_url':
+            data[name] = (url_for('static', filename='uploads/' + dream.image_filename)
+                          if dream.image_filename else None)
+        elif name == 'author':
+            data[name] = {'id': dream.author.id, 'username': dream.author.username}
+        else:
+            data[name] = getattr(dream, name)
+    return data
+
+
+def serialize_rating(rating):
+    return {
+        'rating': rating.rating,
+        'review': rating.review,
+        'rater': rating.rater.username,
+        'created_at': rating.created_at,
+    }
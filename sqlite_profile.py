@@ -0,0 +1,96 @@
+"""
+SQLite production profile for Neural Dreams Inc.
+Engine options and per-connection pragmas that let readers and writers
+work concurrently (WAL) across multiple gunicorn workers
+"""
+import sqlite3
+import weakref
+from sqlalchemy import event
+from config import Config
+
+# Engines that already have the pragma listener
+_configured_engines = weakref.WeakSet()
+
+
+def is_sqlite_url(url):
+    """Check whether a database URL points at SQLite"""
+    return str(url).startswith('sqlite')
+
+
+def is_memory_url(url):
+    """Check whether a SQLite URL is an in-memory database (SQLAlchemy gives those a single-connection pool)"""
+    from sqlalchemy.engine import make_url
+    url = make_url(url)
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def engine_options(url, config=None):
+    """Get SQLAlchemy engine options appropriate for the given database URL.
+
+    `config` is the app's config mapping; the `Config` defaults apply without one.
+    """
+    config = vars(Config) if config is None else config
+    if not is_sqlite_url(url):
+        return {
+            "pool_recycle": 300,
+            "pool_pre_ping": True,
+        }
+
+    options = {
+        "connect_args": {
+            "timeout": config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            "check_same_thread": False,
+        },
+    }
+    if is_memory_url(url):
+        # Its pool doesn't take the QueuePool sizing options
+        return options
+
+    # Local file: connections never go stale, so no recycling or pre-ping.
+    # Sync workers use one connection at a time; the overflow covers threads.
+    options.update({
+        "pool_size": config['SQLITE_POOL_SIZE'],
+        "max_overflow": config['SQLITE_MAX_OVERFLOW'],
+        "pool_timeout": config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+    })
+    return options
+
+
+def sqlite_pragmas(config=None):
+    """Get the pragmas applied to every new SQLite connection"""
+    config = vars(Config) if config is None else config
+    return [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ('cache_size', -config['SQLITE_CACHE_SIZE_KB']),  # negative means KiB
+        ('temp_store', 'MEMORY'),
+        ('foreign_keys', 'ON'),
+    ]
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """Run `pragmas` on a freshly opened DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def configure_sqlite_engine(engine, config=None):
+    """Apply the SQLite profile to an engine before it opens connections"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    if engine not in _configured_engines:
+        pragmas = sqlite_pragmas(config)
+
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            if isinstance(dbapi_connection, sqlite3.Connection):
+                apply_pragmas(dbapi_connection, pragmas)
+
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+        _configured_engines.add(engine)
+    return True
@@ -0,0 +1,82 @@
+"""
+Template caching for Neural Dreams Inc.
+A {% cache %} block that stores rendered fragments in the app cache, plus a
+filesystem bytecode cache so new workers skip compiling templates
+"""
+import os
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+import metrics
+
+
+def fragment_key(key):
+    """Join a key expression (a value or a tuple of values) into a string"""
+    if isinstance(key, (tuple, list)):
+        return ':'.join(str(part) for part in key)
+    return str(key)
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache key[, ttl] %}...{% endcache %}
+
+    The key should carry a version of everything the block shows, e.g.
+    ('dream-card', dream.id, dream.updated_at); viewer-specific markup
+    belongs outside the block.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_ttl=600)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key, ttl, caller):
+        store = self.environment.fragment_cache
+        if store is None:
+            return caller()
+        key = 'fragment:' + fragment_key(key)
+        rendered = store.get(key)
+        metrics.record_cache('fragment', rendered is not None)
+        if rendered is None:
+            rendered = str(caller())
+            store.set(key, rendered, ttl or self.environment.fragment_cache_ttl)
+        return Markup(rendered)
+
+
+def init_template_cache(app, cache):
+    """Enable the {% cache %} tag and the bytecode cache on the app's Jinja environment"""
+    env = app.jinja_env
+    env.add_extension(FragmentCacheExtension)
+    if app.config['FRAGMENT_CACHE_TTL'] > 0:
+        env.fragment_cache = cache
+        env.fragment_cache_ttl = app.config['FRAGMENT_CACHE_TTL']
+
+    if not app.config['JINJA_BYTECODE_CACHE']:
+        return
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _check_private(directory)
+        env.bytecode_cache = FileSystemBytecodeCache(directory)
+    else:
+        # Jinja's own per-user 0700 directory under the temp dir, which it checks it owns
+        env.bytecode_cache = FileSystemBytecodeCache()
+
+
+def _check_private(directory):
+    """Refuse a bytecode directory other users could write: Jinja unmarshals and runs what it finds there"""
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise ValueError(f'JINJA_BYTECODE_CACHE_DIR {directory} must be owned by this user and '
+                         f'not writable by group or others')
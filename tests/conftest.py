@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh SQLite file, inside an app context"""
+    from app import create_app
+    from extensions import db
+    from migrations import init_db
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+    })
+    with app.app_context():
+        init_db()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,35 @@
+import base64
+import json
+import pytest
+
+
+def cursor(value, dream_id):
+    return base64.urlsafe_b64encode(json.dumps([value, dream_id]).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('sort_by, value, dream_id', [
+    ('newest', '2024-01-01T00:00:00', 3),
+    ('price_low', 10, 3),
+    ('rating_high', 4.5, 3),
+    ('rating_high', 4, 3),
+])
+def test_well_typed_cursor_is_accepted(app, sort_by, value, dream_id):
+    response = app.test_client().get(f'/api/v1/dreams?sort_by={sort_by}&cursor={cursor(value, dream_id)}')
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('sort_by, value, dream_id', [
+    ('newest', 5, 3),
+    ('newest', 'yesterday', 3),
+    ('price_low', '10', 3),
+    ('price_low', [10], 3),
+    ('price_low', 10, '3'),
+    ('price_low', 10, True),
+    ('price_low', 2 ** 70, 3),
+    ('rating_high', None, 3),
+    ('rating_high', {'a': 1}, 3),
+])
+def test_mistyped_cursor_is_a_bad_request(app, sort_by, value, dream_id):
+    response = app.test_client().get(f'/api/v1/dreams?sort_by={sort_by}&cursor={cursor(value, dream_id)}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid cursor'}
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, insert, select
+import archive
+import counters
+from extensions import db
+from models import Dream, DreamHistory, Purchase, PurchaseArchive, Rating, RatingArchive, User, UserHistory
+
+AUTHORS = (1, 2)
+BUYERS = range(3, 13)
+DREAMS = range(1, 5)
+NOW = datetime.utcnow()
+OLD = NOW - timedelta(days=800)
+
+
+@pytest.fixture
+def history(app):
+    """Authors 1 and 2 with two dreams each; every buyer bought and rated every dream, odd buyers long ago"""
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': 0, 'created_at': OLD} for n in (*AUTHORS, *BUYERS)])
+        conn.execute(insert(Dream), [{'id': d, 'title': f'Dream {d}', 'description': '-', 'excerpt': '-',
+                                      'category': 'surreal', 'price': 10 + d, 'author_id': AUTHORS[d % 2],
+                                      'created_at': OLD} for d in DREAMS])
+        conn.execute(insert(Purchase), [{'buyer_id': b, 'dream_id': d, 'price_paid': 10 + d,
+                                         'purchase_date': OLD if b % 2 else NOW} for b in BUYERS for d in DREAMS])
+        conn.execute(insert(Rating), [{'rater_id': b, 'dream_id': d, 'rating': 1 + (b + d) % 5,
+                                       'created_at': OLD if b % 2 else NOW} for b in BUYERS for d in DREAMS])
+        counters.backfill(conn)
+    return app
+
+
+def author_sales(author_id):
+    """Lifetime (sales, earnings): hot purchases of the author's dreams plus the rollup"""
+    sales, earnings = db.session.execute(
+        select(func.count(Purchase.id), func.coalesce(func.sum(Purchase.price_paid), 0))
+        .join(Dream, Purchase.dream_id == Dream.id).where(Dream.author_id == author_id)).one()
+    rollup = db.session.get(UserHistory, author_id)
+    if rollup is not None:
+        sales, earnings = sales + rollup.sales, earnings + rollup.earnings
+    return sales, earnings
+
+
+def dream_purchases(dream_id):
+    hot = db.session.scalar(select(func.count()).where(Purchase.dream_id == dream_id))
+    rollup = db.session.get(DreamHistory, dream_id)
+    return hot + (rollup.purchases if rollup else 0)
+
+
+def lifetime_totals():
+    db.session.expire_all()
+    return {
+        'users': {user_id: archive.user_totals(user_id) for user_id in BUYERS},
+        'authors': {author_id: author_sales(author_id) for author_id in AUTHORS},
+        'dreams': {dream_id: (dream_purchases(dream_id), archive.rating_totals(dream_id)) for dream_id in DREAMS},
+    }
+
+
+def count(model):
+    return db.session.scalar(select(func.count()).select_from(model))
+
+
+def test_archival_keeps_lifetime_totals(history):
+    before = lifetime_totals()
+
+    moved = archive.archive(NOW - timedelta(days=365), batch_size=7)
+
+    old_rows = len(BUYERS) // 2 * len(DREAMS)
+    assert moved == {'purchases': old_rows, 'ratings': old_rows}
+    assert (count(PurchaseArchive), count(RatingArchive)) == (old_rows, old_rows)
+    assert (count(Purchase), count(Rating)) == (old_rows, old_rows)
+    assert lifetime_totals() == before
+    with db.engine.connect() as conn:
+        assert counters.find_drift(conn) == ([], [])
+
+
+def test_deleting_an_archived_dream_keeps_the_authors_sales(history):
+    archive.archive(NOW - timedelta(days=365), batch_size=7)
+    before = author_sales(1)
+    client = history.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+
+    assert client.post('/marketplace/delete/2').status_code == 302
+
+    db.session.expire_all()
+    assert db.session.get(Dream, 2) is None
+    assert author_sales(1) == before
+    assert (db.session.get(User, 1).sales_count, db.session.get(User, 1).total_earnings) == before
+    with db.engine.connect() as conn:
+        assert counters.find_drift(conn) == ([], [])
+
+
+class BeforeOtherCommit:
+    """A connection whose SELECTs ran before another transaction committed: they see no rows"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.dialect = conn.dialect
+
+    def execute(self, statement, *args, **kwargs):
+        if statement.is_select:
+            statement = statement.where(False)
+        return self.conn.execute(statement, *args, **kwargs)
+
+
+def test_rollup_row_created_by_another_transaction_is_added_to(history):
+    # The archive job and a dream delete can both find the author's rollup row missing
+    with db.engine.begin() as conn:
+        conn.execute(insert(UserHistory), [{'user_id': 1, 'sales': 3, 'earnings': 30}])
+    with db.engine.begin() as conn:
+        archive._add_to_rollup(BeforeOtherCommit(conn), UserHistory, 'user_id', {1: {'sales': 2, 'earnings': 20}})
+    rollup = db.session.get(UserHistory, 1)
+    assert (rollup.sales, rollup.earnings) == (5, 50)
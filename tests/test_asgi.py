@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime
+import pytest
+from sqlalchemy import event, insert
+from extensions import db
+from models import Dream, Rating, User
+
+pytest.importorskip('a2wsgi')
+pytest.importorskip('aiosqlite')
+
+
+@pytest.fixture
+def asgi(app):
+    """The ASGI app over dream 1 by user 1, rated by user 2"""
+    from asgi import AsyncReadApp
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': 0, 'created_at': now} for n in (1, 2)])
+        conn.execute(insert(Dream), [{'id': 1, 'title': 'Dream 1', 'description': '-', 'excerpt': '-',
+                                      'category': 'surreal', 'price': 10, 'author_id': 1, 'created_at': now}])
+        conn.execute(insert(Rating), [{'rater_id': 2, 'dream_id': 1, 'rating': 5, 'created_at': now}])
+    app.extensions['typeahead'].started = True  # its background build reads on the sync engine
+    return AsyncReadApp(app)
+
+
+def statements_on(engine):
+    executed = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: executed.append(args[2]))
+    return executed
+
+
+def get(asgi, path, method='GET'):
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(), 'root_path': '',
+             'headers': [(b'host', b'localhost')], 'http_version': '1.1', 'scheme': 'http',
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 1234)}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi(scope, receive, send))
+    return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+@pytest.mark.parametrize('path', ['/', '/leaderboard', '/tags/', '/marketplace/', '/marketplace/dream/1',
+                                  '/api/v1/dreams', '/api/v1/dreams/1', '/api/v1/users/u1/stats'])
+def test_read_views_query_through_the_async_engine(asgi, path):
+    sync_statements, async_statements = statements_on(db.engine), statements_on(asgi.reader.engine.sync_engine)
+
+    status, body = get(asgi, path)
+
+    assert status == 200
+    assert async_statements and not sync_statements
+    assert body == asgi.app.test_client().get(path).data
+
+
+def test_dream_detail_fans_out_its_queries(asgi):
+    status, body = get(asgi, '/api/v1/dreams/1?include=ratings')
+    assert status == 200
+    assert b'"ratings"' in body and b'"u2"' in body
+
+
+@pytest.mark.parametrize('path, method', [('/auth/login', 'GET'), ('/marketplace/dream/1', 'POST'),
+                                          ('/marketplace', 'GET'), ('/no-such-page', 'GET')])
+def test_other_requests_go_to_the_wsgi_app(asgi, path, method):
+    async_statements = statements_on(asgi.reader.engine.sync_engine)
+    status, _ = get(asgi, path, method)
+    assert status == asgi.app.test_client().open(path, method=method).status_code
+    assert not async_statements
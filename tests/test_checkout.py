@@ -0,0 +1,96 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import func, insert, select, update
+import checkout
+import ledger
+from counters import find_drift
+from extensions import db
+from models import Dream, LedgerEntry, Purchase, User
+
+BUYER_POINTS = 1000
+
+
+class SimulatedFailure(Exception):
+    pass
+
+
+@pytest.fixture
+def shop(app):
+    """Buyer 1 (with a matching ledger grant), authors 2 and 3, dreams 1-6 at 10-15 points"""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': BUYER_POINTS if n == 1 else 0, 'created_at': now} for n in (1, 2, 3)])
+        conn.execute(insert(LedgerEntry), [{'user_id': 1, 'amount': BUYER_POINTS, 'kind': 'grant', 'created_at': now}])
+        conn.execute(insert(Dream), [{'id': n, 'title': f'Dream {n}', 'description': '-', 'excerpt': '-',
+                                      'category': 'surreal', 'price': 9 + n, 'author_id': 2 + n % 2, 'created_at': now}
+                                     for n in range(1, 7)])
+    return app
+
+
+def buyer():
+    return db.session.get(User, 1)
+
+
+def state():
+    """Everything a checkout writes"""
+    with db.engine.connect() as conn:
+        return (conn.execute(select(User.id, User.points, User.sales_count).order_by(User.id)).all(),
+                conn.execute(select(func.count(Purchase.id))).scalar(),
+                conn.execute(select(func.sum(Dream.purchase_count))).scalar(),
+                conn.execute(select(func.count(LedgerEntry.id))).scalar())
+
+
+def assert_consistent():
+    assert not any(find_drift(db.session.connection()))
+    assert not list(ledger.find_mismatches())
+
+
+def test_checkout_buys_the_whole_cart(shop):
+    ok, message, problems = checkout.checkout(buyer(), [1, 2, 3])
+    assert ok and not problems, message
+    assert buyer().points == BUYER_POINTS - (10 + 11 + 12)
+    assert db.session.scalar(select(func.count(Purchase.id)).where(Purchase.buyer_id == 1)) == 3
+    assert_consistent()
+
+
+def test_invalid_item_rejects_the_whole_cart(shop):
+    checkout.checkout(buyer(), [1])
+    db.session.remove()
+    before = state()
+    ok, _, problems = checkout.checkout(buyer(), [2, 3, 1, 999])
+    assert not ok
+    assert set(problems) == {1, 999}
+    assert state() == before
+
+
+def test_unaffordable_cart_writes_nothing(shop):
+    db.session.execute(update(User).where(User.id == 1).values(points=20))
+    db.session.commit()
+    before = state()
+    ok, message, problems = checkout.checkout(buyer(), [1, 2])
+    assert not ok and not problems
+    assert 'Insufficient points' in message
+    assert state() == before
+
+
+def test_failure_mid_write_rolls_back_and_retry_succeeds(shop, monkeypatch):
+    original = ledger.record_entries
+
+    def fail_midway(entries):
+        original(entries)
+        raise SimulatedFailure('ledger write failed')
+
+    before = state()
+    monkeypatch.setattr(ledger, 'record_entries', fail_midway)
+    ok, message, _ = checkout.checkout(buyer(), [4, 5, 6])
+    assert not ok
+    assert message == 'An error occurred during checkout'
+    assert state() == before
+    db.session.remove()
+
+    monkeypatch.setattr(ledger, 'record_entries', original)
+    ok, _, _ = checkout.checkout(buyer(), [4, 5, 6])
+    assert ok
+    assert buyer().points == BUYER_POINTS - (13 + 14 + 15)
+    assert_consistent()
@@ -0,0 +1,60 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import insert
+import counters
+from dream_utils import process_dream_purchase
+from extensions import db
+from models import Dream, User
+
+
+@pytest.fixture
+def market(app):
+    """Authors 1 and 2 with dreams 1-3 (10, 20 and 30 points); buyers 3-5 with 100 points"""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': 0 if n < 3 else 100, 'created_at': now} for n in range(1, 6)])
+        conn.execute(insert(Dream), [{'id': d, 'title': f'Dream {d}', 'description': '-', 'excerpt': '-',
+                                      'category': 'surreal', 'price': 10 * d, 'author_id': 1 if d < 3 else 2,
+                                      'created_at': now} for d in (1, 2, 3)])
+    return app
+
+
+def buy(buyer_id, dream_id):
+    return process_dream_purchase(db.session.get(User, buyer_id), db.session.get(Dream, dream_id))[0]
+
+
+def counts():
+    db.session.expire_all()
+    return ({dream.id: dream.purchase_count for dream in Dream.query.order_by(Dream.id)},
+            {user.id: (user.sales_count, user.total_earnings) for user in User.query.filter(User.id < 3)})
+
+
+def test_record_sale_keeps_counters_in_step_with_purchases(market):
+    for buyer_id, dream_id in [(3, 1), (4, 1), (5, 1), (3, 2), (4, 3)]:
+        assert buy(buyer_id, dream_id)
+
+    assert counts() == ({1: 3, 2: 1, 3: 1}, {1: (4, 50), 2: (1, 30)})
+    with db.engine.connect() as conn:
+        assert counters.find_drift(conn) == ([], [])
+
+
+def test_rejected_purchase_leaves_counters_alone(market):
+    assert buy(3, 1)
+    assert not buy(3, 1)  # already owned
+    assert not buy(1, 1)  # own dream
+
+    assert counts() == ({1: 1, 2: 0, 3: 0}, {1: (1, 10), 2: (0, 0)})
+    with db.engine.connect() as conn:
+        assert counters.find_drift(conn) == ([], [])
+
+
+def test_backfill_repairs_drifted_counters(market):
+    assert buy(3, 1) and buy(4, 3)
+    with db.engine.begin() as conn:
+        conn.execute(Dream.__table__.update().values(purchase_count=7))
+        conn.execute(User.__table__.update().values(sales_count=0, total_earnings=0))
+        assert counters.find_drift(conn) != ([], [])
+        counters.backfill(conn)
+
+    assert counts() == ({1: 1, 2: 0, 3: 1}, {1: (1, 10), 2: (1, 30)})
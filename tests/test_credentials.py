@@ -0,0 +1,35 @@
+import pytest
+from werkzeug.security import generate_password_hash
+from cache import Cache, SQLiteBackend
+from credentials import CredentialService, HashingBusy, Throttle
+
+
+@pytest.fixture
+def shared_cache(tmp_path):
+    """Two caches on one SQLite file, as two workers on a host would have"""
+    path = str(tmp_path / 'cache' / 'cache.sqlite')
+    return Cache(SQLiteBackend(path, 'secret')), Cache(SQLiteBackend(path, 'secret'))
+
+
+def test_throttle_budget_is_shared_between_workers(shared_cache):
+    first, second = (Throttle(cache, 'login-ip', capacity=3, rate=1 / 60) for cache in shared_cache)
+    assert [first.allow('1.2.3.4'), second.allow('1.2.3.4'), first.allow('1.2.3.4')] == [True, True, True]
+    assert not second.allow('1.2.3.4')
+    assert second.allow('5.6.7.8')
+
+
+def test_hashing_budget_is_shared_between_workers(shared_cache):
+    first, second = (CredentialService(cache, 'pbkdf2:sha256:1000', budget=1, queue_timeout=0.05)
+                     for cache in shared_cache)
+    slot = first._acquire_slot()
+    with pytest.raises(HashingBusy):
+        second.hash_password('hunter2')
+    shared_cache[0].delete(slot)
+    assert second.hash_password('hunter2').startswith('pbkdf2:sha256:1000$')
+
+
+@pytest.mark.parametrize('method', ['pbkdf2', 'scrypt', 'pbkdf2:sha256:1000'])
+def test_hash_from_the_configured_method_needs_no_rehash(shared_cache, method):
+    service = CredentialService(shared_cache[0], method, budget=1, queue_timeout=0.05)
+    assert not service.needs_rehash(service.hash_password('hunter2'))
+    assert service.needs_rehash(generate_password_hash('hunter2', 'pbkdf2:sha256:1'))
@@ -0,0 +1,47 @@
+from datetime import datetime
+from sqlalchemy import event, func, insert, select
+from extensions import db
+from models import Dream, Purchase, Rating, User, UserHistory
+
+CHILDREN = 5000
+
+
+def seed():
+    """Author 1, buyers 2..CHILDREN+1, and dreams 1 and 2 each bought and rated by every buyer"""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com',
+                                     'password_hash': '-', 'points': 0, 'created_at': now}
+                                    for n in range(1, CHILDREN + 2)])
+        conn.execute(insert(Dream), [{'id': n, 'title': f'Dream {n}', 'description': '-', 'category': 'surreal',
+                                      'price': 10, 'author_id': 1, 'created_at': now} for n in (1, 2)])
+        for dream_id in (1, 2):
+            conn.execute(insert(Purchase), [{'buyer_id': n, 'dream_id': dream_id, 'price_paid': 10,
+                                             'purchase_date': now} for n in range(2, CHILDREN + 2)])
+            conn.execute(insert(Rating), [{'rater_id': n, 'dream_id': dream_id, 'rating': 4, 'created_at': now}
+                                          for n in range(2, CHILDREN + 2)])
+
+
+def children(dream_id):
+    return [db.session.scalar(select(func.count()).where(model.dream_id == dream_id)) for model in (Purchase, Rating)]
+
+
+def test_deleting_a_dream_removes_its_purchases_and_ratings(app):
+    seed()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    response = client.post('/marketplace/delete/1')
+
+    assert response.status_code == 302
+    assert db.session.get(Dream, 1) is None
+    assert children(1) == [0, 0]
+    assert children(2) == [CHILDREN, CHILDREN]
+    # The database cascades: no per-row DELETEs for the children
+    assert len(statements) < 50
+    # The author keeps the deleted dream's sales
+    assert db.session.get(UserHistory, 1).sales == CHILDREN
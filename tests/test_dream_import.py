@@ -0,0 +1,44 @@
+from datetime import datetime
+from sqlalchemy import insert
+import dream_import
+from extensions import db
+from models import ImportJob, User
+
+
+def queued_job(tmp_path):
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': 1, 'username': 'u1', 'email': 'u1@example.com', 'password_hash': '-',
+                                     'points': 0, 'created_at': datetime.utcnow()}])
+        conn.execute(insert(ImportJob), [{'id': 1, 'author_id': 1, 'manifest_name': 'dreams.csv'}])
+    manifest = tmp_path / '1-manifest'
+    manifest.write_text('title,description,category,price\n')
+    return {'manifest': str(manifest)}
+
+
+def job_row():
+    db.session.expire_all()
+    return db.session.get(ImportJob, 1)
+
+
+def test_failure_before_the_import_starts_marks_the_job_failed(app, tmp_path, monkeypatch):
+    paths = queued_job(tmp_path)
+
+    def lost_connection(*args, **kwargs):
+        raise ConnectionError('database went away')
+    monkeypatch.setattr(db.session, 'get', lost_connection)
+    dream_import._run_job(app, 1, paths)
+    monkeypatch.undo()
+
+    job = job_row()
+    assert (job.status, job.finished_at is not None) == ('failed', True)
+    assert job.message.startswith('The import stopped unexpectedly')
+    assert not (tmp_path / '1-manifest').exists()
+
+
+def test_missing_upload_marks_the_job_failed(app, tmp_path):
+    paths = queued_job(tmp_path)
+    (tmp_path / '1-manifest').unlink()
+
+    dream_import._run_job(app, 1, paths)
+
+    assert job_row().status == 'failed'
@@ -0,0 +1,46 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import insert
+from extensions import db
+from models import Dream, Rating, User
+
+
+@pytest.fixture
+def dream_page(app):
+    """Dream 1 by author 1, rated by user 2"""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': 0, 'created_at': now} for n in (1, 2)])
+        conn.execute(insert(Dream), [{'id': 1, 'title': 'Dream 1', 'description': '-', 'excerpt': '-',
+                                      'category': 'surreal', 'price': 10, 'author_id': 1, 'created_at': now}])
+        conn.execute(insert(Rating), [{'rater_id': 2, 'dream_id': 1, 'rating': 5, 'created_at': now}])
+    client = app.test_client()
+    assert client.get('/marketplace/dream/1').headers['X-Page-Cache'] == 'MISS'
+    assert client.get('/marketplace/dream/1').headers['X-Page-Cache'] == 'HIT'
+    return client
+
+
+def rename(user_id, username):
+    db.session.get(User, user_id).username = username
+    db.session.commit()
+
+
+def test_author_rename_drops_the_cached_page(dream_page):
+    rename(1, 'dreamweaver')
+    response = dream_page.get('/marketplace/dream/1')
+    assert response.headers['X-Page-Cache'] == 'MISS'
+    assert b'dreamweaver' in response.data
+
+
+def test_authors_new_dream_drops_the_cached_page(dream_page):
+    db.session.add(Dream(title='Dream 2', description='-', category='funny', price=5, author_id=1))
+    db.session.commit()
+    assert dream_page.get('/marketplace/dream/1').headers['X-Page-Cache'] == 'MISS'
+
+
+def test_rater_rename_drops_the_cached_page(dream_page):
+    rename(2, 'nightowl')
+    response = dream_page.get('/marketplace/dream/1')
+    assert response.headers['X-Page-Cache'] == 'MISS'
+    assert b'nightowl' in response.data
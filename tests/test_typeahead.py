@@ -0,0 +1,57 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import func, insert, select
+from counters import record_sale
+from extensions import db
+from models import Dream, TypeaheadChange, User
+from typeahead import Typeahead
+
+
+@pytest.fixture
+def worker(app):
+    """Another worker's index over authors 1 and 2 with one dream each, reading the change log on every search"""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(insert(User), [{'id': n, 'username': f'u{n}', 'email': f'u{n}@example.com', 'password_hash': '-',
+                                     'points': 0, 'created_at': now} for n in (1, 2)])
+        conn.execute(insert(Dream), [{'id': d, 'title': f'Dream {d}', 'description': '-', 'excerpt': '-',
+                                      'category': 'surreal', 'price': 10, 'author_id': d, 'created_at': now}
+                                     for d in (1, 2)])
+    app.config['TYPEAHEAD_SYNC_SECONDS'] = 0
+    worker = Typeahead(app)
+    worker._rebuild()
+    worker.start = pytest.fail  # every change must arrive through the log, not a rebuild
+    return worker
+
+
+def test_committed_changes_reach_other_workers(worker):
+    db.session.get(Dream, 1).title = 'Flying'
+    db.session.get(User, 2).username = 'nightowl'
+    db.session.delete(db.session.get(Dream, 2))
+    db.session.commit()
+
+    assert worker.search('fly', 5)[0] == [(1, 'Flying', 0.0)]
+    assert worker.search('night', 5)[1] == [(2, 'nightowl', 0)]
+    assert worker.search('dream', 5)[0] == []
+
+
+def test_sales_reorder_other_workers_suggestions(worker):
+    record_sale(db.session.get(Dream, 2), 10)
+    db.session.commit()
+
+    assert worker.search('u', 5)[1] == [(2, 'u2', 1), (1, 'u1', 0)]
+
+
+def test_change_committed_behind_a_newer_one_is_not_skipped(worker):
+    position = db.session.scalar(select(func.max(TypeaheadChange.id))) or 0
+    # The transaction that took the lower id commits after the worker read past it
+    with db.engine.begin() as conn:
+        conn.execute(insert(TypeaheadChange), [{'id': position + 2, 'kind': 'user', 'entry_id': 1,
+                                                'text': 'late', 'score': 0}])
+    worker.search('late', 5)
+    with db.engine.begin() as conn:
+        conn.execute(insert(TypeaheadChange), [{'id': position + 1, 'kind': 'dream', 'entry_id': 2,
+                                                'text': 'Lucid', 'score': 0}])
+
+    assert worker.search('lucid', 5)[0] == [(2, 'Lucid', 0)]
+    assert worker._gaps == {}
@@ -0,0 +1,332 @@
+"""
+Typeahead suggestions for dream titles and usernames.
+Each worker keeps an in-memory prefix index per kind: entries sorted by
+casefolded text with a max segment tree over their scores, so a prefix is
+two bisects and its top K come out in O(K log n) however many entries
+share it. Every transaction that changes a title, username or score also
+writes the change to the typeahead_change log. The committing worker puts
+it into a small overlay straight away; other workers read the log from the
+last id they saw every TYPEAHEAD_SYNC_SECONDS and add the same changes to
+their overlays. An overlay that outgrows TYPEAHEAD_MAX_OVERLAY is folded
+into a background rebuild.
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, insert, inspect, or_, select
+from extensions import db
+from models import Dream, TypeaheadChange, User
+from replicas import RoutingSession, read_only_scope
+
+# Sorts after any character a title or username can contain
+_PREFIX_END = '\U0010ffff'
+_MISSING = object()
+
+
+class PrefixIndex:
+    """(id, text, score) entries searchable by text prefix, best score first"""
+
+    def __init__(self, entries=()):
+        rows = sorted(entries, key=lambda entry: (entry[1].casefold(), entry[0]))
+        self._ids = array('q', [entry[0] for entry in rows])
+        self._texts = [entry[1] for entry in rows]
+        self._scores = array('d', [entry[2] or 0.0 for entry in rows])
+        self._size = len(rows)
+        # tree[size + i] is entry i; every parent holds the better of its children
+        tree = array('q', bytes(8 * self._size)) + array('q', range(self._size))
+        for node in range(self._size - 1, 0, -1):
+            tree[node] = self._better(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+        # Changes since the build: {id: (casefolded text, text, score) or None once removed}, which
+        # shadows the sorted entries, and the live ones sorted by casefolded text. Swapped as one tuple
+        self._changes = ({}, [])
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def overlay(self):
+        return self._changes[0]
+
+    def set_overlay(self, overlay):
+        live = sorted((entry[0], entry_id, entry[1], entry[2]) for entry_id, entry in overlay.items() if entry is not None)
+        self._changes = (overlay, live)
+
+    def _better(self, a, b):
+        # Higher score wins, then alphabetical order
+        if a < 0:
+            return b
+        score_a, score_b = self._scores[a], self._scores[b]
+        return a if score_a > score_b or (score_a == score_b and a < b) else b
+
+    def _best_in(self, low, high):
+        """Position of the best entry in [low, high)"""
+        best, tree = -1, self._tree
+        low += self._size
+        high += self._size
+        while low < high:
+            if low & 1:
+                best = self._better(best, tree[low])
+                low += 1
+            if high & 1:
+                high -= 1
+                best = self._better(best, tree[high])
+            low >>= 1
+            high >>= 1
+        return best
+
+    def apply(self, changes):
+        """Record {id: (text, score) or None} without re-sorting the index"""
+        overlay = dict(self.overlay)
+        for entry_id, entry in changes.items():
+            overlay[entry_id] = None if entry is None else (entry[0].casefold(), entry[0], entry[1] or 0.0)
+        self.set_overlay(overlay)
+
+    def search(self, prefix, k):
+        """Up to k (id, text, score) entries whose text starts with prefix, best score first"""
+        key = prefix.casefold()
+        overlay, live = self._changes
+        low = bisect_left(self._texts, key, key=str.casefold)
+        high = bisect_left(self._texts, key + _PREFIX_END, lo=low, key=str.casefold)
+
+        found, heap = [], []
+
+        def push(low, high):
+            if low < high:
+                best = self._best_in(low, high)
+                heapq.heappush(heap, (-self._scores[best], best, low, high))
+
+        push(low, high)
+        while heap and len(found) < k:
+            _, position, low, high = heapq.heappop(heap)
+            entry_id = self._ids[position]
+            if entry_id not in overlay:
+                found.append((entry_id, self._texts[position], self._scores[position]))
+            push(low, position)
+            push(position + 1, high)
+
+        found.extend((entry_id, text, score) for _, entry_id, text, score in
+                     live[bisect_left(live, (key,)):bisect_left(live, (key + _PREFIX_END,))])
+        found.sort(key=lambda entry: (-entry[2], entry[1].casefold(), entry[0]))
+        return found[:k]
+
+
+def _load_dreams():
+    return PrefixIndex(db.session.execute(
+        select(Dream.id, Dream.title, Dream.average_rating).execution_options(yield_per=50000)))
+
+
+def _load_users():
+    return PrefixIndex(db.session.execute(
+        select(User.id, User.username, User.sales_count).execution_options(yield_per=50000)))
+
+
+class Typeahead:
+    """A worker's dream and user prefix indexes, rebuilt in a background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.dreams = PrefixIndex()
+        self.users = PrefixIndex()
+        self.ready = False
+        self.started = False
+        self._lock = threading.Lock()
+        self._building = False
+        self._position = 0  # last change log id replayed
+        self._gaps = {}  # {skipped change id: monotonic deadline}; their transactions may still commit
+        self._synced_at = 0.0
+        self._checked_at = 0.0
+        self._pruned_at = 0.0
+
+    def start(self):
+        """Rebuild both indexes from the database in the background, unless a rebuild is running"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = self.started = True
+        threading.Thread(target=self._rebuild, name='typeahead-build', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context(), read_only_scope():
+                # Read the log position first, so changes committed during the load are replayed after it
+                position = db.session.scalar(select(func.max(TypeaheadChange.id))) or 0
+                before = self.dreams.overlay, self.users.overlay
+                dreams, users = _load_dreams(), _load_users()
+            with self._lock:
+                # Carry over what this worker committed while the load ran
+                for old, new, seen in ((self.dreams, dreams, before[0]), (self.users, users, before[1])):
+                    new.set_overlay({entry_id: entry for entry_id, entry in old.overlay.items()
+                                     if seen.get(entry_id, _MISSING) is not entry})
+                self.dreams, self.users = dreams, users
+                self._position, self._gaps = position, {}
+                self._synced_at = time.monotonic()
+                self.ready = True
+            self.app.logger.info(f'Typeahead index built: {len(dreams)} dreams, {len(users)} users')
+        except Exception:
+            self.app.logger.exception('Typeahead index build failed')
+        finally:
+            self._building = False
+
+    def apply(self, dream_changes, user_changes):
+        """Apply changes committed in this worker; the others replay them from the change log"""
+        with self._lock:
+            if dream_changes:
+                self.dreams.apply(dream_changes)
+            if user_changes:
+                self.users.apply(user_changes)
+        self._rebuild_if_large()
+
+    def _rebuild_if_large(self):
+        if max(len(self.dreams.overlay), len(self.users.overlay)) > self.app.config['TYPEAHEAD_MAX_OVERLAY']:
+            self.start()
+
+    def _sync(self):
+        config = self.app.config
+        now = time.monotonic()
+        if now - self._checked_at < config['TYPEAHEAD_SYNC_SECONDS']:
+            return
+        self._checked_at = now
+        if now - self._synced_at > config['TYPEAHEAD_LOG_KEEP_SECONDS']:
+            # The changes since the last read may have been pruned
+            self.start()
+            return
+        try:
+            self._replay(now)
+            if now - self._pruned_at > config['TYPEAHEAD_LOG_KEEP_SECONDS'] / 10:
+                self._pruned_at = now
+                prune_changes(config['TYPEAHEAD_LOG_KEEP_SECONDS'])
+        except Exception:
+            self.app.logger.exception('Typeahead sync failed')
+
+    def _replay(self, now):
+        """Apply the changes other workers logged since the last read"""
+        position, gaps = self._position, self._gaps
+        newer = TypeaheadChange.id > position
+        with read_only_scope():
+            rows = db.session.execute(
+                select(TypeaheadChange.id, TypeaheadChange.kind, TypeaheadChange.entry_id,
+                       TypeaheadChange.text, TypeaheadChange.score)
+                .where(or_(newer, TypeaheadChange.id.in_(list(gaps))) if gaps else newer)
+                .order_by(TypeaheadChange.id)).all()
+        changes = {'dream': {}, 'user': {}}
+        for row in rows:
+            changes[row.kind][row.entry_id] = None if row.text is None else (row.text, row.score)
+
+        top = max([position, *(row.id for row in rows)])
+        seen = {row.id for row in rows}
+        gaps = {change_id: deadline for change_id, deadline in gaps.items()
+                if change_id not in seen and deadline > now}
+        if top - position > sum(change_id > position for change_id in seen):
+            # An id below the newest one is missing: a transaction that took it hasn't committed yet
+            deadline = now + self.app.config['TYPEAHEAD_LOG_LAG_SECONDS']
+            gaps.update((change_id, deadline) for change_id in range(position + 1, top + 1) if change_id not in seen)
+        with self._lock:
+            if changes['dream']:
+                self.dreams.apply(changes['dream'])
+            if changes['user']:
+                self.users.apply(changes['user'])
+            self._position, self._gaps = top, gaps
+            self._synced_at = now
+        self._rebuild_if_large()
+
+    def search(self, prefix, k):
+        """(dreams, users) suggestions for a prefix, each a list of (id, text, score)"""
+        if not self.ready:
+            self.start()
+            return _search_database(prefix, k)
+        self._sync()
+        return self.dreams.search(prefix, k), self.users.search(prefix, k)
+
+
+def prune_changes(keep_seconds):
+    """Delete change log rows older than `keep_seconds`"""
+    with db.engine.begin() as conn:
+        conn.execute(delete(TypeaheadChange)
+                     .where(TypeaheadChange.created_at < datetime.utcnow() - timedelta(seconds=keep_seconds)))
+
+
+def _search_database(prefix, k):
+    """The same suggestions straight from the database, while the worker's index is still building"""
+    key = prefix.lower()
+    with read_only_scope():
+        dreams = db.session.execute(
+            select(Dream.id, Dream.title, Dream.average_rating)
+            .where(func.lower(Dream.title).startswith(key, autoescape=True))
+            .order_by(Dream.average_rating.desc(), Dream.title, Dream.id).limit(k)).all()
+        users = db.session.execute(
+            select(User.id, User.username, User.sales_count)
+            .where(func.lower(User.username).startswith(key, autoescape=True))
+            .order_by(User.sales_count.desc(), User.username, User.id).limit(k)).all()
+    return [tuple(row) for row in dreams], [tuple(row) for row in users]
+
+
+def get_typeahead():
+    return current_app.extensions['typeahead']
+
+
+def _changed(obj, *names):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _publish(connection, dreams, users):
+    """Write {id: (text, score) or None} changes to the log in the current transaction"""
+    rows = [{'kind': kind, 'entry_id': entry_id, 'text': entry and entry[0], 'score': entry and entry[1]}
+            for kind, changes in (('dream', dreams), ('user', users)) for entry_id, entry in changes.items()]
+    if rows:
+        connection.execute(insert(TypeaheadChange), rows)
+
+
+def update_on_commit(db_session, dreams=None, users=None):
+    """Log {id: (text, score) or None} changes made without ORM objects, and update this worker's index on commit"""
+    dreams, users = dreams or {}, users or {}
+    _publish(db_session.connection(), dreams, users)
+    pending = db_session.info.setdefault('typeahead', ({}, {}))
+    pending[0].update(dreams)
+    pending[1].update(users)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_changes(db_session, flush_context):
+    dreams, users = {}, {}
+    for obj in (*db_session.new, *db_session.dirty):
+        # Read loaded values from the instance dict so nothing is lazy-loaded mid-flush
+        values = inspect(obj).dict
+        if isinstance(obj, Dream) and (obj in db_session.new or _changed(obj, 'title', 'average_rating')):
+            dreams[obj.id] = (values['title'], values.get('average_rating'))
+        elif isinstance(obj, User) and (obj in db_session.new or _changed(obj, 'username', 'sales_count')):
+            users[obj.id] = (values['username'], values.get('sales_count'))
+    for obj in db_session.deleted:
+        if isinstance(obj, Dream):
+            dreams[obj.id] = None
+        elif isinstance(obj, User):
+            users[obj.id] = None
+    if dreams or users:
+        update_on_commit(db_session, dreams, users)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_committed(db_session):
+    changes = db_session.info.pop('typeahead', None)
+    if changes and any(changes) and has_app_context() and 'typeahead' in current_app.extensions:
+        get_typeahead().apply(*changes)
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _discard_changes(db_session, previous_transaction):
+    db_session.info.pop('typeahead', None)
+
+
+def init_typeahead(app):
+    typeahead = app.extensions['typeahead'] = Typeahead(app)
+
+    @app.before_request
+    def _build_typeahead():
+        # Each worker builds its index when it starts serving, not when CLI commands create the app
+        if not typeahead.started:
+            typeahead.start()
@@ -2,7 +2,8 @@
 User Tag System for Neural Dreams Inc.
 Analyzes user behavior and assigns appropriate dream tags
 """
-from app import db
+from extensions import db
+from replicas import read_only
 from sqlalchemy import func
 from collections import Counter
 
@@ -79,9 +80,11 @@ ACHIEVEMENT_TAGS = {
     }
 }
 
+@read_only
 def analyze_user_dream_preferences(user_id):
     """Analyze user's dream creation and purchase patterns"""
-    from models import User, Dream, Purchase
+    from models import User, Dream
+    from archive import purchase_history
     user = User.query.get(user_id)
     if not user:
         return None
@@ -90,7 +93,8 @@ def analyze_user_dream_preferences(user_id):
     created_dreams = Dream.query.filter_by(author_id=user_id).all()
     
     # Get user's purchased dreams
-    purchased_dreams = db.session.query(Dream).join(Purchase).filter(Purchase.buyer_id == user_id).all()
+    history = purchase_history()
+    purchased_dreams = db.session.query(Dream).join(history, history.dream_id == Dream.id).filter(history.buyer_id == user_id).all()
     
     # Combine creation and purchase preferences (weighted: 70% creation, 30% purchase)
     creation_categories = [dream.category for dream in created_dreams]
@@ -123,10 +127,12 @@ def get_primary_dream_tag(user_id):
 
 def check_achievement_tags(user_id):
     """Check if user qualifies for any achievement tags"""
-    from models import User, Dream, Purchase, Rating
+    from models import User, Dream
+    from archive import user_totals
     user = User.query.get(user_id)
     if not user:
         return []
+    totals = user_totals(user_id)
     
     achievements = []
     
@@ -136,17 +142,17 @@ def check_achievement_tags(user_id):
         achievements.append('dream_master')
     
     # Top Seller - check earnings
-    total_earnings = db.session.query(func.sum(Purchase.price_paid)).join(Dream).filter(Dream.author_id == user_id).scalar() or 0
+    total_earnings = user.total_earnings
     if total_earnings >= ACHIEVEMENT_TAGS['top_seller']['threshold']:
         achievements.append('top_seller')
     
     # Dream Collector - 50+ purchases
-    purchase_count = Purchase.query.filter_by(buyer_id=user_id).count()
+    purchase_count = totals['purchases']
     if purchase_count >= ACHIEVEMENT_TAGS['dream_collector']['threshold']:
         achievements.append('dream_collector')
     
     # Generous Rater - 100+ ratings given
-    rating_count = Rating.query.filter_by(rater_id=user_id).count()
+    rating_count = totals['ratings_given']
     if rating_count >= ACHIEVEMENT_TAGS['generous_rater']['threshold']:
         achievements.append('generous_rater')
     
@@ -217,26 +223,31 @@ def update_all_user_tags():
     
     return updated_count
 
+@read_only
 def get_users_by_tag(tag_name):
     """Get all users with a specific tag"""
     from models import User
     return User.query.filter_by(dream_tag=tag_name).all()
 
+@read_only
 def get_tag_leaderboard():
     """Get a leaderboard of users grouped by their tags"""
+    from sqlalchemy import select
     from models import User
+    from async_db import gather
     tag_counts = db.session.query(User.dream_tag, func.count(User.id)).filter(User.dream_tag.isnot(None)).group_by(User.dream_tag).all()
+    tag_counts = [(tag, count, info) for tag, count in tag_counts if (info := get_tag_info_by_name(tag))]
     
+    # Sample users for every tag at once: concurrent on the ASGI read path
+    samples = gather(*(select(User).where(User.dream_tag == tag).limit(5) for tag, _, _ in tag_counts))
     leaderboard = []
-    for tag, count in tag_counts:
-        tag_info = get_tag_info_by_name(tag)
-        if tag_info:
-            leaderboard.append({
-                'tag': tag,
-                'info': tag_info,
-                'user_count': count,
-                'users': User.query.filter_by(dream_tag=tag).limit(5).all()
-            })
+    for (tag, count, tag_info), users in zip(tag_counts, samples):
+        leaderboard.append({
+            'tag': tag,
+            'info': tag_info,
+            'user_count': count,
+            'users': users.scalars().all()
+        })
     
     return sorted(leaderboard, key=lambda x: x['user_count'], reverse=True)
 